@@ -2,6 +2,20 @@ import os
 from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from backend.models import db, User_Info, Subject, Chapter, Quiz, Question, Score
+from backend.score_stats import rebuild_user_quiz_stats, init_score_stats
+from backend.submissions import init_score_queue, get_score_queue, submit_score, request_idempotency_key, InvalidSubmission
+from backend.quiz_sessions import init_quiz_sessions
+from backend.events import init_events
+from backend.unread_counts import init_unread_counter
+from backend.notification_retention import compact_notifications
+from backend.reminders import reminder_recipients
+from backend.tasks import send_daily_reminder_batch
+from backend.reports import queue_monthly_reports, monthly_report_message, ReportRow
+from backend.reminders import reminder_message
+from backend.mail_outbox import enqueue_mail, drain_outbox, requeue_dead
+from backend.exports import csv_chunks, write_csv, score_rows, SCORE_COLUMNS
+from backend.caching import init_catalog_versioning, cached_view, conditional_get, versions_validator
+from backend.search import init_search_index, rebuild_search_index
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_caching import Cache
 from flask_cors import CORS
@@ -55,6 +69,29 @@ app.config['MAIL_PORT'] = 587
 app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = 'your-email@gmail.com'  # Update with your email
 app.config['MAIL_PASSWORD'] = 'your-app-password'  # Update with your app password
+# Bulk sends reuse one SMTP connection for up to MAIL_MAX_EMAILS messages,
+# with MAIL_SEND_WORKERS connections in parallel; workers keep a pooled
+# connection open between batches until it is idle for MAIL_POOL_IDLE_TIMEOUT
+app.config['MAIL_MAX_EMAILS'] = 100
+app.config['MAIL_SEND_WORKERS'] = 4
+app.config['MAIL_POOL_IDLE_TIMEOUT'] = 60
+
+# Outbound mail goes through the mail outbox: drained every 15 seconds at up to
+# MAIL_RATE_PER_SECOND (bursts of MAIL_RATE_BURST), retried with exponential
+# backoff and dead-lettered after MAIL_OUTBOX_MAX_ATTEMPTS
+app.config['MAIL_RATE_PER_SECOND'] = 5
+app.config['MAIL_RATE_BURST'] = 20
+app.config['MAIL_OUTBOX_BATCH_SIZE'] = 200
+app.config['MAIL_OUTBOX_MAX_ATTEMPTS'] = 6
+app.config['MAIL_OUTBOX_BACKOFF_SECONDS'] = 30
+app.config['MAIL_OUTBOX_BACKOFF_MAX_SECONDS'] = 3600
+app.config['MAIL_OUTBOX_CLAIM_TIMEOUT'] = 300
+app.config['MAIL_OUTBOX_DRAIN_SECONDS'] = 50
+app.config['MAIL_OUTBOX_RETENTION_DAYS'] = 7
+
+# FLASK_-prefixed environment variables override the settings above,
+# e.g. FLASK_SQLALCHEMY_DATABASE_URI to point the app at another database
+app.config.from_prefixed_env()
 
 # Initialize extensions
 db.init_app(app)
@@ -66,13 +103,94 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "main.signin"
 
-# Configure Flask-Caching with Redis
+# Configure Flask-Caching with Redis, fronted by an in-process LRU tier
 cache = Cache(app, config={
-    'CACHE_TYPE': 'RedisCache',
+    'CACHE_TYPE': 'backend.cache_tiers.TwoTierCache',
     'CACHE_REDIS_URL': 'redis://localhost:6379/1',
-    'CACHE_DEFAULT_TIMEOUT': 300
+    'CACHE_DEFAULT_TIMEOUT': 300,
+    'CACHE_LOCAL_MAX_ENTRIES': 1024,
+    'CACHE_LOCAL_TIMEOUT': 60,
+    'CACHE_VERSION_POLL_INTERVAL': 2,
+    'CACHE_LOCAL_PREFIXES': ('view/', 'version/', 'answer_key/')
 })
 
+# Catalog reads are version-stamped, so they can be cached for hours
+app.config['CATALOG_CACHE_TIMEOUT'] = 6 * 3600
+# Per-endpoint TTL overrides (seconds) for views wrapped in cached_view
+app.config['CACHE_VIEW_TIMEOUTS'] = {}
+# Stampede protection for cached_view: serve the old response for up to
+# CACHE_STALE_TTL seconds while one worker holding a CACHE_LOCK_TIMEOUT lease
+# rebuilds it, and refresh hot entries early (XFetch, 0 disables)
+app.config['CACHE_STALE_TTL'] = 120
+app.config['CACHE_LOCK_TIMEOUT'] = 10
+app.config['CACHE_EARLY_REFRESH_BETA'] = 1.0
+init_catalog_versioning()
+
+# Write-behind score queue: when enabled, quiz submissions are graded and
+# journaled locally, then batch-inserted by a background flusher
+app.config['SCORE_QUEUE_ENABLED'] = False
+app.config['SCORE_QUEUE_PATH'] = os.path.join(BASE_DIR, 'instance', 'score_queue.sqlite3')
+app.config['SCORE_QUEUE_BATCH_SIZE'] = 200
+app.config['SCORE_QUEUE_FLUSH_INTERVAL_MS'] = 250
+# Queued submissions that keep failing are set aside after this many attempts
+app.config['SCORE_QUEUE_MAX_ATTEMPTS'] = 5
+# Attempt tokens handed out with each quiz stay valid for a day
+app.config['ATTEMPT_TOKEN_MAX_AGE'] = 24 * 3600
+
+# CSV exports run by celery are streamed to files in this folder
+app.config['EXPORT_FOLDER'] = os.path.join(BASE_DIR, 'instance', 'exports')
+
+# Timed quiz sessions live in Redis (in-memory fallback); expired sessions are
+# auto-submitted by a sweeper after the grace period
+app.config['QUIZ_SESSION_REDIS_URL'] = 'redis://localhost:6379/2'
+app.config['QUIZ_SESSION_GRACE_SECONDS'] = 5
+app.config['QUIZ_SESSION_SWEEP_INTERVAL'] = 5
+
+# Class-wide notifications for subjects with at least this many enrolled
+# students are stored once per subject (fan-out on read); smaller classes get
+# a copy in every student's notifications, written by a background task.
+# 0 always broadcasts, None always copies
+app.config['NOTIFICATION_BROADCAST_THRESHOLD'] = 200
+
+# Discussion threads are served in keyset pages of this many messages
+app.config['DISCUSSION_PAGE_SIZE'] = 50
+app.config['DISCUSSION_MAX_PAGE_SIZE'] = 200
+
+# Server-Sent Events for notifications and discussions (Redis pub/sub, with an
+# in-process broker fallback); streams close after EVENTS_MAX_STREAM_SECONDS
+# and clients resume with Last-Event-ID
+app.config['EVENTS_REDIS_URL'] = 'redis://localhost:6379/0'
+app.config['EVENTS_HEARTBEAT_SECONDS'] = 15
+app.config['EVENTS_MAX_STREAM_SECONDS'] = 1800
+
+# Unread-notification badge counters (Redis, rebuilt from the database after
+# UNREAD_COUNT_TTL seconds or the next expiry; database counts without Redis)
+app.config['UNREAD_COUNT_REDIS_URL'] = 'redis://localhost:6379/3'
+app.config['UNREAD_COUNT_TTL'] = 3600
+
+# Notification compaction: expired rows and read ones older than the retention
+# are deleted hourly in short batches, at most MAX_ROWS deletions per run
+app.config['NOTIFICATION_READ_RETENTION_DAYS'] = 30
+app.config['NOTIFICATION_COMPACTION_BATCH_SIZE'] = 500
+app.config['NOTIFICATION_COMPACTION_MAX_ROWS'] = 20000
+app.config['NOTIFICATION_COMPACTION_PAUSE_MS'] = 50
+
+# Daily reminders: students without an attempt today are selected with one
+# anti-join and handed to send tasks this many at a time
+app.config['REMINDER_BATCH_SIZE'] = 500
+
+# Periodic tasks run by celery beat
+app.config['CELERYBEAT_SCHEDULE'] = {
+    'compact-notifications': {
+        'task': 'backend.tasks.compact_notifications_task',
+        'schedule': 3600.0,
+    },
+    'drain-mail-outbox': {
+        'task': 'backend.tasks.drain_mail_outbox_task',
+        'schedule': 15.0,
+    },
+}
+
 # Initialize Celery
 celery = Celery('quiz_master', broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
@@ -99,28 +217,11 @@ app.register_blueprint(main_blueprint)
 app.register_blueprint(notification_bp)
 
 # API Routes for VueJS Frontend
-@app.route('/api/subjects', methods=['GET'])
-@cache.cached(timeout=300)
-def api_subjects():
-    """Get all subjects or search subjects by name/description"""
-    search = request.args.get('search', '').strip()
-    if search:
-        subjects = Subject.query.filter(
-            or_(
-                Subject.name.ilike(f'%{search}%'),
-                Subject.description.ilike(f'%{search}%')
-            )
-        ).all()
-    else:
-        subjects = Subject.query.all()
-    return jsonify([{
-        'id': subject.id,
-        'name': subject.name,
-        'description': subject.description
-    } for subject in subjects])
+# GET /api/subjects (optionally ?search=) is served by main.get_subjects
 
 @app.route('/api/subjects/<int:subject_id>/chapters', methods=['GET'])
-@cache.cached(timeout=300)
+@conditional_get(versions_validator("chapter"))
+@cached_view(entities=("chapter",), timeout='CATALOG_CACHE_TIMEOUT')
 def api_chapters(subject_id):
     """Get chapters for a subject"""
     chapters = Chapter.query.filter_by(subject_id=subject_id).all()
@@ -132,7 +233,8 @@ def api_chapters(subject_id):
     } for chapter in chapters])
 
 @app.route('/api/chapters/<int:chapter_id>/quizzes', methods=['GET'])
-@cache.cached(timeout=300)
+@conditional_get(versions_validator("quiz"))
+@cached_view(entities=("quiz",), timeout='CATALOG_CACHE_TIMEOUT')
 def api_quizzes(chapter_id):
     """Get quizzes for a chapter"""
     quizzes = Quiz.query.filter_by(chapter_id=chapter_id).all()
@@ -146,7 +248,8 @@ def api_quizzes(chapter_id):
     } for quiz in quizzes])
 
 @app.route('/api/quizzes/<int:quiz_id>/questions', methods=['GET'])
-@cache.cached(timeout=300)
+@conditional_get(versions_validator("question"))
+@cached_view(entities=("question",), timeout='CATALOG_CACHE_TIMEOUT')
 def api_questions(quiz_id):
     """Get questions for a quiz"""
     questions = Question.query.filter_by(quiz_id=quiz_id).all()
@@ -165,23 +268,27 @@ def api_questions(quiz_id):
 @login_required
 def api_submit_score():
     """Submit quiz score"""
-    data = request.get_json()
-    score = Score(
-        user_id=current_user.id,
-        quiz_id=data['quiz_id'],
-        total_scored=data['total_scored'],
-        time_stamp_of_attempt=datetime.now()
-    )
-    db.session.add(score)
-    db.session.commit()
-    
-    # Clear cache for user scores
-    cache.delete(f'user_scores_{current_user.id}')
+    data = request.get_json(silent=True) or {}
+    if data.get('quiz_id') is None or db.session.get(Quiz, data['quiz_id']) is None:
+        return jsonify({'error': 'Quiz not found'}), 404
+    # Cached user scores are invalidated once the score is written
+    try:
+        submit_score(current_user.id, data['quiz_id'], data.get('total_scored'), data.get('total_questions'),
+                     request_idempotency_key())
+    except InvalidSubmission as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({'message': 'Score submitted successfully'})
 
+def user_scores_validator():
+    """ETag seed for the current user's scores: attempt count and newest score id"""
+    return db.session.query(
+        db.func.count(Score.id), db.func.max(Score.id)
+    ).filter(Score.user_id == current_user.id).one().tuple(), None
+
 @app.route('/api/user/scores', methods=['GET'])
 @login_required
+@conditional_get(user_scores_validator)
 def api_user_scores():
     """Get user scores"""
     cache_key = f'user_scores_{current_user.id}'
@@ -204,54 +311,33 @@ def api_user_scores():
 # Celery Tasks
 @celery.task
 def send_daily_reminder(user_email, user_name):
-    """Send daily reminder to user"""
-    try:
-        msg = Message(
-            'Daily Quiz Reminder',
-            sender='your-email@gmail.com',
-            recipients=[user_email]
-        )
-        msg.body = f"Hello {user_name}! Don't forget to take your daily quiz to improve your knowledge."
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+    """Queue daily reminder for user"""
+    with app.app_context():
+        enqueue_mail([reminder_message(user_email, user_name)], kind="daily_reminder")
+        db.session.commit()
+    return True
 
 @celery.task
 def send_monthly_report(user_email, user_name, report_data):
-    """Send monthly activity report"""
-    try:
-        msg = Message(
-            'Monthly Activity Report',
-            sender='your-email@gmail.com',
-            recipients=[user_email]
-        )
-        msg.html = f"""
-        <h2>Monthly Activity Report for {user_name}</h2>
-        <p>Quizzes taken: {report_data['quizzes_taken']}</p>
-        <p>Average score: {report_data['average_score']}%</p>
-        <p>Total score: {report_data['total_score']}</p>
-        """
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending monthly report: {e}")
-        return False
+    """Queue monthly activity report"""
+    row = ReportRow(user_email, user_name, report_data['quizzes_taken'],
+                    report_data['average_score'], report_data['total_score'])
+    with app.app_context():
+        enqueue_mail([monthly_report_message(row)], kind="monthly_report")
+        db.session.commit()
+    return True
 
 @celery.task
 def export_user_csv(user_id):
-    """Export user quiz data as CSV"""
+    """Export user quiz data as CSV, streamed to a file in EXPORT_FOLDER"""
     try:
-        scores = Score.query.filter_by(user_id=user_id).all()
-        # Generate CSV content
-        csv_content = "quiz_id,chapter_id,date_of_quiz,score,remarks\n"
-        for score in scores:
-            quiz = Quiz.query.get(score.quiz_id)
-            csv_content += f"{score.quiz_id},{quiz.chapter_id},{quiz.date_of_quiz},{score.total_scored},{quiz.remarks}\n"
-        
-        # Save to file or send via email
-        return csv_content
+        filename = os.path.join(
+            app.config['EXPORT_FOLDER'],
+            f"quiz_data_user_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        with app.app_context():
+            write_csv(filename, csv_chunks(SCORE_COLUMNS, score_rows(user_id)))
+        return filename
     except Exception as e:
         print(f"Error exporting CSV: {e}")
         return None
@@ -259,46 +345,80 @@ def export_user_csv(user_id):
 # Scheduled Jobs
 @celery.task
 def daily_reminders():
-    """Send daily reminders to all users"""
-    users = User_Info.query.filter_by(role=1).all()  # Only regular users
-    for user in users:
-        # Check if user hasn't taken a quiz today
-        today = datetime.now().date()
-        recent_score = Score.query.filter(
-            Score.user_id == user.id,
-            Score.time_stamp_of_attempt >= today
-        ).first()
-        
-        if not recent_score:
-            send_daily_reminder.delay(user.email, user.full_name)
+    """Send daily reminders to all users who haven't taken a quiz today"""
+    with app.app_context():
+        for recipients in reminder_recipients(datetime.now().date(), app.config['REMINDER_BATCH_SIZE']):
+            send_daily_reminder_batch.delay(recipients)
 
 @celery.task
 def monthly_reports():
-    """Generate and send monthly reports"""
-    users = User_Info.query.filter_by(role=1).all()
-    for user in users:
-        # Get last month's data
-        last_month = datetime.now() - timedelta(days=30)
-        scores = Score.query.filter(
-            Score.user_id == user.id,
-            Score.time_stamp_of_attempt >= last_month
-        ).all()
-        
-        if scores:
-            total_score = sum(score.total_scored for score in scores)
-            average_score = total_score / len(scores)
-            
-            report_data = {
-                'quizzes_taken': len(scores),
-                'average_score': round(average_score, 2),
-                'total_score': total_score
-            }
-            
-            send_monthly_report.delay(user.email, user.full_name, report_data)
+    """Generate monthly reports and queue them in the mail outbox"""
+    with app.app_context():
+        queued = queue_monthly_reports()
+        db.session.commit()
+    print(f"Monthly reports queued for {queued} users")
+
+# CLI: backfill the per-user/per-quiz score rollup from Score history
+@app.cli.command("rebuild-score-stats")
+def rebuild_score_stats_command():
+    """Rebuild the UserQuizStats rollup from all recorded scores"""
+    rows = rebuild_user_quiz_stats()
+    print(f"Rebuilt score stats for {rows} user/quiz pairs")
+
+# CLI: repopulate the full-text search index from the source tables
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuild the FTS5 search index"""
+    rows = rebuild_search_index()
+    print(f"Indexed {rows} rows for full-text search")
+
+# CLI: drain the write-behind score queue
+@app.cli.command("flush-score-queue")
+def flush_score_queue_command():
+    """Insert every pending queued score submission now"""
+    queue = get_score_queue()
+    if queue is None:
+        print("Score queue is disabled (SCORE_QUEUE_ENABLED)")
+        return
+    print(f"Flushed {queue.flush_all()} queued score submissions")
+
+# CLI: send due messages from the mail outbox
+@app.cli.command("drain-mail-outbox")
+def drain_mail_outbox_command():
+    """Send due outbox messages now, within the rate limit"""
+    batches = drain_outbox(app, mail, max_seconds=app.config['MAIL_OUTBOX_DRAIN_SECONDS'])
+    print(f"Sent {sum(batch['sent'] for batch in batches)} messages in {len(batches)} batches")
+
+# CLI: give dead-lettered outbox messages another round of attempts
+@app.cli.command("requeue-dead-mail")
+def requeue_dead_mail_command():
+    """Move every dead-lettered outbox message back to pending"""
+    requeued = requeue_dead()
+    db.session.commit()
+    print(f"Requeued {requeued} dead-lettered messages")
+
+# CLI: run one notification compaction pass
+@app.cli.command("compact-notifications")
+def compact_notifications_command():
+    """Delete expired and old read notifications now"""
+    report = compact_notifications(
+        read_retention_days=app.config['NOTIFICATION_READ_RETENTION_DAYS'],
+        batch_size=app.config['NOTIFICATION_COMPACTION_BATCH_SIZE'],
+        max_rows=app.config['NOTIFICATION_COMPACTION_MAX_ROWS'],
+        pause=app.config['NOTIFICATION_COMPACTION_PAUSE_MS'] / 1000.0
+    )
+    print(f"Removed {report['notifications']} notifications, {report['broadcasts']} broadcasts and "
+          f"{report['receipts']} receipts in {report['batches']} batches")
 
 def initialize_database():
     with app.app_context():
         db.create_all()
+        init_search_index(app)
+        init_score_stats(app)
+        init_score_queue(app)
+        init_quiz_sessions(app)
+        init_events(app)
+        init_unread_counter(app)
         # Check if admin exists (role=0)
         admin_email = "admin@quizmaster.com"
         admin = User_Info.query.filter_by(role=0).first()
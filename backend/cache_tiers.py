@@ -0,0 +1,261 @@
+"""Two-tier cache backend: an in-process LRU/TTL tier in front of Redis.
+
+Small, hot entries (catalog listings, version counters) are served from
+process memory; everything else and every miss falls through to the remote
+backend. Writes go to the remote tier and are broadcast over Redis pub/sub so
+other workers evict their local copies. When pub/sub is unavailable, version
+counters are only held locally for ``version_poll_interval`` seconds, so other
+workers pick up bumps by polling. Version-stamped keys never change content,
+which keeps them safe to hold locally for longer.
+
+Use it as a Flask-Caching backend with
+``CACHE_TYPE = "backend.cache_tiers.TwoTierCache"``; it reads the usual
+``CACHE_REDIS_*`` settings plus the ``CACHE_LOCAL_*`` options in ``factory``.
+"""
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+
+class LocalLRUCache:
+    """Thread-safe, size-bounded LRU map with per-entry expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TwoTierCache(BaseCache):
+    """Local LRU tier in front of a remote cachelib backend (normally RedisCache).
+
+    :param remote: the shared backend every read falls back to
+    :param redis_client: redis client used for pub/sub invalidation (optional)
+    :param local_max_entries: size bound of the in-process tier
+    :param local_timeout: longest time an entry is held locally, in seconds
+    :param local_prefixes: only keys with one of these prefixes use the local tier
+    :param version_prefix: prefix of version counter keys
+    :param version_poll_interval: local TTL of version counters without pub/sub
+    :param channel: pub/sub channel used for cross-worker invalidation
+    """
+
+    def __init__(self, remote, redis_client=None, default_timeout=300,
+                 local_max_entries=1024, local_timeout=60,
+                 local_prefixes=("view/", "version/"), version_prefix="version/",
+                 version_poll_interval=2, channel="cache-invalidation"):
+        super().__init__(default_timeout=default_timeout)
+        self.remote = remote
+        self.redis_client = redis_client
+        self.local = LocalLRUCache(local_max_entries)
+        self.local_timeout = local_timeout
+        self.local_prefixes = tuple(local_prefixes)
+        self.version_prefix = version_prefix
+        self.version_poll_interval = version_poll_interval
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.invalidation_mode = "polling"
+        self.counters = {"local_hits": 0, "local_misses": 0, "remote_hits": 0, "remote_misses": 0,
+                         "invalidations_sent": 0, "invalidations_received": 0}
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        remote = RedisCache.factory(app, config, args, dict(kwargs))
+        return cls(
+            remote,
+            redis_client=remote._write_client,
+            default_timeout=kwargs.get("default_timeout", 300),
+            local_max_entries=config.get("CACHE_LOCAL_MAX_ENTRIES", 1024),
+            local_timeout=config.get("CACHE_LOCAL_TIMEOUT", 60),
+            local_prefixes=config.get("CACHE_LOCAL_PREFIXES", ("view/", "version/")),
+            version_poll_interval=config.get("CACHE_VERSION_POLL_INTERVAL", 2),
+            channel=config.get("CACHE_INVALIDATION_CHANNEL", "cache-invalidation"),
+        )
+
+    # Local tier helpers
+
+    def _is_local(self, key):
+        return key.startswith(self.local_prefixes)
+
+    def _local_ttl(self, key, timeout=None):
+        ttl = self.local_timeout
+        if key.startswith(self.version_prefix) and self.invalidation_mode != "pubsub":
+            ttl = min(ttl, self.version_poll_interval)
+        timeout = self._normalize_timeout(timeout)
+        return min(ttl, timeout) if timeout else ttl
+
+    def _store_local(self, key, value, timeout=None):
+        if self._is_local(key):
+            self.local.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_ttl(key, timeout))
+
+    # Cross-worker invalidation
+
+    def _ensure_listener(self):
+        """Start the pub/sub listener once per process (workers may be forked)"""
+        if self.redis_client is None or self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self.invalidation_mode = "polling"
+            self.local.clear()
+            threading.Thread(target=self._listen, name="cache-invalidation", daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.invalidation_mode = "pubsub"
+                for message in pubsub.listen():
+                    self._handle_invalidation(message)
+            except Exception:
+                pass
+            # Messages may have been missed while disconnected
+            self.invalidation_mode = "polling"
+            self.local.clear()
+            time.sleep(self.version_poll_interval)
+
+    def _handle_invalidation(self, message):
+        if not message or message.get("type") != "message":
+            return
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        origin, _, key = data.partition(":")
+        if origin == self.origin:
+            return
+        self.counters["invalidations_received"] += 1
+        if key == "*":
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    def _publish(self, key):
+        if self.redis_client is None:
+            return
+        if key != "*" and not self._is_local(key):
+            return
+        try:
+            self.redis_client.publish(self.channel, f"{self.origin}:{key}")
+            self.counters["invalidations_sent"] += 1
+        except Exception as e:
+            print(f"Error publishing cache invalidation for {key}: {e}")
+
+    # cachelib interface
+
+    def get(self, key):
+        self._ensure_listener()
+        if self._is_local(key):
+            payload = self.local.get(key)
+            if payload is not None:
+                self.counters["local_hits"] += 1
+                return pickle.loads(payload)
+            self.counters["local_misses"] += 1
+        value = self.remote.get(key)
+        if value is None:
+            self.counters["remote_misses"] += 1
+            return None
+        self.counters["remote_hits"] += 1
+        self._store_local(key, value)
+        return value
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def has(self, key):
+        return (self._is_local(key) and self.local.get(key) is not None) or self.remote.has(key)
+
+    def set(self, key, value, timeout=None):
+        result = self.remote.set(key, value, timeout)
+        self._store_local(key, value, timeout)
+        self._publish(key)
+        return result
+
+    def add(self, key, value, timeout=None):
+        added = self.remote.add(key, value, timeout)
+        if added:
+            self._store_local(key, value, timeout)
+        return added
+
+    def delete(self, key):
+        self.local.delete(key)
+        result = self.remote.delete(key)
+        self._publish(key)
+        return result
+
+    def delete_many(self, *keys):
+        return [key for key in keys if self.delete(key)]
+
+    def inc(self, key, delta=1):
+        value = self.remote.inc(key, delta)
+        if value is not None:
+            self._store_local(key, value)
+        self._publish(key)
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def clear(self):
+        self.local.clear()
+        result = self.remote.clear()
+        self._publish("*")
+        return result
+
+    def stats(self):
+        """Hit/miss counters per tier plus the current invalidation mode"""
+        return {
+            "local": {
+                "hits": self.counters["local_hits"],
+                "misses": self.counters["local_misses"],
+                "entries": len(self.local),
+                "max_entries": self.local.max_entries,
+            },
+            "remote": {
+                "hits": self.counters["remote_hits"],
+                "misses": self.counters["remote_misses"],
+            },
+            "invalidation": {
+                "mode": self.invalidation_mode,
+                "sent": self.counters["invalidations_sent"],
+                "received": self.counters["invalidations_received"],
+            },
+        }
@@ -0,0 +1,333 @@
+"""Version-stamped caching for catalog reads.
+
+Each catalog entity type (subject, chapter, quiz, question) has a generation
+counter stored in the cache. Cache keys for catalog reads embed the current
+counters of every entity type they depend on, and any committed write to one of
+those models bumps its counter. Old entries are never read again and simply
+age out, so catalog responses can be cached for hours while edits still show up
+on the next request.
+
+The same versions (or cheap max/count queries) also back strong ETags, so
+conditional GETs can be answered with 304 without building the body.
+"""
+import time
+import math
+import random
+import hashlib
+import uuid
+from datetime import timezone
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, has_app_context, request, make_response
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .models import Subject, Chapter, Quiz, Question
+
+CATALOG_ENTITIES = {
+    Subject: "subject",
+    Chapter: "chapter",
+    Quiz: "quiz",
+    Question: "question",
+}
+
+# Deleting a parent cascades to these child entity types
+CASCADED_ENTITIES = {
+    "subject": ("chapter", "quiz", "question"),
+    "chapter": ("quiz", "question"),
+    "quiz": ("question",),
+    "question": (),
+}
+
+VERSION_KEY = "version/{}"
+
+
+def quiz_scope(quiz_id):
+    """Per-quiz version for reads of a single quiz's questions, such as answer keys"""
+    return f"quiz:{int(quiz_id)}"
+
+
+def get_cache():
+    """Return the Flask-Caching ``Cache`` registered on the current app"""
+    return next(iter(current_app.extensions["cache"]))
+
+
+def get_versions(*entities):
+    """Current generation counters for the given entity types"""
+    backend = get_cache().cache
+    keys = [VERSION_KEY.format(entity) for entity in entities]
+    versions = list(backend.get_many(*keys))
+    for i, (key, version) in enumerate(zip(keys, versions)):
+        if version is None:
+            # Seed from the clock so a lost counter never reuses an old generation
+            backend.add(key, int(time.time() * 1000), timeout=0)
+            versions[i] = backend.get(key)
+    return tuple(versions)
+
+
+def bump_versions(*entities):
+    """Invalidate every cached read that depends on the given entity types"""
+    backend = get_cache().cache
+    for entity in entities:
+        key = VERSION_KEY.format(entity)
+        if backend.get(key) is None:
+            get_versions(entity)
+        backend.inc(key)
+
+
+def versioned_key(prefix, *entities):
+    """Build a cache key that changes whenever one of the entity types is written"""
+    versions = get_versions(*entities)
+    stamp = ".".join(f"{entity}{version}" for entity, version in zip(entities, versions))
+    return f"{prefix}@{stamp}"
+
+
+def current_principal():
+    """(user_id, role) of the caller, from the JWT payload or the login session"""
+    payload = getattr(request, "user", None)
+    if payload:
+        return payload.get("user_id"), payload.get("role")
+    if current_user and current_user.is_authenticated:
+        return current_user.id, current_user.role
+    return None, None
+
+
+def view_cache_key(entities=(), vary_on_query=True, vary_on_role=False, vary_on_user=False):
+    """Cache key for the current request.
+
+    Always includes the endpoint and path; optionally the sorted query string,
+    the caller's role or user id, and the versions of the entity types the view
+    reads.
+    """
+    parts = [f"view/{request.endpoint}{request.path}"]
+    if vary_on_query and request.args:
+        # Encoded, so "a=x%26b%3D1" and "a=x&b=1" cannot share a key
+        query = urlencode(sorted(request.args.items(multi=True)))
+        parts.append("q=" + hashlib.md5(query.encode("utf-8")).hexdigest())
+    if vary_on_role or vary_on_user:
+        user_id, role = current_principal()
+        if vary_on_role:
+            parts.append(f"role={role}")
+        if vary_on_user:
+            parts.append(f"user={user_id}")
+    key = "|".join(parts)
+    return versioned_key(key, *entities) if entities else key
+
+
+def view_timeout(timeout=None, query_timeout=None):
+    """TTL for the current request, honouring per-endpoint CACHE_VIEW_TIMEOUTS overrides"""
+    if request.args and query_timeout is not None:
+        timeout = query_timeout
+    if isinstance(timeout, str):
+        timeout = current_app.config[timeout]
+    overrides = current_app.config.get("CACHE_VIEW_TIMEOUTS", {})
+    return overrides.get(request.endpoint, timeout)
+
+
+def _stampede_setting(value, config_key, default):
+    return value if value is not None else current_app.config.get(config_key, default)
+
+
+def _refresh_due(envelope, beta, now):
+    """Soft expiry reached, or XFetch decided to refresh early.
+
+    XFetch refreshes with a probability that grows as expiry approaches and
+    with how long the value took to compute, so one request usually rebuilds
+    the entry before it goes stale.
+    """
+    expires_at = envelope["expires_at"]
+    if expires_at is None:
+        return False
+    if now >= expires_at:
+        return True
+    if beta <= 0:
+        return False
+    return now - envelope["delta"] * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _wait_for_fill(cache, key, lease_key, wait):
+    """Poll for another worker's result while it holds the lease"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope
+        if not cache.has(lease_key):
+            break
+    return None
+
+
+def cached_view(entities=(), timeout=None, query_timeout=None,
+                vary_on_query=True, vary_on_role=False, vary_on_user=False,
+                stale_ttl=None, lock_timeout=None, early_refresh_beta=None):
+    """Cache successful responses of a view, with single-flight recomputation.
+
+    Place it below authentication decorators so the caller is known when the
+    key is built. ``timeout`` is the TTL in seconds or the name of a config key
+    holding it (the cache default if None), ``query_timeout`` replaces it for
+    requests with a query string, and both can be overridden per endpoint with
+    the ``CACHE_VIEW_TIMEOUTS`` app config.
+
+    Only the worker holding a short lease (``cache.add`` on a lock key) rebuilds
+    an entry. After the TTL the old response is kept for ``stale_ttl`` more
+    seconds and served to everyone else while the rebuild runs; on a cold miss
+    the others wait up to ``lock_timeout`` seconds for the result.
+    ``early_refresh_beta`` > 0 enables probabilistic early refresh (XFetch).
+    The three stampede settings default to the ``CACHE_STALE_TTL``,
+    ``CACHE_LOCK_TIMEOUT`` and ``CACHE_EARLY_REFRESH_BETA`` app config.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            cache = get_cache()
+            key = view_cache_key(entities, vary_on_query, vary_on_role, vary_on_user)
+            lease_key = f"lock/{key}"
+            grace = _stampede_setting(stale_ttl, "CACHE_STALE_TTL", 60)
+            lease_timeout = _stampede_setting(lock_timeout, "CACHE_LOCK_TIMEOUT", 10)
+            beta = _stampede_setting(early_refresh_beta, "CACHE_EARLY_REFRESH_BETA", 0)
+
+            envelope = cache.get(key)
+            if envelope is not None and not _refresh_due(envelope, beta, time.time()):
+                return _cached_response(envelope)
+
+            token = uuid.uuid4().hex
+            leased = cache.add(lease_key, token, timeout=lease_timeout)
+            if not leased:
+                if envelope is None:
+                    envelope = _wait_for_fill(cache, key, lease_key, lease_timeout)
+                if envelope is not None:
+                    return _cached_response(envelope)
+
+            try:
+                started = time.time()
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    ttl = view_timeout(timeout, query_timeout)
+                    if ttl is None:
+                        ttl = cache.cache.default_timeout
+                    now = time.time()
+                    cache.set(key, {
+                        "response": (response.get_data(), response.status_code, response.mimetype),
+                        "delta": now - started,
+                        "expires_at": now + ttl if ttl else None,
+                    }, timeout=ttl + grace if ttl else 0)
+                return response
+            finally:
+                if leased and cache.get(lease_key) == token:
+                    cache.delete(lease_key)
+        return decorated
+    return decorator
+
+
+def _cached_response(envelope):
+    body, status, mimetype = envelope["response"]
+    return current_app.response_class(body, status=status, mimetype=mimetype)
+
+
+def versions_validator(*entities):
+    """Conditional GET validator for views whose body only depends on catalog versions"""
+    def validator(*args, **kwargs):
+        return view_cache_key(entities), None
+    return validator
+
+
+def conditional_get(validator):
+    """Answer conditional GETs with 304 before the view builds its body.
+
+    ``validator`` receives the view arguments and returns ``(seed, last_modified)``
+    from cheap queries (entity versions, max ``updated_at``, row counts), or
+    None to skip conditional handling, e.g. when the caller may not see the
+    resource. The seed, endpoint, path and query string are hashed into a strong
+    ETag. ``If-None-Match`` takes precedence over ``If-Modified-Since``; only
+    return a ``last_modified`` that advances on every change to the body
+    (deletes included), else None. Place it below authentication decorators and
+    above ``cached_view``.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return f(*args, **kwargs)
+            validated = validator(*args, **kwargs)
+            if validated is None:
+                return f(*args, **kwargs)
+            seed, last_modified = validated
+            etag = hashlib.md5(
+                repr((request.endpoint, request.full_path, seed)).encode("utf-8")
+            ).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified is not None and last_modified <= since
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated
+    return decorator
+
+
+def _changed_entities(session):
+    return session.info.setdefault("changed_catalog_entities", set())
+
+
+def _changed_quizzes(obj):
+    """Quizzes whose questions a Question or Quiz write touches, old and new parent included"""
+    if isinstance(obj, Quiz):
+        return [obj.id]
+    if isinstance(obj, Question):
+        history = inspect(obj).attrs.quiz_id.history
+        return list(history.deleted) + [obj.quiz_id]
+    return []
+
+
+def _collect_catalog_changes(session, flush_context, instances):
+    changed = _changed_entities(session)
+    for obj in list(session.new) + list(session.dirty):
+        entity = CATALOG_ENTITIES.get(type(obj))
+        if entity:
+            changed.add(entity)
+            if entity == "question":
+                changed.update(quiz_scope(quiz_id) for quiz_id in _changed_quizzes(obj) if quiz_id is not None)
+    for obj in session.deleted:
+        entity = CATALOG_ENTITIES.get(type(obj))
+        if entity:
+            changed.add(entity)
+            changed.update(CASCADED_ENTITIES[entity])
+            changed.update(quiz_scope(quiz_id) for quiz_id in _changed_quizzes(obj) if quiz_id is not None)
+
+
+def _bump_after_commit(session):
+    changed = session.info.pop("changed_catalog_entities", None)
+    if not changed or not has_app_context():
+        return
+    try:
+        bump_versions(*sorted(changed))
+    except Exception as e:
+        print(f"Error bumping catalog cache versions: {e}")
+
+
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop("changed_catalog_entities", None)
+
+
+def init_catalog_versioning():
+    """Bump catalog versions whenever a transaction touching catalog models commits"""
+    if not event.contains(Session, "before_flush", _collect_catalog_changes):
+        event.listen(Session, "before_flush", _collect_catalog_changes)
+        event.listen(Session, "after_commit", _bump_after_commit)
+        event.listen(Session, "after_soft_rollback", _discard_after_rollback)
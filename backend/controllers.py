@@ -1,5 +1,5 @@
 # App routes
-from flask import Flask, render_template, request, url_for, redirect, current_app, Blueprint, send_from_directory, session
+from flask import Flask, render_template, request, url_for, redirect, current_app, Blueprint, send_from_directory, session, abort
 from .models import *
 from datetime import datetime
 from sqlalchemy import func
@@ -16,6 +16,16 @@ import jwt
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import timedelta
 from .tasks import daily_reminder_task, monthly_report_task, export_csv_task
+from .progress import load_subjects, apply_progress
+from .grading import get_answer_key, grade_form, grade_answers
+from .submissions import submit_score, submission_key, issue_attempt_token, find_submission, InvalidAttemptToken
+from .quiz_sessions import get_quiz_sessions
+from .caching import cached_view, get_cache, get_versions, conditional_get, versions_validator
+from .discussions import requested_discussion_page
+from .unread_counts import reset_unread
+from .mail_outbox import outbox_stats, requeue_dead
+from .exports import csv_chunks, csv_response, score_rows, user_rows, SCORE_COLUMNS, USER_COLUMNS
+from .search import full_text_search, search_ids, load_ranked, subject_ids_for, INDEXED_ENTITIES, SEARCH_RESULT_LIMIT
 from sqlalchemy.exc import SQLAlchemyError
 
 from .models import Course, Teacher, TeacherSubject, Discussion, ChapterMaterial, Branch
@@ -46,10 +56,6 @@ def decode_jwt_token(token):
     except jwt.InvalidTokenError:
         return None
 
-# Get cache from current app
-def get_cache():
-    return current_app.extensions['cache']
-
 @main.route("/")
 def home():
     # Show available courses on homepage for students/guests
@@ -522,6 +528,7 @@ def enroll_in_subject(user_id, subject_id):
         enrollment = UserEnrollment(user_id=user_id, subject_id=subject_id)
         db.session.add(enrollment)
         db.session.commit()
+        reset_unread(user_id)
     
     return redirect(url_for("main.course_registration", user_id=user_id))
 
@@ -542,6 +549,7 @@ def unenroll_from_subject(user_id, subject_id):
     if enrollment:
         enrollment.is_active = False
         db.session.commit()
+        reset_unread(user_id)
     
     return redirect(url_for("main.course_registration", user_id=user_id))
 
@@ -608,29 +616,25 @@ def add_question(quiz_id, name):
 # Attempt quiz (user only)
 @main.route("/quiz/<quiz_id>/<user_id>", methods=["GET", "POST"])
 def attempt_quiz(quiz_id, user_id):
+    if request.method == "POST":
+        # Same check as the JSON submit paths, so no score is recorded for a missing quiz
+        Quiz.query.get_or_404(quiz_id)
+        answer_key = get_answer_key(quiz_id)
+        if answer_key is None:
+            abort(404)
+        try:
+            idempotency_key = submission_key(user_id, quiz_id)
+        except InvalidAttemptToken:
+            abort(400)
+        result = submit_score(user_id, quiz_id, grade_form(answer_key, request.form), len(answer_key.answers),
+                              idempotency_key)
+        return redirect(url_for("main.quiz_results", quiz_id=quiz_id, user_id=user_id, score=result.total_scored, total=result.total_questions))
+
     quiz = Quiz.query.get(quiz_id)
     questions = Question.query.filter_by(quiz_id=quiz_id).all()
     user = User_Info.query.get(user_id)
-
-    if request.method == "POST":
-        total_score = 0
-        for question in questions:
-            selected_option = request.form.get(f"question_{question.id}")
-            selected_option = str(selected_option).strip().lower() if selected_option else ""
-            correct_option = str(question.correct_option).strip().lower()
-            # If correct_option is "option1", "option2", etc., map to the actual answer text
-            if correct_option in ["option1", "option2", "option3", "option4"]:
-                correct_option_text = str(getattr(question, correct_option, "")).strip().lower()
-            else:
-                correct_option_text = correct_option
-            if selected_option == correct_option_text:
-                total_score += 1
-        score = Score(user_id=user_id, quiz_id=quiz_id, total_scored=total_score, time_stamp_of_attempt=datetime.now())
-        db.session.add(score)
-        db.session.commit()
-        return redirect(url_for("main.quiz_results", quiz_id=quiz_id, user_id=user_id, score=total_score, total=len(questions)))
-
-    return render_template("quiz.html", quiz=quiz, questions=questions, user_id=user_id, user=user)
+    return render_template("quiz.html", quiz=quiz, questions=questions, user_id=user_id, user=user,
+                           attempt_token=issue_attempt_token(user_id, quiz_id))
 
 # ---------------- Discussion Forum (Student & Teacher) ----------------
 
@@ -753,9 +757,9 @@ def search(name):
     if request.method == "POST":
         search_text = request.form.get("search_text")
         # Search for subjects
-        subjects = Subject.query.filter(Subject.name.ilike(f"%{search_text}%")).all()
+        subjects = load_ranked(Subject, search_ids(search_text, "subject"))
         # Search for chapters
-        chapters = Chapter.query.filter(Chapter.name.ilike(f"%{search_text}%")).all()
+        chapters = load_ranked(Chapter, search_ids(search_text, "chapter"))
         return render_template("admin_dashboard.html", name=name, subjects=subjects, chapters=chapters, search_text=search_text)
     return redirect(url_for("main.admin_dashboard", name=name))
 
@@ -767,30 +771,13 @@ def user_search(id, name):
         search_text = request.form.get("search_text")
         user = User_Info.query.get(id)
         
-        # Get all subjects and filter based on search
-        all_subjects = Subject.query.all()
-        filtered_subjects = []
+        # Rank subjects by their own, their chapters' and their quizzes' matches
+        matches = full_text_search(search_text, ["subject", "chapter", "quiz"], limit=200)
+        subject_ids = subject_ids_for(matches)
+        subjects_by_id = {s.id: s for s in load_subjects(Subject.id.in_(subject_ids))}
+        filtered_subjects = [subjects_by_id[i] for i in subject_ids if i in subjects_by_id]
         
-        for subject in all_subjects:
-            # Check if subject name matches search
-            subject_matches = search_text.lower() in subject.name.lower()
-            
-            # Check if any chapter in this subject matches search
-            chapters_match = False
-            for chapter in subject.chapters:
-                if search_text.lower() in chapter.name.lower():
-                    chapters_match = True
-                    break
-                
-                # Check if any quiz in this chapter matches search
-                for quiz in chapter.quizzes:
-                    if search_text.lower() in quiz.name.lower():
-                        chapters_match = True
-                        break
-            
-            # If subject, chapter, or quiz matches, include this subject
-            if subject_matches or chapters_match:
-                filtered_subjects.append(subject)
+        apply_progress(id, filtered_subjects)
         
         from datetime import datetime
         return render_template(
@@ -1012,8 +999,15 @@ def list_courses():
 # --- Subject CRUD ---
 @main.route("/api/subjects", methods=["GET"])
 @jwt_required
+@conditional_get(versions_validator("subject"))
+@cached_view(entities=("subject",), timeout="CATALOG_CACHE_TIMEOUT", query_timeout=600)
 def get_subjects():
-    subjects = Subject.query.all()
+    """All subjects, or those matching ?search= on name and description, best match first"""
+    search = request.args.get("search", "").strip()
+    if search:
+        subjects = load_ranked(Subject, search_ids(search, "subject"))
+    else:
+        subjects = Subject.query.all()
     return jsonify([
         {"id": s.id, "name": s.name, "description": s.description} for s in subjects
     ])
@@ -1059,6 +1053,8 @@ def api_delete_subject(subject_id):
 # --- Chapter CRUD ---
 @main.route("/api/chapters", methods=["GET"])
 @jwt_required
+@conditional_get(versions_validator("chapter"))
+@cached_view(entities=("chapter",), timeout="CATALOG_CACHE_TIMEOUT")
 def get_chapters():
     chapters = Chapter.query.all()
     return jsonify([
@@ -1107,6 +1103,8 @@ def api_delete_chapter(chapter_id):
 # --- Quiz CRUD ---
 @main.route("/api/quizzes", methods=["GET"])
 @jwt_required
+@conditional_get(versions_validator("quiz"))
+@cached_view(entities=("quiz",), timeout="CATALOG_CACHE_TIMEOUT")
 def get_quizzes():
     quizzes = Quiz.query.all()
     return jsonify([
@@ -1166,6 +1164,8 @@ def api_delete_quiz(quiz_id):
 # --- Question CRUD ---
 @main.route("/api/questions", methods=["GET"])
 @jwt_required
+@conditional_get(versions_validator("question"))
+@cached_view(entities=("question",), timeout="CATALOG_CACHE_TIMEOUT")
 def get_questions():
     questions = Question.query.all()
     return jsonify([
@@ -1246,17 +1246,32 @@ def api_profile():
         "pin_code": user.pin_code
     })
 
+# --- Full-Text Search API ---
+# Ranked full-text search across the catalog
+@main.route("/api/search", methods=["GET"])
+@jwt_required
+def api_search():
+    """Search subjects, chapters, quizzes and questions (users too for admins)"""
+    search_text = request.args.get("q", "").strip()
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    allowed_types = [t for t in INDEXED_ENTITIES if t != "user" or request.user["role"] == 0]
+    requested = request.args.get("type")
+    entity_types = [t for t in requested.split(",") if t in allowed_types] if requested else allowed_types
+    if not search_text or not entity_types:
+        return jsonify([])
+    return jsonify([
+        {"type": entity_type, "id": entity_id}
+        for entity_type, entity_id in full_text_search(search_text, entity_types, limit)
+    ])
+
 # --- User Quiz Endpoints ---
 
 # List all available quizzes (with subject/chapter info)
 @main.route("/api/user/quizzes", methods=["GET"])
 @jwt_required
+@conditional_get(versions_validator("quiz", "chapter", "subject"))
+@cached_view(entities=("quiz", "chapter", "subject"), timeout="CATALOG_CACHE_TIMEOUT")
 def user_list_quizzes():
-    cache = get_cache()
-    cached_result = cache.get('user_quizzes')
-    if cached_result:
-        return jsonify(cached_result)
-    
     quizzes = Quiz.query.all()
     result = []
     for q in quizzes:
@@ -1272,7 +1287,6 @@ def user_list_quizzes():
             "subject": {"id": subject.id, "name": subject.name} if subject else None
         })
     
-    cache.set('user_quizzes', result, timeout=300)
     return jsonify(result)
 
 # Get quiz details (questions, options)
@@ -1289,6 +1303,7 @@ def user_quiz_detail(quiz_id):
         "date_of_quiz": quiz.date_of_quiz.isoformat(),
         "time_duration": quiz.time_duration,
         "remarks": quiz.remarks,
+        "attempt_token": issue_attempt_token(request.user["user_id"], quiz.id),
         "questions": [
             {
                 "id": q.id,
@@ -1309,29 +1324,100 @@ def user_attempt_quiz(quiz_id):
     quiz = Quiz.query.get(quiz_id)
     if not quiz:
         return jsonify({"error": "Quiz not found"}), 404
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
     data = request.get_json()
     answers = data.get("answers")  # {question_id: selected_option}
     if not answers or not isinstance(answers, dict):
         return jsonify({"error": "Answers must be provided as a dict"}), 400
-    total_score = 0
-    for q in questions:
-        selected = answers.get(str(q.id)) or answers.get(q.id)
-        if selected and selected == q.correct_option:
-            total_score += 1
-    # Record the attempt
-    score = Score(user_id=user_id, quiz_id=quiz_id, total_scored=total_score, time_stamp_of_attempt=datetime.now())
-    db.session.add(score)
-    db.session.commit()
+    answer_key = get_answer_key(quiz_id)
+    if answer_key is None:
+        return jsonify({"error": "Quiz not found"}), 404
+    try:
+        idempotency_key = submission_key(user_id, quiz_id)
+    except InvalidAttemptToken as e:
+        return jsonify({"error": str(e)}), 400
+    # Record the attempt (a retried attempt token returns the original result)
+    result = submit_score(user_id, quiz_id, grade_answers(answer_key, answers), len(answer_key.answers),
+                          idempotency_key)
     return jsonify({
         "message": "Quiz submitted",
-        "total_scored": total_score,
-        "total_questions": len(questions)
+        "total_scored": result.total_scored,
+        "total_questions": result.total_questions
     })
 
+# --- Timed Quiz Sessions ---
+
+# Start (or resume) a timed attempt of a quiz
+@main.route("/api/user/quizzes/<int:quiz_id>/session", methods=["POST"])
+@jwt_required
+def user_start_quiz_session(quiz_id):
+    quiz = Quiz.query.get(quiz_id)
+    if not quiz:
+        return jsonify({"error": "Quiz not found"}), 404
+    return jsonify(get_quiz_sessions().start(request.user["user_id"], quiz)), 201
+
+# Current state of a session: remaining time and saved answers
+@main.route("/api/user/quiz_sessions/<session_id>", methods=["GET"])
+@jwt_required
+def user_quiz_session(session_id):
+    sessions = get_quiz_sessions()
+    session = sessions.get(session_id, request.user["user_id"])
+    if not session:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify(sessions.state(session))
+
+# Autosave partial answers ({question_id: selected_option})
+@main.route("/api/user/quiz_sessions/<session_id>/answers", methods=["PATCH"])
+@jwt_required
+def user_autosave_quiz_session(session_id):
+    sessions = get_quiz_sessions()
+    session = sessions.get(session_id, request.user["user_id"])
+    if not session:
+        return jsonify({"error": "Session not found"}), 404
+    answers = (request.get_json(silent=True) or {}).get("answers")
+    if not isinstance(answers, dict):
+        return jsonify({"error": "Answers must be provided as a dict"}), 400
+    if not sessions.autosave(session, answers):
+        return jsonify({"error": "Session is already submitted or expired"}), 409
+    return jsonify({"saved": len(answers), "remaining_seconds": sessions.state(session)["remaining_seconds"]})
+
+# Submit a session; answers sent after the deadline are ignored
+@main.route("/api/user/quiz_sessions/<session_id>/submit", methods=["POST"])
+@jwt_required
+def user_submit_quiz_session(session_id):
+    sessions = get_quiz_sessions()
+    session = sessions.get(session_id, request.user["user_id"])
+    if not session:
+        return jsonify({"error": "Session not found"}), 404
+    answers = (request.get_json(silent=True) or {}).get("answers")
+    result = sessions.submit(session, answers if isinstance(answers, dict) else None)
+    if result is None:
+        # Already submitted (retry, or auto-submitted at the deadline)
+        submission = find_submission(f"session:{session_id}")
+        if not submission:
+            if Quiz.query.get(session["quiz_id"]) is None:
+                return jsonify({"error": "Quiz not found"}), 404
+            return jsonify({"error": "Session is already being submitted"}), 409
+        total_scored, total_questions = submission["total_scored"], submission["total_questions"]
+    else:
+        total_scored, total_questions = result.total_scored, result.total_questions
+    return jsonify({
+        "message": "Quiz submitted",
+        "total_scored": total_scored,
+        "total_questions": total_questions,
+        "expired": sessions.expired(session)
+    })
+
+def user_scores_validator():
+    """ETag seed for the caller's scores: attempt count, newest score id and quiz names version"""
+    count, max_id = db.session.query(func.count(Score.id), func.max(Score.id)).filter(
+        Score.user_id == request.user["user_id"]
+    ).one()
+    return (count, max_id, get_versions("quiz")), None
+
 # View user's quiz history/scores
 @main.route("/api/user/scores", methods=["GET"])
 @jwt_required
+@conditional_get(user_scores_validator)
 def user_scores():
     user_id = request.user["user_id"]
     scores = Score.query.filter_by(user_id=user_id).all()
@@ -1386,86 +1472,41 @@ def trigger_admin_csv_export(user_id):
 @jwt_required
 @admin_required
 def admin_stats():
-    """Get comprehensive admin statistics"""
+    """Get headline admin statistics.
+
+    The per-student ``users`` list this used to embed is served page by page
+    by /api/admin/stats/users, and each student's scores by
+    /api/admin/users/<user_id>/scores.
+    """
     try:
         # Basic counts
-        total_users = User_Info.query.filter(User_Info.role == 1).count()
-        total_subjects = Subject.query.count()
-        total_chapters = Chapter.query.count()
-        total_quizzes = Quiz.query.count()
-        total_attempts = Score.query.count()
-        
-        # Enhanced user analytics
-        users_with_attempts = db.session.query(User_Info).join(Score).filter(User_Info.role == 1).distinct().count()
-        
-        # Calculate average score across all attempts
-        avg_score_result = db.session.query(db.func.avg(Score.total_scored)).scalar()
-        average_score = round(avg_score_result or 0, 1)
-        
-        # Today's attempts
-        today = datetime.now().date()
-        todays_attempts = Score.query.filter(
-            db.func.date(Score.time_stamp_of_attempt) == today
-        ).count()
+        role_counts = dict(
+            db.session.query(User_Info.role, db.func.count(User_Info.id))
+            .group_by(User_Info.role)
+            .all()
+        )
+        total_users = role_counts.get(1, 0)
+        total_subjects, total_chapters, total_quizzes = db.session.query(
+            db.select(db.func.count(Subject.id)).scalar_subquery(),
+            db.select(db.func.count(Chapter.id)).scalar_subquery(),
+            db.select(db.func.count(Quiz.id)).scalar_subquery()
+        ).one()
         
-        # Active users this week (users with attempts in last 7 days)
+        # Attempt analytics in a single pass over Score
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
         week_ago = datetime.now() - timedelta(days=7)
-        active_this_week = db.session.query(User_Info).join(Score).filter(
-            User_Info.role == 1,
-            Score.time_stamp_of_attempt >= week_ago
-        ).distinct().count()
-        
-        # Get all users with their detailed analytics
-        users = db.session.query(User_Info).filter(User_Info.role == 1).all()
-        users_data = []
-        
-        for user in users:
-            user_scores = Score.query.filter_by(user_id=user.id).all()
-            
-            # Calculate user-specific analytics
-            avg_score = 0
-            best_score = 0
-            last_activity = None
-            status = 'inactive'
-            
-            if user_scores:
-                scores_list = [score.total_scored for score in user_scores]
-                avg_score = round(sum(scores_list) / len(scores_list), 1)
-                best_score = max(scores_list)
-                last_activity = max(score.time_stamp_of_attempt for score in user_scores)
-                
-                # Determine status based on recent activity
-                if last_activity and (datetime.now() - last_activity).days <= 7:
-                    status = 'active'
-                elif last_activity and (datetime.now() - last_activity).days <= 30:
-                    status = 'recent'
-            
-            users_data.append({
-                'id': user.id,
-                'full_name': user.full_name,
-                'email': user.email,
-                'qualification': user.qualification,
-                'dob': user.dob.isoformat() if user.dob else None,
-                'address': user.address,
-                'pin_code': user.pin_code,
-                'scores': [{
-                    'id': score.id,
-                    'total_scored': score.total_scored,
-                    'time_stamp_of_attempt': score.time_stamp_of_attempt.isoformat(),
-                    'quiz': {
-                        'name': score.quiz.name if score.quiz else 'Unknown Quiz',
-                        'chapter': {
-                            'subject': {
-                                'name': score.quiz.chapter.subject.name if score.quiz and score.quiz.chapter else 'Unknown Subject'
-                            }
-                        } if score.quiz and score.quiz.chapter else None
-                    } if score.quiz else None
-                } for score in user_scores],
-                'averageScore': avg_score,
-                'bestScore': best_score,
-                'lastActivity': last_activity.isoformat() if last_activity else None,
-                'status': status
-            })
+        is_student = User_Info.role == 1
+        (total_attempts, avg_score_result, todays_attempts,
+         users_with_attempts, active_this_week) = db.session.query(
+            db.func.count(Score.id),
+            db.func.avg(Score.total_scored),
+            db.func.sum(db.case((Score.time_stamp_of_attempt >= today_start, 1), else_=0)),
+            db.func.count(db.distinct(db.case((is_student, Score.user_id)))),
+            db.func.count(db.distinct(db.case(
+                (db.and_(is_student, Score.time_stamp_of_attempt >= week_ago), Score.user_id)
+            )))
+        ).join(User_Info, User_Info.id == Score.user_id).one()
+        average_score = round(avg_score_result or 0, 1)
 
         return jsonify({
             'totalUsers': total_users,
@@ -1476,14 +1517,166 @@ def admin_stats():
             'activeUsers': active_this_week,
             'usersAttemptingQuizzes': users_with_attempts,
             'averageScore': average_score,
-            'todaysAttempts': todays_attempts,
+            'todaysAttempts': todays_attempts or 0,
             'activeThisWeek': active_this_week,
-            'users': users_data,
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# --- Admin Cache Statistics Endpoint ---
+@main.route("/api/admin/cache/stats", methods=["GET"])
+@jwt_required
+@admin_required
+def admin_cache_stats():
+    """Per-tier hit/miss counters of the cache backend"""
+    backend = get_cache().cache
+    if not hasattr(backend, "stats"):
+        return jsonify({'backend': type(backend).__name__})
+    return jsonify({'backend': type(backend).__name__, **backend.stats()})
+
+@main.route("/api/admin/mail/outbox", methods=["GET"])
+@jwt_required
+@admin_required
+def admin_mail_outbox():
+    """Mail outbox message counts per status and recent batch throughput"""
+    return jsonify(outbox_stats())
+
+@main.route("/api/admin/mail/outbox/requeue", methods=["POST"])
+@jwt_required
+@admin_required
+def admin_requeue_dead_mail():
+    """Move dead-lettered outbox messages (all, or the given ids) back to pending"""
+    data = request.get_json(silent=True) or {}
+    requeued = requeue_dead(data.get("ids"))
+    db.session.commit()
+    return jsonify({'requeued': requeued})
+
+# --- Admin Per-User Analytics Endpoint (paginated, sortable) ---
+@main.route("/api/admin/stats/users", methods=["GET"])
+@jwt_required
+@admin_required
+def admin_stats_users():
+    """Get per-user analytics one page at a time, read from the score rollup"""
+    page = request.args.get("page", 1, type=int)
+    per_page = min(max(request.args.get("per_page", 25, type=int), 1), 100)
+    sort = request.args.get("sort", "full_name")
+    order = request.args.get("order", "asc")
+    status = request.args.get("status")
+
+    totals = db.session.query(
+        UserQuizStats.user_id.label("user_id"),
+        db.func.sum(UserQuizStats.attempt_count).label("attempts"),
+        db.func.sum(UserQuizStats.score_sum).label("score_sum"),
+        db.func.max(UserQuizStats.best_score).label("best_score"),
+        db.func.max(UserQuizStats.latest_attempt_at).label("last_activity")
+    ).group_by(UserQuizStats.user_id).subquery()
+
+    attempts = db.func.coalesce(totals.c.attempts, 0)
+    average_score = db.func.coalesce(
+        db.func.round(db.cast(totals.c.score_sum, db.Float) / totals.c.attempts, 1), 0
+    )
+    best_score = db.func.coalesce(totals.c.best_score, 0)
+    sort_columns = {
+        "full_name": User_Info.full_name,
+        "email": User_Info.email,
+        "attempts": attempts,
+        "average_score": average_score,
+        "best_score": best_score,
+        "last_activity": totals.c.last_activity,
+    }
+    if sort not in sort_columns:
+        return jsonify({"error": f"sort must be one of {', '.join(sort_columns)}"}), 400
+    sort_column = sort_columns[sort]
+    sort_column = sort_column.desc() if order == "desc" else sort_column.asc()
+
+    query = db.session.query(
+        User_Info, attempts, average_score, best_score, totals.c.last_activity
+    ).outerjoin(totals, totals.c.user_id == User_Info.id).filter(User_Info.role == 1)
+
+    now = datetime.now()
+    week_ago = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+    if status == "active":
+        query = query.filter(totals.c.last_activity >= week_ago)
+    elif status == "recent":
+        query = query.filter(totals.c.last_activity < week_ago, totals.c.last_activity >= month_ago)
+    elif status == "inactive":
+        query = query.filter(db.or_(totals.c.last_activity.is_(None), totals.c.last_activity < month_ago))
+
+    pagination = query.order_by(sort_column, User_Info.id.asc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+
+    users_data = []
+    for user, user_attempts, avg_score, best, last_activity in pagination.items:
+        # Determine status based on recent activity
+        user_status = 'inactive'
+        if last_activity and (now - last_activity).days <= 7:
+            user_status = 'active'
+        elif last_activity and (now - last_activity).days <= 30:
+            user_status = 'recent'
+        
+        users_data.append({
+            'id': user.id,
+            'full_name': user.full_name,
+            'email': user.email,
+            'qualification': user.qualification,
+            'dob': user.dob.isoformat() if user.dob else None,
+            'address': user.address,
+            'pin_code': user.pin_code,
+            'attempts': user_attempts,
+            'averageScore': avg_score,
+            'bestScore': best,
+            'lastActivity': last_activity.isoformat() if last_activity else None,
+            'status': user_status
+        })
+
+    return jsonify({
+        'users': users_data,
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'total': pagination.total,
+        'pages': pagination.pages,
+    })
+
+# --- Admin Per-User Score History Endpoint ---
+@main.route("/api/admin/users/<int:user_id>/scores", methods=["GET"])
+@jwt_required
+@admin_required
+def admin_user_score_history(user_id):
+    """Get one user's full score history, newest first, with quiz and subject names joined in"""
+    page = request.args.get("page", 1, type=int)
+    per_page = min(max(request.args.get("per_page", 50, type=int), 1), 200)
+
+    pagination = db.session.query(
+        Score, Quiz.name, Subject.name
+    ).outerjoin(Quiz, Quiz.id == Score.quiz_id).outerjoin(
+        Chapter, Chapter.id == Quiz.chapter_id
+    ).outerjoin(Subject, Subject.id == Chapter.subject_id).filter(
+        Score.user_id == user_id
+    ).order_by(Score.time_stamp_of_attempt.desc(), Score.id.desc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+
+    return jsonify({
+        'scores': [{
+            'id': score.id,
+            'total_scored': score.total_scored,
+            'time_stamp_of_attempt': score.time_stamp_of_attempt.isoformat(),
+            'quiz': {
+                'name': quiz_name,
+                'chapter': {
+                    'subject': {'name': subject_name}
+                } if subject_name else None
+            } if quiz_name else None
+        } for score, quiz_name, subject_name in pagination.items],
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'total': pagination.total,
+        'pages': pagination.pages,
+    })
+
 # --- Admin Users Endpoint ---
 @main.route("/api/admin/users", methods=["GET"])
 @jwt_required
@@ -1575,18 +1768,7 @@ def admin_delete_teacher(teacher_id):
 def admin_export_users():
     """Export all users data as CSV"""
     try:
-        users = User_Info.query.filter_by(role=1).all()
-        
-        # Generate CSV content
-        csv_content = "user_id,full_name,email,qualification,dob,address,pin_code,quiz_attempts\n"
-        for user in users:
-            scores_count = Score.query.filter_by(user_id=user.id).count()
-            csv_content += f"{user.id},{user.full_name},{user.email},{user.qualification or ''},{user.dob or ''},{user.address},{user.pin_code},{scores_count}\n"
-        
-        return csv_content, 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': 'attachment; filename=users_export.csv'
-        }
+        return csv_response(csv_chunks(USER_COLUMNS, user_rows()), "users_export.csv")
     except Exception as e:
         return jsonify({"error": "Failed to export users"}), 500
 
@@ -1597,19 +1779,7 @@ def user_export_csv():
     """Export user's quiz data as CSV"""
     try:
         user_id = request.user["user_id"]
-        scores = Score.query.filter_by(user_id=user_id).all()
-        
-        # Generate CSV content
-        csv_content = "quiz_id,chapter_id,date_of_quiz,score,remarks\n"
-        for score in scores:
-            quiz = Quiz.query.get(score.quiz_id)
-            if quiz:
-                csv_content += f"{score.quiz_id},{quiz.chapter_id},{quiz.date_of_quiz},{score.total_scored},{quiz.remarks or ''}\n"
-        
-        return csv_content, 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': 'attachment; filename=quiz_results.csv'
-        }
+        return csv_response(csv_chunks(SCORE_COLUMNS, score_rows(user_id)), "quiz_results.csv")
     except Exception as e:
         return jsonify({"error": "Failed to export data"}), 500
 
@@ -1620,19 +1790,7 @@ def user_export_csv():
 def admin_export_user_csv(user_id):
     """Export specific user's quiz data as CSV"""
     try:
-        scores = Score.query.filter_by(user_id=user_id).all()
-        
-        # Generate CSV content
-        csv_content = "quiz_id,chapter_id,date_of_quiz,score,remarks\n"
-        for score in scores:
-            quiz = Quiz.query.get(score.quiz_id)
-            if quiz:
-                csv_content += f"{score.quiz_id},{quiz.chapter_id},{quiz.date_of_quiz},{score.total_scored},{quiz.remarks or ''}\n"
-        
-        return csv_content, 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': f'attachment; filename=user_{user_id}_data.csv'
-        }
+        return csv_response(csv_chunks(SCORE_COLUMNS, score_rows(user_id)), f"user_{user_id}_data.csv")
     except Exception as e:
         return jsonify({"error": "Failed to export user data"}), 500
 
@@ -1669,16 +1827,14 @@ def admin_monthly_report():
 def admin_user_management():
     name = request.args.get("name") or (current_user.email if hasattr(current_user, "email") else "")
     search_text = None
+    truncated = False
     if request.method == "POST":
         search_text = request.form.get("search_text")
         if search_text:
-            users = User_Info.query.filter(
-                db.or_(
-                    User_Info.full_name.ilike(f"%{search_text}%"),
-                    User_Info.email.ilike(f"%{search_text}%"),
-                    User_Info.qualification.ilike(f"%{search_text}%")
-                )
-            ).all()
+            # One extra id tells whether matches were cut off at the limit
+            ids = search_ids(search_text, "user", SEARCH_RESULT_LIMIT + 1)
+            truncated = len(ids) > SEARCH_RESULT_LIMIT
+            users = load_ranked(User_Info, ids[:SEARCH_RESULT_LIMIT])
         else:
             users = User_Info.query.all()
     else:
@@ -1688,7 +1844,8 @@ def admin_user_management():
     for u in users:
         u.scores = Score.query.filter_by(user_id=u.id).all()
 
-    return render_template("user_management.html", users=users, name=name, user=current_user, search_text=search_text)
+    return render_template("user_management.html", users=users, name=name, user=current_user, search_text=search_text,
+                           truncated=truncated, search_limit=SEARCH_RESULT_LIMIT)
 
 # --- Admin Teacher Management Page ---
 @main.route("/admin/teacher-management", methods=["GET", "POST"])
@@ -1905,72 +2062,13 @@ def user_dashboard(id, name):
                              current_date=datetime.now().strftime("%d %B, %Y"))
     
     # Get subjects with progress data (only from user's branch)
-    subjects = Subject.query.filter(
+    subjects = load_subjects(
         Subject.id.in_(enrolled_subject_ids),
         Subject.branch_id == user.branch_id
-    ).all()
-    
-    # Calculate progress for each subject
-    for subject in subjects:
-        # Get all quizzes in this subject
-        all_quizzes = []
-        for chapter in subject.chapters:
-            all_quizzes.extend(chapter.quizzes)
-        
-        # Get user's scores for these quizzes (get the latest attempt for each quiz)
-        quiz_ids = [quiz.id for quiz in all_quizzes]
-        user_scores = []
-        for quiz_id in quiz_ids:
-            # Get the latest score for this quiz
-            latest_score = Score.query.filter(
-                Score.user_id == id,
-                Score.quiz_id == quiz_id
-            ).order_by(Score.time_stamp_of_attempt.desc()).first()
-            if latest_score:
-                user_scores.append(latest_score)
-        
-        # Calculate progress based on actual scores
-        total_quizzes = len(all_quizzes)
-        if total_quizzes > 0:
-            # Calculate average score percentage across all quizzes
-            total_score_percentage = 0
-            scored_quizzes = 0
-            
-            for quiz in all_quizzes:
-                # Get the latest score for this quiz
-                latest_score = Score.query.filter(
-                    Score.user_id == id,
-                    Score.quiz_id == quiz.id
-                ).order_by(Score.time_stamp_of_attempt.desc()).first()
-                
-                if latest_score:
-                    # Get total questions in this quiz
-                    total_questions = Question.query.filter_by(quiz_id=quiz.id).count()
-                    if total_questions > 0:
-                        # Calculate percentage for this quiz
-                        quiz_percentage = (latest_score.total_scored / total_questions) * 100
-                        total_score_percentage += quiz_percentage
-                        scored_quizzes += 1
-                        quiz.user_score = latest_score.total_scored
-                        quiz.user_percentage = quiz_percentage
-                    else:
-                        quiz.user_score = None
-                        quiz.user_percentage = 0
-                else:
-                    quiz.user_score = None
-                    quiz.user_percentage = 0
-            
-            # Calculate overall progress percentage
-            if scored_quizzes > 0:
-                subject.progress_percentage = total_score_percentage / scored_quizzes
-            else:
-                subject.progress_percentage = 0
-        else:
-            subject.progress_percentage = 0
-        
-        # Add progress data to subject
-        subject.total_quizzes = total_quizzes
-        subject.completed_quizzes = len(user_scores)
+    )
+    
+    # Calculate progress for all subjects in a constant number of queries
+    apply_progress(id, subjects)
     
     return render_template("user_dashboard.html", 
                          id=id, name=name, subjects=subjects, user=user,
@@ -1985,7 +2083,10 @@ def user_subject_details(user_id, subject_id):
     user = User_Info.query.get_or_404(user_id)
     
     # Get subject
-    subject = Subject.query.get_or_404(subject_id)
+    subjects = load_subjects(Subject.id == subject_id)
+    if not subjects:
+        abort(404)
+    subject = subjects[0]
     
     # Check if user is enrolled in this subject
     enrollment = UserEnrollment.query.filter_by(
@@ -1998,29 +2099,7 @@ def user_subject_details(user_id, subject_id):
         return redirect(url_for("main.user_dashboard", id=user_id, name=user.full_name))
     
     # Get user's scores for this subject's quizzes (latest attempt for each quiz)
-    for chapter in subject.chapters:
-        for quiz in chapter.quizzes:
-            # Get the latest score for this quiz
-            latest_score = Score.query.filter(
-                Score.user_id == user_id,
-                Score.quiz_id == quiz.id
-            ).order_by(Score.time_stamp_of_attempt.desc()).first()
-            
-            if latest_score:
-                # Get total questions in this quiz
-                total_questions = Question.query.filter_by(quiz_id=quiz.id).count()
-                if total_questions > 0:
-                    quiz.user_score = latest_score.total_scored
-                    quiz.user_percentage = (latest_score.total_scored / total_questions) * 100
-                    quiz.total_questions = total_questions
-                else:
-                    quiz.user_score = None
-                    quiz.user_percentage = 0
-                    quiz.total_questions = 0
-            else:
-                quiz.user_score = None
-                quiz.user_percentage = 0
-                quiz.total_questions = Question.query.filter_by(quiz_id=quiz.id).count()
+    apply_progress(user_id, [subject])
     
     return render_template("user_subject_details.html", 
                          user=user, subject=subject, 
@@ -2047,11 +2126,11 @@ def course_discussion(user_id, subject_id):
     if not enrollment:
         return redirect(url_for("main.user_dashboard", id=user_id, name=user.full_name))
     
-    # Get all discussions for this subject
-    discussions = Discussion.query.filter_by(subject_id=subject_id).order_by(Discussion.created_at.asc()).all()
+    # Get the newest page of discussions (or the page before ?before_id=)
+    discussions, has_earlier = requested_discussion_page(subject_id)
     
     return render_template("course_discussion.html", 
-                         user=user, subject=subject, discussions=discussions,
+                         user=user, subject=subject, discussions=discussions, has_earlier=has_earlier,
                          current_date=datetime.now().strftime("%d %B, %Y"))
 
 @main.route("/user/<int:user_id>/subject/<int:subject_id>/discussion", methods=["POST"])
@@ -2108,11 +2187,11 @@ def teacher_course_discussion(teacher_id, subject_id):
     # Get subject
     subject = Subject.query.get_or_404(subject_id)
     
-    # Get all discussions for this subject
-    discussions = Discussion.query.filter_by(subject_id=subject_id).order_by(Discussion.created_at.asc()).all()
+    # Get the newest page of discussions (or the page before ?before_id=)
+    discussions, has_earlier = requested_discussion_page(subject_id)
     
     return render_template("teacher_course_discussion.html", 
-                         teacher=current_user, subject=subject, discussions=discussions,
+                         teacher=current_user, subject=subject, discussions=discussions, has_earlier=has_earlier,
                          current_date=datetime.now().strftime("%d %B, %Y"))
 
 @main.route("/teacher/<int:teacher_id>/subject/<int:subject_id>/discussion", methods=["POST"])
@@ -2149,33 +2228,54 @@ def teacher_post_discussion_message(teacher_id, subject_id):
     
     return redirect(url_for("main.teacher_course_discussion", teacher_id=teacher_id, subject_id=subject_id))
 
-@main.route("/api/discussions/<int:subject_id>", methods=["GET"])
-@login_required
-def api_get_discussions(subject_id):
-    """API endpoint to get discussions for a subject"""
-    # Check if user has access to this subject
+def can_access_discussions(subject_id):
+    """Whether the current user may read a subject's discussion board"""
     if current_user.role == 1:  # Student
-        enrollment = UserEnrollment.query.filter_by(
+        return UserEnrollment.query.filter_by(
             user_id=current_user.id, 
             subject_id=subject_id, 
             is_active=True
-        ).first()
-        if not enrollment:
-            return jsonify({"error": "Access denied"}), 403
-    elif current_user.role == 2:  # Teacher
-        teacher_subject = TeacherSubject.query.filter_by(
+        ).first() is not None
+    if current_user.role == 2:  # Teacher
+        return TeacherSubject.query.filter_by(
             teacher_user_id=current_user.id, 
             subject_id=subject_id
-        ).first()
-        if not teacher_subject:
-            return jsonify({"error": "Access denied"}), 403
-    elif current_user.role != 0:  # Not admin
+        ).first() is not None
+    return current_user.role == 0  # Admin
+
+def discussions_validator(subject_id):
+    """ETag seed for a subject's discussions: message count, newest id and latest edit.
+
+    No Last-Modified: deleting a message does not move the latest edit time,
+    so only the ETag (whose count drops) can tell that the thread changed.
+    """
+    if not can_access_discussions(subject_id):
+        return None
+    seed = db.session.query(
+        func.count(Discussion.id), func.max(Discussion.id), func.max(Discussion.updated_at)
+    ).filter(Discussion.subject_id == subject_id).one()
+    return tuple(seed), None
+
+@main.route("/api/discussions/<int:subject_id>", methods=["GET"])
+@login_required
+@conditional_get(discussions_validator)
+def api_get_discussions(subject_id):
+    """API endpoint to get discussions for a subject.
+
+    Returns one page, oldest first: ``?after_id=`` for messages newer than the
+    last one seen, ``?before_id=`` for older history, ``?limit=`` for the page
+    size. ``X-Has-More`` tells whether another page exists in that direction.
+    """
+    # Check if user has access to this subject
+    if not can_access_discussions(subject_id):
         return jsonify({"error": "Access denied"}), 403
     
-    # Get discussions
-    discussions = Discussion.query.filter_by(subject_id=subject_id).order_by(Discussion.created_at.asc()).all()
+    # Get one keyset page of discussions
+    discussions, has_more = requested_discussion_page(subject_id)
     
-    return jsonify([discussion.to_dict() for discussion in discussions])
+    response = jsonify([discussion.to_dict() for discussion in discussions])
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return response
 
 @main.route("/api/discussions/<int:subject_id>", methods=["POST"])
 @login_required
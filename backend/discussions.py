@@ -0,0 +1,35 @@
+"""Keyset pagination of subject discussion threads.
+
+Pages are addressed by message id rather than offset: ``after_id`` returns the
+messages following the last one a client has seen (for polling), otherwise the
+newest ``limit`` messages before ``before_id`` (or overall) are returned. Both
+walk the (subject_id, id) index and join the author in the same query, so a
+page costs the same however long the forum gets.
+"""
+from flask import current_app, request
+from sqlalchemy.orm import joinedload
+from .models import Discussion
+
+
+def discussion_page(subject_id, before_id=None, after_id=None, limit=50):
+    """(messages oldest first, whether more exist in the paging direction)"""
+    query = Discussion.query.options(joinedload(Discussion.user)).filter(Discussion.subject_id == subject_id)
+    if after_id is not None:
+        rows = query.filter(Discussion.id > after_id).order_by(Discussion.id.asc()).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+    if before_id is not None:
+        query = query.filter(Discussion.id < before_id)
+    rows = query.order_by(Discussion.id.desc()).limit(limit + 1).all()
+    return rows[:limit][::-1], len(rows) > limit
+
+
+def requested_discussion_page(subject_id):
+    """discussion_page for the ``before_id`` / ``after_id`` / ``limit`` query arguments"""
+    limit = request.args.get("limit", current_app.config.get("DISCUSSION_PAGE_SIZE", 50), type=int)
+    limit = max(1, min(limit, current_app.config.get("DISCUSSION_MAX_PAGE_SIZE", 200)))
+    return discussion_page(
+        subject_id,
+        before_id=request.args.get("before_id", type=int),
+        after_id=request.args.get("after_id", type=int),
+        limit=limit
+    )
@@ -0,0 +1,54 @@
+"""Precompiled email templates.
+
+Every kind of email is a pair of Jinja templates under ``templates/email``: a
+plain text ``<name>.txt`` and an ``<name>.html`` extending ``email/base.html``,
+so both parts of a message always carry the same content. Each pair is
+compiled once per process and kept, which leaves two renders as the only
+per-recipient work, and each kind has one ``MessageLayout`` whose MIME
+skeleton is reused for every message built from it.
+"""
+from flask import current_app
+from flask_mail import Message, MessageLayout
+
+EMAIL_SENDER = 'your-email@gmail.com'
+
+
+class EmailTemplate:
+    """A subject plus text and HTML templates rendered for one recipient at a time"""
+
+    def __init__(self, name, subject, sender=EMAIL_SENDER):
+        self.name = name
+        self.subject = subject
+        self.sender = sender
+        self._templates = None
+        self._layout = None
+
+    @property
+    def templates(self):
+        if self._templates is None:
+            env = current_app.jinja_env
+            self._templates = (
+                env.get_template(f"email/{self.name}.txt"),
+                env.get_template(f"email/{self.name}.html"),
+            )
+        return self._templates
+
+    @property
+    def layout(self):
+        if self._layout is None:
+            self._layout = MessageLayout(self.subject, self.sender, html=True)
+        return self._layout
+
+    def render(self, **context):
+        """(text body, HTML body) for one recipient"""
+        text, html = self.templates
+        return text.render(**context), html.render(**context)
+
+    def message(self, recipient, **context):
+        body, html = self.render(**context)
+        return Message(self.subject, sender=self.sender, recipients=[recipient],
+                       body=body, html=html, layout=self.layout)
+
+
+DAILY_REMINDER = EmailTemplate("daily_reminder", "Daily Quiz Reminder")
+MONTHLY_REPORT = EmailTemplate("monthly_report", "Monthly Activity Report")
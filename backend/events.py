@@ -0,0 +1,255 @@
+"""Server-Sent Events for new notifications and discussion messages.
+
+Committed writes of Notification, BroadcastNotification and Discussion rows
+publish a small "changed" message on ``user:<id>`` or ``subject:<id>`` channels,
+through Redis pub/sub or, for single-node runs, an in-process broker. Each open
+stream waits on its channels and, when woken, sends the rows newer than its
+cursor; without Redis it also looks at every heartbeat, since writes made by
+other processes publish nothing it can hear. The cursor ("n<id>.b<id>.d<id>": newest
+personal notification, broadcast and discussion sent) is the SSE event id, so
+a reconnecting client's ``Last-Event-ID`` resumes exactly where it left off.
+"""
+import json
+import queue
+import threading
+import time
+import redis
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session, joinedload
+from .models import db, Notification, BroadcastNotification, Discussion, UserEnrollment, TeacherSubject
+
+
+class InProcessBroker:
+    """Fan messages out to subscriber queues within this process"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            queues = list(self._subscribers.get(channel, ()))
+        for q in queues:
+            q.put(message)
+
+    def subscribe(self, channels):
+        return InProcessSubscription(self, channels)
+
+
+class InProcessSubscription:
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = list(channels)
+        self.queue = queue.Queue()
+        with broker._lock:
+            for channel in self.channels:
+                broker._subscribers.setdefault(channel, set()).add(self.queue)
+
+    def wait(self, timeout):
+        """Block until a message arrives or the timeout passes; True if woken by a message"""
+        try:
+            self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        # Coalesce a burst of messages into one wake-up
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        return True
+
+    def close(self):
+        with self.broker._lock:
+            for channel in self.channels:
+                self.broker._subscribers.get(channel, set()).discard(self.queue)
+
+
+class RedisBroker:
+    def __init__(self, client, prefix="events"):
+        self.client = client
+        self.prefix = prefix
+
+    def publish(self, channel, message):
+        self.client.publish(f"{self.prefix}:{channel}", json.dumps(message))
+
+    def subscribe(self, channels):
+        return RedisSubscription(self.client, [f"{self.prefix}:{channel}" for channel in channels])
+
+
+class RedisSubscription:
+    def __init__(self, client, channels):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(*channels)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        woken = False
+        while True:
+            remaining = deadline - time.monotonic()
+            message = self.pubsub.get_message(timeout=max(remaining, 0) if not woken else 0)
+            if message is None:
+                return woken
+            if message.get("type") == "message":
+                woken = True
+
+    def close(self):
+        self.pubsub.close()
+
+
+def get_broker():
+    return current_app.extensions["event_broker"]
+
+
+def publish(channel, message=None):
+    try:
+        get_broker().publish(channel, message or {"type": "changed"})
+    except Exception as e:
+        print(f"Error publishing event on {channel}: {e}")
+
+
+# Publishing committed writes
+
+def _collect_event_channels(session, flush_context):
+    channels = session.info.setdefault("event_channels", set())
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            channels.add(f"user:{obj.user_id}")
+        elif isinstance(obj, (BroadcastNotification, Discussion)):
+            channels.add(f"subject:{obj.subject_id}")
+
+
+def _publish_after_commit(session):
+    channels = session.info.pop("event_channels", None)
+    if not channels or not has_app_context() or "event_broker" not in current_app.extensions:
+        return
+    for channel in channels:
+        publish(channel)
+
+
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop("event_channels", None)
+
+
+# Reading the stream
+
+class Cursor:
+    """Newest personal notification, broadcast and discussion id already sent"""
+
+    def __init__(self, notification=0, broadcast=0, discussion=0):
+        self.notification = notification
+        self.broadcast = broadcast
+        self.discussion = discussion
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            parts = dict((part[0], int(part[1:])) for part in value.split(".") if part)
+            return cls(parts["n"], parts["b"], parts["d"])
+        except (AttributeError, KeyError, ValueError, IndexError):
+            return None
+
+    def __str__(self):
+        return f"n{self.notification}.b{self.broadcast}.d{self.discussion}"
+
+
+def stream_subject_ids(user):
+    """Subjects whose broadcasts and discussions a user receives"""
+    if user.role == 2:
+        rows = db.session.query(TeacherSubject.subject_id).filter_by(teacher_user_id=user.id)
+    else:
+        rows = db.session.query(UserEnrollment.subject_id).filter_by(user_id=user.id, is_active=True)
+    return [subject_id for (subject_id,) in rows]
+
+
+def current_cursor(user_id, subject_ids):
+    """Cursor at the newest existing rows, for streams that start fresh"""
+    return Cursor(
+        db.session.query(func.coalesce(func.max(Notification.id), 0)).filter_by(user_id=user_id).scalar(),
+        db.session.query(func.coalesce(func.max(BroadcastNotification.id), 0))
+        .filter(BroadcastNotification.subject_id.in_(subject_ids)).scalar(),
+        db.session.query(func.coalesce(func.max(Discussion.id), 0))
+        .filter(Discussion.subject_id.in_(subject_ids)).scalar(),
+    )
+
+
+def pending_events(user_id, subject_ids, cursor, limit=100):
+    """(event name, payload, event id) for rows newer than the cursor, advancing it"""
+    events = []
+    notifications = Notification.query.filter(
+        Notification.user_id == user_id, Notification.id > cursor.notification
+    ).order_by(Notification.id).limit(limit).all()
+    for notification in notifications:
+        cursor.notification = notification.id
+        events.append(("notification", notification.to_dict(), str(cursor)))
+
+    if subject_ids:
+        broadcasts = BroadcastNotification.query.filter(
+            BroadcastNotification.subject_id.in_(subject_ids),
+            BroadcastNotification.id > cursor.broadcast,
+            or_(BroadcastNotification.expires_at.is_(None), BroadcastNotification.expires_at > datetime.now())
+        ).order_by(BroadcastNotification.id).limit(limit).all()
+        for broadcast in broadcasts:
+            cursor.broadcast = broadcast.id
+            events.append(("notification", broadcast.to_dict(user_id), str(cursor)))
+
+        discussions = Discussion.query.options(joinedload(Discussion.user)).filter(
+            Discussion.subject_id.in_(subject_ids), Discussion.id > cursor.discussion
+        ).order_by(Discussion.id).limit(limit).all()
+        for discussion in discussions:
+            cursor.discussion = discussion.id
+            events.append(("discussion", discussion.to_dict(), str(cursor)))
+    return events
+
+
+def format_event(name, payload, event_id):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_stream(user, last_event_id=None, heartbeat=15, max_duration=1800):
+    """Generator of SSE frames for a user; run it inside ``stream_with_context``"""
+    user_id = user.id
+    subject_ids = stream_subject_ids(user)
+    cursor = Cursor.parse(last_event_id) if last_event_id else None
+    if cursor is None:
+        cursor = current_cursor(user_id, subject_ids)
+    channels = [f"user:{user_id}"] + [f"subject:{subject_id}" for subject_id in subject_ids]
+    broker = get_broker()
+    # Redis carries every process's writes; the in-process broker only this one's
+    poll_on_heartbeat = isinstance(broker, InProcessBroker)
+    subscription = broker.subscribe(channels)
+    db.session.remove()
+
+    started = time.monotonic()
+    try:
+        yield f"retry: 3000\nid: {cursor}\n\n"
+        changed = True  # catch up on anything since the client's Last-Event-ID
+        while time.monotonic() - started < max_duration:
+            if changed:
+                events = pending_events(user_id, subject_ids, cursor)
+                db.session.remove()
+                for name, payload, event_id in events:
+                    yield format_event(name, payload, event_id)
+            changed = subscription.wait(heartbeat)
+            if not changed:
+                yield ": heartbeat\n\n"
+                changed = poll_on_heartbeat
+    finally:
+        subscription.close()
+
+
+def init_events(app, broker=None):
+    """Attach the event broker (Redis at EVENTS_REDIS_URL when reachable) and publish hooks"""
+    if broker is None:
+        try:
+            client = redis.from_url(app.config["EVENTS_REDIS_URL"])
+            client.ping()
+            broker = RedisBroker(client)
+        except Exception as e:
+            print(f"Event stream falling back to in-process broker: {e}")
+            broker = InProcessBroker()
+    app.extensions["event_broker"] = broker
+    if not event.contains(Session, "after_flush", _collect_event_channels):
+        event.listen(Session, "after_flush", _collect_event_channels)
+        event.listen(Session, "after_commit", _publish_after_commit)
+        event.listen(Session, "after_soft_rollback", _discard_after_rollback)
+    return broker
@@ -0,0 +1,80 @@
+"""Streaming CSV exports.
+
+Each export is one joined query read ``batch_size`` rows at a time with
+``yield_per`` and written through the ``csv`` module, which quotes commas,
+quotes and line breaks in free text such as remarks and addresses. Rows are
+collected in a small buffer that is handed on every ``EXPORT_CHUNK_SIZE``
+characters, so the same chunks feed a streamed download or a file written
+piece by piece, and memory stays flat whatever the number of rows.
+"""
+import csv
+import io
+import os
+from flask import Response, stream_with_context
+from sqlalchemy import select, func
+from .models import db, User_Info, Score, Quiz
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+SCORE_COLUMNS = ["quiz_id", "chapter_id", "date_of_quiz", "score", "remarks"]
+USER_COLUMNS = ["user_id", "full_name", "email", "qualification", "dob", "address", "pin_code", "quiz_attempts"]
+
+
+def _stream(stmt, batch_size):
+    yield from db.session.execute(stmt.execution_options(yield_per=batch_size))
+
+
+def score_rows(user_id, batch_size=EXPORT_BATCH_SIZE):
+    """A user's attempts with their quiz's chapter, date and remarks"""
+    stmt = select(
+        Score.quiz_id, Quiz.chapter_id, Quiz.date_of_quiz, Score.total_scored, Quiz.remarks
+    ).join(Quiz, Quiz.id == Score.quiz_id).where(Score.user_id == user_id).order_by(Score.id)
+    return _stream(stmt, batch_size)
+
+
+def user_rows(batch_size=EXPORT_BATCH_SIZE):
+    """Every student with their number of attempts, counted from the (user_id, time) index"""
+    attempts = select(func.count(Score.id)).where(Score.user_id == User_Info.id).scalar_subquery()
+    stmt = select(
+        User_Info.id, User_Info.full_name, User_Info.email, User_Info.qualification,
+        User_Info.dob, User_Info.address, User_Info.pin_code, attempts
+    ).where(User_Info.role == 1).order_by(User_Info.id)
+    return _stream(stmt, batch_size)
+
+
+def csv_chunks(columns, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the CSV text of a header and rows in chunks of about ``chunk_size`` characters"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(chunks, filename):
+    """Streamed CSV download; the query runs while the response is being sent"""
+    return Response(stream_with_context(chunks), mimetype="text/csv", headers={
+        "Content-Disposition": f"attachment; filename={filename}"
+    })
+
+
+def write_csv(path, chunks):
+    """Write chunks to ``path`` through a temporary file, so readers never see a partial export"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.part"
+    try:
+        with open(partial, "w", newline="", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path
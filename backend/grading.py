@@ -0,0 +1,84 @@
+"""Quiz grading against compiled answer keys.
+
+A quiz's questions are compiled once into an immutable answer key (question id
+-> normalized correct option label and text) and cached under the quiz's own
+version, so a submission is graded in one pass over the key without loading
+Question rows. A committed write to one of the quiz's questions bumps that
+version and its next submission recompiles; other quizzes keep their keys.
+A quiz that does not exist has no key (None), never an empty one, so callers
+can answer 404 instead of recording a score of 0 out of 0.
+"""
+from collections import namedtuple
+from flask import current_app
+from .models import db, Quiz, Question
+from .caching import get_cache, versioned_key, quiz_scope
+
+OPTION_LABELS = ("option1", "option2", "option3", "option4")
+
+# label is the normalized correct_option ("option2", or the answer text when
+# it was stored as text); text is the normalized text of the correct answer
+CorrectAnswer = namedtuple("CorrectAnswer", ["question_id", "label", "text"])
+AnswerKey = namedtuple("AnswerKey", ["quiz_id", "answers"])
+
+
+def normalize(value):
+    return str(value).strip().lower() if value is not None else ""
+
+
+def compile_answer_key(quiz_id):
+    """Build the answer key for a quiz from a single column query; None when there is no such quiz"""
+    rows = db.session.query(
+        Question.id, Question.correct_option,
+        Question.option1, Question.option2, Question.option3, Question.option4
+    ).select_from(Quiz).outerjoin(Question, Question.quiz_id == Quiz.id).filter(
+        Quiz.id == quiz_id
+    ).order_by(Question.id).all()
+    if not rows:
+        return None
+
+    answers = []
+    for question_id, correct_option, *options in rows:
+        if question_id is None:
+            continue  # a quiz without questions
+        label = normalize(correct_option)
+        if label in OPTION_LABELS:
+            text = normalize(options[OPTION_LABELS.index(label)])
+        else:
+            text = label
+        answers.append(CorrectAnswer(question_id, label, text))
+    return AnswerKey(int(quiz_id), tuple(answers))
+
+
+def get_answer_key(quiz_id):
+    """Cached answer key for a quiz, recompiled whenever its questions change; None for a missing quiz"""
+    cache = get_cache()
+    try:
+        key = versioned_key(f"answer_key/{int(quiz_id)}", quiz_scope(quiz_id))
+        answer_key = cache.get(key)
+    except Exception as e:
+        # Grading must keep working when the cache is down
+        print(f"Error reading cached answer key for quiz {quiz_id}: {e}")
+        return compile_answer_key(quiz_id)
+    if answer_key is None:
+        answer_key = compile_answer_key(quiz_id)
+        if answer_key is not None:
+            cache.set(key, answer_key, timeout=current_app.config.get("CATALOG_CACHE_TIMEOUT"))
+    return answer_key
+
+
+def grade_form(answer_key, form):
+    """Score an HTML form submission (``question_<id>`` -> chosen option text)"""
+    return sum(
+        1 for answer in answer_key.answers
+        if normalize(form.get(f"question_{answer.question_id}")) == answer.text
+    )
+
+
+def grade_answers(answer_key, answers):
+    """Score a JSON submission ({question_id: option label or text})"""
+    total = 0
+    for answer in answer_key.answers:
+        selected = answers.get(str(answer.question_id)) or answers.get(answer.question_id)
+        if selected and normalize(selected) in (answer.label, answer.text):
+            total += 1
+    return total
@@ -0,0 +1,90 @@
+"""Batched SMTP delivery.
+
+Messages are split into batches of ``MAIL_MAX_EMAILS`` (the most one SMTP
+session is allowed to carry) and each batch is sent over a single
+``flask_mail`` Connection, so STARTTLS and login happen once per batch instead
+of once per message; rejected messages are counted without stopping the batch
+and a dropped session is reopened. An item whose message cannot be built fails
+on its own with a ``MessageBuildError``. Batches are spread over a small thread
+pool of ``MAIL_SEND_WORKERS`` connections.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+MAIL_BATCH_SIZE = 100
+
+
+class MessageBuildError(Exception):
+    """An item's message could not be rendered; sending it again cannot help"""
+
+
+def batched(items, size):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def report_failures(result):
+    for message, error in result.failures:
+        print(f"Error sending email to {', '.join(message.send_to)}: {error}")
+
+
+def deliver_batch(app, mail, items, build_message):
+    """Build and send each item's message over one connection.
+
+    Returns (sent count, [(item, error)] for the items that failed).
+    """
+    built = {}
+    unbuilt = []
+
+    def messages():
+        for item in items:
+            try:
+                message = build_message(item)
+            except Exception as e:
+                print(f"Error building email for {item!r}: {e}")
+                unbuilt.append((item, MessageBuildError(f"{type(e).__name__}: {e}")))
+                continue
+            built[id(message)] = (item, message)
+            yield message
+
+    result = None
+    try:
+        with app.app_context():
+            with mail.connect() as connection:
+                result = connection.send_many(messages())
+    except Exception as e:
+        if result is None:
+            raise
+        # Every message was handed over; only closing the session failed
+        print(f"Error closing mail connection: {e}")
+    report_failures(result)
+    return result.sent, unbuilt + [(built[id(message)][0], error) for message, error in result.failures]
+
+
+def deliver_in_batches(app, mail, items, build_message, batch_size=None, workers=None):
+    """Send ``build_message(item)`` for every item in connection-sized batches across a worker pool.
+
+    Returns (sent count, [(item, error)] for the items that failed). When a
+    batch cannot open its connection every item in it is reported as failed.
+    """
+    batch_size = batch_size or app.config.get("MAIL_MAX_EMAILS") or MAIL_BATCH_SIZE
+    workers = workers or app.config.get("MAIL_SEND_WORKERS", 4)
+    sent, failures = 0, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batches = [(batch, pool.submit(deliver_batch, app, mail, batch, build_message))
+                   for batch in batched(items, batch_size)]
+        for batch, future in batches:
+            try:
+                batch_sent, batch_failures = future.result()
+            except Exception as e:
+                # The connection itself could not be opened
+                print(f"Error delivering mail batch: {e}")
+                failures.extend((item, e) for item in batch)
+                continue
+            sent += batch_sent
+            failures.extend(batch_failures)
+    return sent, failures
@@ -0,0 +1,286 @@
+"""Rate-limited, retrying outbound mail queue.
+
+Tasks enqueue messages as ``OutboxEmail`` rows instead of talking to SMTP.
+The drainer claims due rows in batches (a claim is a lease, so rows held by a
+crashed drainer are picked up again once ``claim_timeout`` passes; every claim
+counts as an attempt, so a message that keeps taking its drainer down is
+dead-lettered like any other) and sends
+them through the pooled batch delivery, taking one token from a token bucket
+per message so bursts never exceed ``MAIL_RATE_PER_SECOND`` beyond the
+configured burst. Temporary failures are retried with exponential backoff and
+jitter; permanent rejections, and messages that run out of attempts, are kept
+with status "dead" for inspection and requeueing. Messages of a batch that
+share a subject and sender are rendered from one MIME layout. Every batch
+records its throughput, kept in the cache for the admin outbox endpoint.
+"""
+import json
+import random
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.utils import formataddr
+from flask_mail import Message, MessageLayout, BadHeaderError
+from sqlalchemy import insert, update, delete, select, func, or_, and_
+from .models import db, OutboxEmail
+from .mail_delivery import deliver_in_batches, MessageBuildError
+from .caching import get_cache
+
+METRICS_KEY = "mail_outbox/metrics"
+DRAIN_LOCK_KEY = "lock/mail_outbox"
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average and up to ``capacity`` at once"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+
+
+def outbox_values(message, kind=None, now=None):
+    return {
+        "kind": kind,
+        "sender": message.sender if isinstance(message.sender, str) else formataddr(message.sender),
+        "recipients": json.dumps(list(message.recipients)),
+        "subject": message.subject,
+        "body": message.body,
+        "html": message.html,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now or datetime.now(),
+    }
+
+
+def enqueue_mail(messages, kind=None):
+    """Queue flask_mail Messages for delivery with one INSERT (caller commits); returns the count"""
+    now = datetime.now()
+    rows = [outbox_values(message, kind, now) for message in messages]
+    if rows:
+        db.session.execute(insert(OutboxEmail), rows)
+    return len(rows)
+
+
+def outbox_message(row, layouts=None):
+    """Message for a queued row; ``layouts`` shares one MIME layout per subject, sender and parts"""
+    layout = None
+    if layouts is not None:
+        key = (row.subject, row.sender, bool(row.html))
+        layout = layouts.get(key)
+        if layout is None:
+            layout = layouts.setdefault(key, MessageLayout(row.subject, row.sender, html=bool(row.html)))
+    return Message(row.subject, sender=row.sender, recipients=json.loads(row.recipients),
+                   body=row.body, html=row.html, layout=layout)
+
+
+def is_permanent(error):
+    """Whether retrying cannot help: the server rejected the message itself, or it could not be built"""
+    if isinstance(error, (BadHeaderError, AssertionError, MessageBuildError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return error.smtp_code >= 500
+    return False
+
+
+def retry_delay(attempts, base, maximum):
+    """Exponential backoff with full jitter for the given attempt number"""
+    return random.uniform(0, min(maximum, base * 2 ** (attempts - 1)))
+
+
+def claim_batch(limit, claim_timeout=300, max_attempts=6):
+    """Lease up to ``limit`` due rows to a new claim, counting an attempt for each; returns (claim id, rows)
+
+    Rows whose lease expired after their last attempt are dead-lettered
+    instead of being claimed again.
+    """
+    claim_id = uuid.uuid4().hex
+    now = datetime.now()
+    expired = and_(OutboxEmail.status == "sending", OutboxEmail.claimed_at < now - timedelta(seconds=claim_timeout))
+    db.session.execute(
+        update(OutboxEmail).where(expired, OutboxEmail.attempts >= max_attempts)
+        .values(status="dead", claimed_by=None, last_error="Claim expired without an outcome")
+        .execution_options(synchronize_session=False)
+    )
+    due = select(OutboxEmail.id).where(or_(
+        and_(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now),
+        expired
+    )).order_by(OutboxEmail.next_attempt_at, OutboxEmail.id).limit(limit).scalar_subquery()
+    db.session.execute(
+        update(OutboxEmail).where(OutboxEmail.id.in_(due))
+        .values(status="sending", claimed_by=claim_id, claimed_at=now, attempts=OutboxEmail.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    rows = OutboxEmail.query.filter_by(claimed_by=claim_id, status="sending").order_by(OutboxEmail.id).all()
+    # Detached, so worker threads can read them without the session
+    for row in rows:
+        db.session.expunge(row)
+    return claim_id, rows
+
+
+def record_outcome(claim_id, rows, failures, max_attempts, backoff_base, backoff_max):
+    """Mark sent rows, reschedule temporary failures and dead-letter the rest; returns (retried, dead)"""
+    now = datetime.now()
+    failed = {row.id: error for row, error in failures}
+    sent_ids = [row.id for row in rows if row.id not in failed]
+    if sent_ids:
+        db.session.execute(
+            update(OutboxEmail).where(OutboxEmail.id.in_(sent_ids), OutboxEmail.claimed_by == claim_id)
+            .values(status="sent", sent_at=now, claimed_by=None)
+            .execution_options(synchronize_session=False)
+        )
+    retried = dead = 0
+    for row in rows:
+        if row.id not in failed:
+            continue
+        error = failed[row.id]
+        attempts = row.attempts  # counted when the row was claimed
+        values = {"last_error": f"{type(error).__name__}: {error}"[:1000], "claimed_by": None}
+        if is_permanent(error) or attempts >= max_attempts:
+            values["status"] = "dead"
+            dead += 1
+        else:
+            values["status"] = "pending"
+            values["next_attempt_at"] = now + timedelta(seconds=retry_delay(attempts, backoff_base, backoff_max))
+            retried += 1
+        db.session.execute(
+            update(OutboxEmail).where(OutboxEmail.id == row.id, OutboxEmail.claimed_by == claim_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return retried, dead
+
+
+def record_metrics(metrics, keep=50):
+    try:
+        cache = get_cache()
+        history = cache.get(METRICS_KEY) or []
+        cache.set(METRICS_KEY, (history + [metrics])[-keep:], timeout=0)
+    except Exception as e:
+        print(f"Error recording mail outbox metrics: {e}")
+
+
+def drain_batch(app, mail, limiter, batch_size=100, max_attempts=6, backoff_base=30, backoff_max=3600,
+                claim_timeout=300):
+    """Claim and send one batch of due messages; returns its metrics, or None when nothing was due"""
+    claim_id, rows = claim_batch(batch_size, claim_timeout, max_attempts)
+    if not rows:
+        return None
+
+    layouts = {}
+
+    def build_message(row):
+        limiter.acquire()
+        return outbox_message(row, layouts)
+
+    started = time.monotonic()
+    waited_before = limiter.waited
+    sent, failures = deliver_in_batches(app, mail, rows, build_message)
+    elapsed = time.monotonic() - started
+    retried, dead = record_outcome(claim_id, rows, failures, max_attempts, backoff_base, backoff_max)
+    metrics = {
+        "claim_id": claim_id,
+        "finished_at": datetime.now().isoformat(),
+        "claimed": len(rows),
+        "sent": sent,
+        "retried": retried,
+        "dead": dead,
+        "seconds": round(elapsed, 3),
+        "throttled_seconds": round(limiter.waited - waited_before, 3),
+        "per_second": round(sent / elapsed, 2) if elapsed else None,
+    }
+    record_metrics(metrics)
+    return metrics
+
+
+def drain_outbox(app, mail, max_seconds=50):
+    """Send due messages batch after batch for up to ``max_seconds``; returns the batch metrics.
+
+    Only one drainer runs at a time (a cache lease), so the rate limit holds
+    across workers.
+    """
+    config = app.config
+    token = uuid.uuid4().hex
+    try:
+        cache = get_cache()
+        if not cache.add(DRAIN_LOCK_KEY, token, timeout=max_seconds + 60):
+            return []
+    except Exception as e:
+        print(f"Error taking the mail outbox lease, draining without it: {e}")
+        cache = None
+
+    limiter = TokenBucket(config.get("MAIL_RATE_PER_SECOND", 5), config.get("MAIL_RATE_BURST", 20))
+    batches = []
+    deadline = time.monotonic() + max_seconds
+    try:
+        while time.monotonic() < deadline:
+            metrics = drain_batch(
+                app, mail, limiter,
+                batch_size=config.get("MAIL_OUTBOX_BATCH_SIZE", 100),
+                max_attempts=config.get("MAIL_OUTBOX_MAX_ATTEMPTS", 6),
+                backoff_base=config.get("MAIL_OUTBOX_BACKOFF_SECONDS", 30),
+                backoff_max=config.get("MAIL_OUTBOX_BACKOFF_MAX_SECONDS", 3600),
+                claim_timeout=config.get("MAIL_OUTBOX_CLAIM_TIMEOUT", 300)
+            )
+            if metrics is None:
+                break
+            batches.append(metrics)
+    finally:
+        if cache is not None:
+            try:
+                if cache.get(DRAIN_LOCK_KEY) == token:
+                    cache.delete(DRAIN_LOCK_KEY)
+            except Exception as e:
+                print(f"Error releasing the mail outbox lease: {e}")
+    return batches
+
+
+def requeue_dead(ids=None):
+    """Give dead-lettered messages a fresh set of attempts (caller commits); returns the count"""
+    query = update(OutboxEmail).where(OutboxEmail.status == "dead")
+    if ids:
+        query = query.where(OutboxEmail.id.in_(ids))
+    return db.session.execute(
+        query.values(status="pending", attempts=0, next_attempt_at=datetime.now(), last_error=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def purge_sent(before, limit=1000):
+    """Delete up to ``limit`` messages sent before ``before`` (caller commits)"""
+    ids = select(OutboxEmail.id).where(
+        OutboxEmail.status == "sent", OutboxEmail.sent_at < before
+    ).order_by(OutboxEmail.id).limit(limit).scalar_subquery()
+    return db.session.execute(
+        delete(OutboxEmail).where(OutboxEmail.id.in_(ids)).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def outbox_stats():
+    """Message counts per status plus the recent batch metrics"""
+    counts = dict(db.session.query(OutboxEmail.status, func.count(OutboxEmail.id)).group_by(OutboxEmail.status))
+    try:
+        batches = get_cache().get(METRICS_KEY) or []
+    except Exception as e:
+        print(f"Error reading mail outbox metrics: {e}")
+        batches = []
+    return {"counts": counts, "batches": batches}
@@ -17,6 +17,9 @@ class User_Info(db.Model, UserMixin):
     pin_code = db.Column(db.Integer, nullable=False)
     branch_id = db.Column(db.Integer, db.ForeignKey("branch.id"), nullable=True)  # Added branch selection
     scores = db.relationship("Score", cascade="all,delete", backref="user", lazy=True)
+    quiz_stats = db.relationship("UserQuizStats", cascade="all,delete", backref="user", lazy=True)
+    score_submissions = db.relationship("ScoreSubmission", cascade="all,delete", backref="user", lazy=True)
+    notification_receipts = db.relationship("NotificationReceipt", cascade="all,delete", backref="user", lazy=True)
     # Courses taught by the user (if teacher)
     courses = db.relationship("Course", cascade="all,delete", backref="teacher", lazy=True)
     # Branch relationship
@@ -76,6 +79,8 @@ class Quiz(db.Model):
     chapter_id = db.Column(db.Integer, db.ForeignKey("chapter.id"), nullable=False)
     questions = db.relationship("Question", cascade="all,delete", backref="quiz", lazy=True)
     scores = db.relationship("Score", cascade="all,delete", backref="quiz", lazy=True)
+    user_stats = db.relationship("UserQuizStats", cascade="all,delete", backref="quiz", lazy=True)
+    score_submissions = db.relationship("ScoreSubmission", cascade="all,delete", backref="quiz", lazy=True)
 
 # Question model
 class Question(db.Model):
@@ -92,6 +97,7 @@ class Question(db.Model):
 # Score model
 class Score(db.Model):
     __tablename__ = "score"
+    __table_args__ = (db.Index("ix_score_user_id_time_stamp", "user_id", "time_stamp_of_attempt"),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user_info.id"), nullable=False)
     quiz_id = db.Column(db.Integer, db.ForeignKey("quiz.id"), nullable=False)
@@ -99,6 +105,36 @@ class Score(db.Model):
     time_stamp_of_attempt = db.Column(db.DateTime, nullable=False)  # Use DateTime type
     # Optionally add more fields: correct_answers, ranking, etc.
 
+# Per-user/per-quiz score rollup, updated in the same transaction as each Score insert
+class UserQuizStats(db.Model):
+    __tablename__ = "user_quiz_stats"
+    __table_args__ = (db.UniqueConstraint("user_id", "quiz_id", name="uq_user_quiz_stats_user_quiz"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user_info.id"), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey("quiz.id"), nullable=False, index=True)
+    attempt_count = db.Column(db.Integer, default=0, nullable=False)
+    best_score = db.Column(db.Integer, default=0, nullable=False)
+    latest_score = db.Column(db.Integer, default=0, nullable=False)
+    latest_attempt_at = db.Column(db.DateTime, nullable=True)
+    score_sum = db.Column(db.Integer, default=0, nullable=False)
+    
+    @property
+    def average_score(self):
+        return self.score_sum / self.attempt_count if self.attempt_count else 0
+
+# One row per accepted quiz submission, keyed by its idempotency key so that
+# replayed or retried submissions never create a second Score
+class ScoreSubmission(db.Model):
+    __tablename__ = "score_submission"
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user_info.id"), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey("quiz.id"), nullable=False)
+    score_id = db.Column(db.Integer, db.ForeignKey("score.id"), nullable=True)
+    total_scored = db.Column(db.Integer, nullable=False)
+    total_questions = db.Column(db.Integer, nullable=True)
+    submitted_at = db.Column(db.DateTime, nullable=False)
+
 # Course model
 class Course(db.Model):
     __tablename__ = "course"
@@ -145,6 +181,7 @@ class UserEnrollment(db.Model):
 # Discussion forum for courses
 class Discussion(db.Model):
     __tablename__ = "discussions"
+    __table_args__ = (db.Index("ix_discussions_subject_id_id", "subject_id", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("user_info.id"), nullable=False)
@@ -284,7 +321,75 @@ class Notification(db.Model):
             'related_id': self.related_id,
             'related_type': self.related_type,
             'is_read': self.is_read,
+            'is_broadcast': False,
+            'priority': self.priority,
+            'created_at': self.created_at.isoformat(),
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+# Class-wide notification stored once per subject and merged into each enrolled
+# student's feed at read time
+class BroadcastNotification(db.Model):
+    __tablename__ = "broadcast_notifications"
+    __table_args__ = (db.Index("ix_broadcast_notifications_subject_created", "subject_id", "created_at"),)
+    id = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
+    title = db.Column(db.String, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    notification_type = db.Column(db.String, nullable=False)  # assignment, announcement, ...
+    related_id = db.Column(db.Integer, nullable=True)
+    related_type = db.Column(db.String, nullable=True)
+    priority = db.Column(db.String, default='normal', nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    expires_at = db.Column(db.DateTime, nullable=True)
+    
+    # Relationships
+    subject = db.relationship("Subject", backref=db.backref("broadcast_notifications", cascade="all,delete"))
+    receipts = db.relationship("NotificationReceipt", cascade="all,delete", backref="broadcast", lazy=True)
+    
+    def to_dict(self, user_id=None, is_read=False):
+        return {
+            'id': self.id,
+            'user_id': user_id,
+            'title': self.title,
+            'message': self.message,
+            'notification_type': self.notification_type,
+            'related_id': self.related_id,
+            'related_type': self.related_type,
+            'is_read': is_read,
+            'is_broadcast': True,
+            'subject_id': self.subject_id,
             'priority': self.priority,
             'created_at': self.created_at.isoformat(),
             'expires_at': self.expires_at.isoformat() if self.expires_at else None
-        }
\ No newline at end of file
+        }
+
+# Per-user read marker for a broadcast; rows only exist for broadcasts a user has read
+class NotificationReceipt(db.Model):
+    __tablename__ = "notification_receipts"
+    __table_args__ = (db.UniqueConstraint("user_id", "broadcast_id", name="uq_notification_receipt_user_broadcast"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user_info.id"), nullable=False)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey("broadcast_notifications.id"), nullable=False)
+    read_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+# Outbound email waiting to be sent by the outbox drainer; rows that exhaust
+# their retries stay behind with status "dead" as the dead-letter store
+class OutboxEmail(db.Model):
+    __tablename__ = "mail_outbox"
+    __table_args__ = (db.Index("ix_mail_outbox_status_next_attempt", "status", "next_attempt_at"),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=True)  # daily_reminder, monthly_report, ...
+    sender = db.Column(db.String, nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # JSON list of addresses
+    subject = db.Column(db.String, nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String, default='pending', nullable=False)  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    claimed_by = db.Column(db.String, nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    sent_at = db.Column(db.DateTime, nullable=True)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""Set-based notification fan-out.
+
+Instead of one ORM object per recipient, notifications for every active
+enrollment of a subject are written with ``INSERT ... SELECT`` in chunks of
+``chunk_size`` enrollments. Each chunk commits on its own so the SQLite write
+lock is only held briefly, and recipients that already have the notification
+are skipped, so a retried job never duplicates rows.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, literal, func, and_, exists
+from .models import db, Assignment, Notification, BroadcastNotification, UserEnrollment
+from .events import publish
+from .unread_counts import adjust_unread
+
+FANOUT_CHUNK_SIZE = 500
+
+
+def assignment_notification(assignment):
+    """Column values shared by every recipient of a new-assignment notification"""
+    return {
+        "title": f"New Assignment: {assignment.title}",
+        "message": f"A new {assignment.assignment_type} has been assigned. Deadline: {assignment.deadline.strftime('%B %d, %Y at %I:%M %p')}",
+        "notification_type": "assignment",
+        "related_id": assignment.id,
+        "related_type": "assignment",
+        "priority": "high" if assignment.deadline <= datetime.now() + timedelta(days=3) else "normal",
+    }
+
+
+def _recipients(subject_id):
+    return and_(UserEnrollment.subject_id == subject_id, UserEnrollment.is_active == True)
+
+
+def count_recipients(subject_id):
+    return db.session.query(func.count(UserEnrollment.id)).filter(_recipients(subject_id)).scalar()
+
+
+def fan_out(subject_id, values, chunk_size=FANOUT_CHUNK_SIZE, progress=None):
+    """Insert a notification with ``values`` for every active enrollment of a subject.
+
+    ``progress(done, total)`` is called after each committed chunk. Returns the
+    number of notifications created.
+    """
+    total = count_recipients(subject_id)
+    already_notified = exists().where(
+        Notification.user_id == UserEnrollment.user_id,
+        Notification.related_type == values["related_type"],
+        Notification.related_id == values["related_id"],
+    )
+    columns = ["user_id", "is_read"] + list(values)
+    created = done = 0
+    last_id = 0
+    while True:
+        chunk = select(UserEnrollment.id).where(
+            _recipients(subject_id), UserEnrollment.id > last_id
+        ).order_by(UserEnrollment.id).limit(chunk_size).subquery()
+        chunk_end, chunk_rows = db.session.execute(select(func.max(chunk.c.id), func.count(chunk.c.id))).one()
+        if not chunk_rows:
+            break
+        rows = select(
+            UserEnrollment.user_id, literal(False), *[literal(value) for value in values.values()]
+        ).where(
+            _recipients(subject_id), UserEnrollment.id > last_id, UserEnrollment.id <= chunk_end, ~already_notified
+        )
+        recipients = db.session.execute(
+            insert(Notification).from_select(columns, rows).returning(Notification.user_id)
+        ).scalars().all()
+        db.session.commit()
+        adjust_unread(recipients, personal=1)
+        created += len(recipients)
+        done += chunk_rows
+        last_id = chunk_end
+        if progress:
+            progress(done, total)
+    if created:
+        # Bulk inserts bypass the ORM publish hooks; wake the subject's streams
+        publish(f"subject:{subject_id}")
+    return created
+
+
+def fan_out_assignment(assignment_id, chunk_size=FANOUT_CHUNK_SIZE, progress=None):
+    """Notify every student enrolled in the assignment's subject"""
+    assignment = db.session.get(Assignment, assignment_id)
+    if assignment is None:
+        return 0
+    return fan_out(assignment.subject_id, assignment_notification(assignment), chunk_size, progress)
+
+
+def assignment_fanout_progress(assignment):
+    """Recipients and notifications created so far for an assignment"""
+    total = count_recipients(assignment.subject_id)
+    broadcast = db.session.query(BroadcastNotification.id).filter_by(
+        related_type="assignment", related_id=assignment.id
+    ).first()
+    if broadcast:
+        return {"total": total, "notified": total, "broadcast": True}
+    notified = db.session.query(func.count(Notification.id)).filter(
+        Notification.related_type == "assignment", Notification.related_id == assignment.id
+    ).scalar()
+    return {"total": total, "notified": notified}
@@ -0,0 +1,105 @@
+"""Per-user notification feed merging personal and broadcast notifications.
+
+Personal notifications are ordinary ``Notification`` rows. Class-wide ones
+(new assignments, announcements) are stored once per subject as
+``BroadcastNotification`` and only produce a ``NotificationReceipt`` row when a
+student reads them. A student's unread feed is therefore their unread personal
+rows plus the broadcasts of subjects they are actively enrolled in, posted
+since they enrolled, that have no receipt yet and have not expired.
+"""
+from datetime import datetime
+from sqlalchemy import and_, or_, func, literal
+from sqlalchemy.dialects.sqlite import insert
+from .models import db, Notification, BroadcastNotification, NotificationReceipt, UserEnrollment
+from .notification_fanout import assignment_notification
+
+
+def broadcast_assignment(assignment):
+    """Announce a new assignment to its subject with a single row (caller commits)"""
+    broadcast = BroadcastNotification(subject_id=assignment.subject_id, **assignment_notification(assignment))
+    db.session.add(broadcast)
+    return broadcast
+
+
+def unread_broadcasts(user_id):
+    """Query of broadcasts the user has not read yet"""
+    now = datetime.now()
+    return BroadcastNotification.query.join(
+        UserEnrollment, and_(
+            UserEnrollment.subject_id == BroadcastNotification.subject_id,
+            UserEnrollment.user_id == user_id,
+            UserEnrollment.is_active == True,
+            BroadcastNotification.created_at >= UserEnrollment.enrolled_at
+        )
+    ).outerjoin(
+        NotificationReceipt, and_(
+            NotificationReceipt.broadcast_id == BroadcastNotification.id,
+            NotificationReceipt.user_id == user_id
+        )
+    ).filter(
+        NotificationReceipt.id.is_(None),
+        or_(BroadcastNotification.expires_at.is_(None), BroadcastNotification.expires_at > now)
+    )
+
+
+def unread_personal(user_id):
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.is_read == False,
+        or_(Notification.expires_at.is_(None), Notification.expires_at > datetime.now())
+    )
+
+
+def unread_feed(user_id, limit=20):
+    """Newest unread personal and broadcast notifications as dicts, merged by created_at"""
+    personal = unread_personal(user_id).order_by(Notification.created_at.desc()).limit(limit).all()
+    broadcasts = unread_broadcasts(user_id).order_by(BroadcastNotification.created_at.desc()).limit(limit).all()
+    feed = [n.to_dict() for n in personal] + [b.to_dict(user_id) for b in broadcasts]
+    feed.sort(key=lambda item: item["created_at"], reverse=True)
+    return feed[:limit]
+
+
+def unread_summary(user_id):
+    """(personal count, newest personal id, broadcast count, newest broadcast id) of unread notifications"""
+    personal_count, personal_max = unread_personal(user_id).with_entities(
+        func.count(Notification.id), func.max(Notification.id)
+    ).one()
+    broadcast_count, broadcast_max = unread_broadcasts(user_id).with_entities(
+        func.count(BroadcastNotification.id), func.max(BroadcastNotification.id)
+    ).one()
+    return personal_count, personal_max, broadcast_count, broadcast_max
+
+
+def can_see_broadcast(user_id, broadcast):
+    return db.session.query(UserEnrollment.id).filter_by(
+        user_id=user_id, subject_id=broadcast.subject_id, is_active=True
+    ).first() is not None
+
+
+def mark_broadcast_read(user_id, broadcast_id):
+    """Record a read receipt; a no-op when one already exists (caller commits).
+
+    Returns whether a receipt was added.
+    """
+    return db.session.execute(
+        insert(NotificationReceipt).values(user_id=user_id, broadcast_id=broadcast_id, read_at=datetime.now())
+        .on_conflict_do_nothing(index_elements=["user_id", "broadcast_id"])
+    ).rowcount == 1
+
+
+def mark_all_read(user_id):
+    """Mark every unread notification read with one UPDATE and one INSERT ... SELECT (caller commits).
+
+    Returns the number of notifications marked.
+    """
+    personal = Notification.query.filter_by(user_id=user_id, is_read=False).update(
+        {"is_read": True}, synchronize_session=False
+    )
+    unread = unread_broadcasts(user_id).with_entities(
+        literal(user_id), BroadcastNotification.id, literal(datetime.now())
+    ).statement
+    broadcast = db.session.execute(
+        insert(NotificationReceipt).from_select(["user_id", "broadcast_id", "read_at"], unread)
+        .on_conflict_do_nothing(index_elements=["user_id", "broadcast_id"])
+    ).rowcount
+    return personal + broadcast
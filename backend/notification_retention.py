@@ -0,0 +1,76 @@
+"""Expiry and retention compaction for notifications.
+
+Removes personal notifications that have expired or were read more than
+``read_retention_days`` ago, and expired subject broadcasts together with their
+read receipts. Rows are deleted in id order, ``batch_size`` at a time, each
+batch in its own short transaction followed by a pause, so the SQLite write
+lock is never held for long and requests keep running during a pass. The
+receipts of expired broadcasts go first, in batches of their own, and a
+broadcast is only deleted once it has none left. A pass stops once
+``max_rows`` rows have been deleted; the next run continues with whatever is
+left.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, exists, and_, or_
+from .models import db, Notification, BroadcastNotification, NotificationReceipt
+
+COMPACTION_BATCH_SIZE = 500
+
+
+def _delete_batch(model, condition, last_id, limit):
+    """Delete up to ``limit`` matching rows after ``last_id``; returns the deleted ids"""
+    ids = db.session.execute(
+        select(model.id).where(condition, model.id > last_id).order_by(model.id).limit(limit)
+    ).scalars().all()
+    if ids:
+        db.session.execute(delete(model).where(model.id.in_(ids)))
+    return ids
+
+
+def compact_notifications(read_retention_days=30, batch_size=COMPACTION_BATCH_SIZE, max_rows=20000, pause=0.05):
+    """Delete expired and old read notifications within a write budget of ``max_rows`` deleted rows.
+
+    Returns a report of the rows removed per kind, the batches committed and
+    whether the budget ran out before everything eligible was removed.
+    """
+    now = datetime.now()
+    expired_broadcasts = select(BroadcastNotification.id).where(BroadcastNotification.expires_at < now)
+    kinds = [
+        ("notifications", Notification, or_(
+            Notification.expires_at < now,
+            and_(Notification.is_read == True, Notification.created_at < now - timedelta(days=read_retention_days))
+        )),
+        ("receipts", NotificationReceipt, NotificationReceipt.broadcast_id.in_(expired_broadcasts)),
+        # Broadcasts read again since their receipts were removed wait for the next run
+        ("broadcasts", BroadcastNotification, and_(
+            BroadcastNotification.expires_at < now,
+            ~exists().where(NotificationReceipt.broadcast_id == BroadcastNotification.id)
+        )),
+    ]
+    report = {"notifications": 0, "broadcasts": 0, "receipts": 0, "batches": 0, "budget_exhausted": False}
+    budget = max_rows
+    for name, model, condition in kinds:
+        last_id = 0
+        while True:
+            if budget <= 0:
+                report["budget_exhausted"] = True
+                return report
+            limit = min(batch_size, budget)
+            try:
+                ids = _delete_batch(model, condition, last_id, limit)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error compacting {name} after id {last_id}: {e}")
+                return report
+            if not ids:
+                break
+            report[name] += len(ids)
+            report["batches"] += 1
+            budget -= len(ids)
+            last_id = ids[-1]
+            if len(ids) < limit:
+                break
+            time.sleep(pause)
+    return report
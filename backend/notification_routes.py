@@ -1,6 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from backend.models import db, User_Info, Assignment, AssignmentSubmission, Notification, UserEnrollment, TeacherSubject
+from backend.models import db, User_Info, Assignment, AssignmentSubmission, Notification, BroadcastNotification, UserEnrollment, TeacherSubject
+from backend.caching import conditional_get
+from backend.notification_fanout import fan_out_assignment, count_recipients, assignment_fanout_progress
+from backend.tasks import assignment_fanout_task
+from backend.events import event_stream
+from backend.notification_feed import broadcast_assignment, unread_feed, unread_summary, can_see_broadcast, mark_broadcast_read, mark_all_read
+from backend.unread_counts import unread_count, adjust_unread, broadcasts_changed, reset_unread
 from datetime import datetime, timedelta
 
 # Create blueprint for notification routes
@@ -29,12 +35,44 @@ def teacher_assignments(teacher_id):
         Assignment.is_active == True
     ).order_by(Assignment.deadline.asc()).all()
     
+    # Fan-out queued by the create form, polled on the page until it finishes
+    fanout = None
+    if request.args.get("fanout_task") and request.args.get("fanout_assignment", type=int):
+        fanout = {
+            "task_id": request.args["fanout_task"],
+            "progress_url": url_for("notifications.api_assignment_fanout_status",
+                                    assignment_id=request.args.get("fanout_assignment", type=int),
+                                    task_id=request.args["fanout_task"])
+        }
+    
     return render_template("teacher_assignments.html",
                          teacher=teacher,
                          assignments=assignments,
                          upcoming_deadlines=upcoming_deadlines,
+                         fanout=fanout,
                          current_date=datetime.now().strftime("%d %B, %Y"))
 
+def _assignment_created(teacher_id, assignment, message, task_id=None):
+    """JSON for API clients, otherwise flash and back to the assignment list.
+
+    ``task_id`` is the queued fan-out task, handed back so its progress can be
+    polled from ``/api/assignments/<id>/fanout?task_id=``.
+    """
+    progress_url = url_for("notifications.api_assignment_fanout_status",
+                           assignment_id=assignment.id, task_id=task_id) if task_id else None
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({
+            "success": True,
+            "assignment_id": assignment.id,
+            "task_id": task_id,
+            "progress_url": progress_url
+        }), 202 if task_id else 201
+    flash(message, "success")
+    if task_id:
+        return redirect(url_for("notifications.teacher_assignments", teacher_id=teacher_id,
+                                fanout_assignment=assignment.id, fanout_task=task_id))
+    return redirect(url_for("notifications.teacher_assignments", teacher_id=teacher_id))
+
 @notification_bp.route("/teacher/<int:teacher_id>/assignments/new", methods=["GET", "POST"])
 @login_required
 def teacher_create_assignment(teacher_id):
@@ -79,29 +117,29 @@ def teacher_create_assignment(teacher_id):
         )
         
         db.session.add(assignment)
-        db.session.commit()
-        
-        # Create notifications for enrolled students
-        enrolled_students = UserEnrollment.query.filter_by(
-            subject_id=int(subject_id),
-            is_active=True
-        ).all()
         
-        for enrollment in enrolled_students:
-            notification = Notification(
-                user_id=enrollment.user_id,
-                title=f"New Assignment: {title}",
-                message=f"A new {assignment_type} has been assigned. Deadline: {deadline.strftime('%B %d, %Y at %I:%M %p')}",
-                notification_type="assignment",
-                related_id=assignment.id,
-                related_type="assignment",
-                priority="high" if deadline <= datetime.now() + timedelta(days=3) else "normal"
-            )
-            db.session.add(notification)
+        recipients = count_recipients(assignment.subject_id)
+        threshold = current_app.config.get("NOTIFICATION_BROADCAST_THRESHOLD", 0)
+        if threshold is not None and recipients >= threshold:
+            # Large class: one broadcast row for the whole subject, merged into feeds at read time
+            db.session.flush()
+            broadcast_assignment(assignment)
+            db.session.commit()
+            broadcasts_changed(assignment.subject_id)
+            return _assignment_created(teacher_id, assignment, f"Assignment created! {recipients} students notified.")
         
         db.session.commit()
-        flash("Assignment created successfully!", "success")
-        return redirect(url_for("notifications.teacher_assignments", teacher_id=teacher_id))
+        
+        # Notify enrolled students off the request path
+        try:
+            task = assignment_fanout_task.delay(assignment.id)
+        except Exception as e:
+            print(f"Error queueing notification fan-out, notifying inline: {e}")
+            created = fan_out_assignment(assignment.id)
+            return _assignment_created(teacher_id, assignment, f"Assignment created! {created} students notified.")
+        return _assignment_created(teacher_id, assignment,
+                                   f"Assignment created! Notifying {recipients} students in the background.",
+                                   task_id=task.id)
     
     # Get subjects taught by this teacher
     teacher_subjects = TeacherSubject.query.filter_by(teacher_user_id=teacher_id).all()
@@ -140,11 +178,8 @@ def user_assignments(user_id):
         Assignment.is_active == True
     ).order_by(Assignment.deadline.asc()).all()
     
-    # Get notifications
-    notifications = Notification.query.filter_by(
-        user_id=user_id,
-        is_read=False
-    ).order_by(Notification.created_at.desc()).limit(10).all()
+    # Get notifications (personal and subject broadcasts)
+    notifications = unread_feed(user_id, limit=10)
     
     return render_template("user_assignments.html",
                          user=user,
@@ -153,19 +188,84 @@ def user_assignments(user_id):
                          notifications=notifications,
                          current_date=datetime.now().strftime("%d %B, %Y"))
 
+def notifications_validator(user_id):
+    """ETag seed for a user's unread feed: unread counts and newest ids, personal and broadcast.
+
+    No Last-Modified: marking notifications read changes the feed without
+    creating anything newer, which only the unread counts in the ETag reflect.
+    """
+    if current_user.id != user_id:
+        return None
+    return unread_summary(user_id), None
+
 @notification_bp.route("/api/notifications/<int:user_id>")
 @login_required
+@conditional_get(notifications_validator)
 def api_user_notifications(user_id):
     """API endpoint to get user notifications"""
     if current_user.id != user_id:
         return jsonify({"error": "Unauthorized"}), 403
     
-    notifications = Notification.query.filter_by(
-        user_id=user_id,
-        is_read=False
-    ).order_by(Notification.created_at.desc()).limit(20).all()
+    return jsonify(unread_feed(user_id, limit=20))
+
+@notification_bp.route("/api/notifications/<int:user_id>/count")
+@login_required
+def api_unread_count(user_id):
+    """API endpoint for the unread badge count"""
+    if current_user.id != user_id:
+        return jsonify({"error": "Unauthorized"}), 403
     
-    return jsonify([n.to_dict() for n in notifications])
+    return jsonify({"unread": unread_count(user_id)})
+
+@notification_bp.route("/api/notifications/<int:user_id>/read_all", methods=["POST"])
+@login_required
+def api_mark_all_notifications_read(user_id):
+    """Mark all of a user's notifications, personal and broadcast, as read"""
+    if current_user.id != user_id:
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    marked = mark_all_read(user_id)
+    db.session.commit()
+    reset_unread(user_id)
+    
+    return jsonify({"success": True, "marked": marked})
+
+@notification_bp.route("/api/events/stream")
+@login_required
+def api_event_stream():
+    """Server-Sent Events stream of new notifications and discussion messages"""
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    stream = event_stream(
+        current_user._get_current_object(),
+        last_event_id,
+        heartbeat=current_app.config.get("EVENTS_HEARTBEAT_SECONDS", 15),
+        max_duration=current_app.config.get("EVENTS_MAX_STREAM_SECONDS", 1800)
+    )
+    return Response(stream_with_context(stream), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@notification_bp.route("/api/assignments/<int:assignment_id>/fanout")
+@login_required
+def api_assignment_fanout_status(assignment_id):
+    """Progress of the notification fan-out for an assignment (teacher only)"""
+    assignment = Assignment.query.get_or_404(assignment_id)
+    
+    if current_user.id != assignment.teacher_id:
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    status = assignment_fanout_progress(assignment)
+    task_id = request.args.get("task_id")
+    if task_id:
+        try:
+            result = assignment_fanout_task.AsyncResult(task_id)
+            status["state"] = result.state
+            if isinstance(result.info, dict):
+                status.update(result.info)
+        except Exception as e:
+            print(f"Error reading fan-out task {task_id}: {e}")
+    return jsonify(status)
 
 @notification_bp.route("/api/notifications/<int:notification_id>/read", methods=["POST"])
 @login_required
@@ -176,8 +276,29 @@ def api_mark_notification_read(notification_id):
     if notification.user_id != current_user.id:
         return jsonify({"error": "Unauthorized"}), 403
     
-    notification.is_read = True
+    # Conditional UPDATE so a repeated request does not decrement the counter twice
+    marked = Notification.query.filter_by(id=notification_id, is_read=False).update(
+        {"is_read": True}, synchronize_session=False
+    )
+    db.session.commit()
+    if marked:
+        adjust_unread([current_user.id], personal=-1)
+    
+    return jsonify({"success": True})
+
+@notification_bp.route("/api/notifications/broadcast/<int:broadcast_id>/read", methods=["POST"])
+@login_required
+def api_mark_broadcast_read(broadcast_id):
+    """Mark a subject broadcast as read for the current user"""
+    broadcast = BroadcastNotification.query.get_or_404(broadcast_id)
+    
+    if not can_see_broadcast(current_user.id, broadcast):
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    added = mark_broadcast_read(current_user.id, broadcast.id)
     db.session.commit()
+    if added:
+        adjust_unread([current_user.id], broadcast=-1)
     
     return jsonify({"success": True})
 
@@ -0,0 +1,88 @@
+"""Progress engine for the student dashboard.
+
+Computes latest-attempt scores, question totals, completion counts and average
+percentages for a user's subjects in a fixed number of queries, independent of
+how many subjects or quizzes are involved.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from .models import db, Subject, Chapter, Quiz, Question, UserQuizStats
+
+
+def load_subjects(*criteria):
+    """Load subjects with their chapters and quizzes eagerly (three queries total)"""
+    return Subject.query.filter(*criteria).options(
+        selectinload(Subject.chapters).selectinload(Chapter.quizzes)
+    ).all()
+
+
+def latest_scores(user_id, subject_ids):
+    """Map quiz_id -> total_scored of the user's latest attempt, for the given subjects.
+
+    Reads the UserQuizStats rollup, so the cost is one row per attempted quiz
+    regardless of how many times each quiz was attempted.
+    """
+    rows = db.session.query(UserQuizStats.quiz_id, UserQuizStats.latest_score).join(
+        Quiz, Quiz.id == UserQuizStats.quiz_id
+    ).join(Chapter, Chapter.id == Quiz.chapter_id).filter(
+        UserQuizStats.user_id == user_id,
+        Chapter.subject_id.in_(subject_ids)
+    ).all()
+    return dict(rows)
+
+
+def question_totals(subject_ids):
+    """Map quiz_id -> number of questions, for the given subjects"""
+    rows = db.session.query(Question.quiz_id, func.count(Question.id)).join(
+        Quiz, Quiz.id == Question.quiz_id
+    ).join(Chapter, Chapter.id == Quiz.chapter_id).filter(
+        Chapter.subject_id.in_(subject_ids)
+    ).group_by(Question.quiz_id).all()
+    return dict(rows)
+
+
+def apply_progress(user_id, subjects):
+    """Attach progress attributes to subjects and their quizzes.
+
+    Sets ``user_score``, ``user_percentage`` and ``total_questions`` on every quiz
+    and ``progress_percentage``, ``total_quizzes`` and ``completed_quizzes`` on
+    every subject. Subjects should come from ``load_subjects`` so that walking
+    chapters and quizzes does not trigger lazy loads.
+    """
+    subject_ids = [subject.id for subject in subjects]
+    if not subject_ids:
+        return subjects
+
+    latest = latest_scores(user_id, subject_ids)
+    totals = question_totals(subject_ids)
+
+    for subject in subjects:
+        total_quizzes = 0
+        completed_quizzes = 0
+        total_score_percentage = 0
+        scored_quizzes = 0
+
+        for chapter in subject.chapters:
+            for quiz in chapter.quizzes:
+                total_quizzes += 1
+                total_questions = totals.get(quiz.id, 0)
+                latest_score = latest.get(quiz.id)
+                quiz.total_questions = total_questions
+
+                if latest_score is not None:
+                    completed_quizzes += 1
+
+                if latest_score is not None and total_questions > 0:
+                    quiz.user_score = latest_score
+                    quiz.user_percentage = (latest_score / total_questions) * 100
+                    total_score_percentage += quiz.user_percentage
+                    scored_quizzes += 1
+                else:
+                    quiz.user_score = None
+                    quiz.user_percentage = 0
+
+        subject.total_quizzes = total_quizzes
+        subject.completed_quizzes = completed_quizzes
+        subject.progress_percentage = total_score_percentage / scored_quizzes if scored_quizzes else 0
+
+    return subjects
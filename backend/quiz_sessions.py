@@ -0,0 +1,351 @@
+"""Server-side timed quiz sessions.
+
+Starting a quiz creates a session holding the start time, the deadline derived
+from ``Quiz.time_duration`` and the answers saved so far. Sessions live in
+Redis (one hash per session plus a sorted set of deadlines) or, when Redis is
+unreachable, in process memory. Autosaves only write the changed answers to
+the store; the database is touched once, when the session is submitted by the
+student or auto-submitted by the sweeper after its deadline. Submissions use
+``session:<id>`` as idempotency key, so a race between the two records a
+single Score.
+"""
+import os
+import re
+import threading
+import time
+import uuid
+import redis
+from flask import current_app
+from .models import db
+from .grading import get_answer_key, grade_answers
+from .submissions import submit_score
+
+UNIT_SECONDS = {"h": 3600, "hr": 3600, "hour": 3600, "m": 60, "min": 60, "minute": 60,
+                "s": 1, "sec": 1, "second": 1}
+
+
+def parse_duration(text):
+    """Seconds allowed by a free-text ``Quiz.time_duration``, or None when it has no limit.
+
+    Accepts "HH:MM" (as labelled on the quiz forms), "HH:MM:SS", unit strings
+    such as "1 hour 30 min", "45m" or "90 seconds", and bare numbers as minutes.
+    """
+    text = (text or "").strip().lower()
+    if not text:
+        return None
+    if re.fullmatch(r"\d+(:\d+){1,2}", text):
+        parts = [int(part) for part in text.split(":")]
+        hours, minutes, seconds = parts if len(parts) == 3 else parts + [0]
+        return hours * 3600 + minutes * 60 + seconds or None
+    units = re.findall(r"(\d+)\s*(hours?|hrs?|h|minutes?|mins?|m|seconds?|secs?|s)(?![a-z])", text)
+    if units:
+        return sum(int(value) * UNIT_SECONDS[unit.rstrip("s") or "s"] for value, unit in units) or None
+    number = re.search(r"\d+", text)
+    if number is None:
+        return None
+    return int(number.group()) * 60 or None
+
+
+class MemorySessionStore:
+    """Process-local store, used when Redis is unavailable"""
+
+    def __init__(self, retention=24 * 3600):
+        self.retention = retention
+        self._sessions = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def create(self, session):
+        with self._lock:
+            self._sessions[session["id"]] = dict(session, answers={}, finished=False)
+            self._active[(session["user_id"], session["quiz_id"])] = session["id"]
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return dict(session, answers=dict(session["answers"])) if session else None
+
+    def active_for(self, user_id, quiz_id):
+        with self._lock:
+            return self._active.get((user_id, quiz_id))
+
+    def save_answers(self, session_id, answers):
+        with self._lock:
+            self._sessions[session_id]["answers"].update(answers)
+
+    def claim(self, session_id):
+        """Mark the session finished; True only for the first caller"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if not session or session["finished"]:
+                return False
+            session["finished"] = True
+            self._active.pop((session["user_id"], session["quiz_id"]), None)
+            return True
+
+    def release(self, session_id):
+        """Undo a claim whose submission failed, so it can be submitted again"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                session["finished"] = False
+                self._active.setdefault((session["user_id"], session["quiz_id"]), session_id)
+
+    def due(self, now, limit=100):
+        with self._lock:
+            # Forget sessions past their retention, like the Redis key expiry does
+            for session_id, session in list(self._sessions.items()):
+                if (session["deadline"] or session["started_at"]) + self.retention < now:
+                    del self._sessions[session_id]
+                    if self._active.get((session["user_id"], session["quiz_id"])) == session_id:
+                        del self._active[(session["user_id"], session["quiz_id"])]
+            return [session_id for session_id, session in self._sessions.items()
+                    if not session["finished"] and session["deadline"] is not None
+                    and session["deadline"] <= now][:limit]
+
+    def purge(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore:
+    """One hash per session (answers as ``a:<question_id>`` fields) plus a deadline index.
+
+    The client must be created with ``decode_responses=True``.
+    """
+
+    def __init__(self, client, prefix="quiz_session", retention=24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.retention = retention
+        self.deadlines = f"{prefix}:deadlines"
+
+    def _key(self, session_id):
+        return f"{self.prefix}:{session_id}"
+
+    def _active_key(self, user_id, quiz_id):
+        return f"{self.prefix}:active:{user_id}:{quiz_id}"
+
+    def _ttl(self, session):
+        if session["deadline"] is None:
+            return self.retention
+        return int(session["deadline"] - time.time()) + self.retention
+
+    def create(self, session):
+        key = self._key(session["id"])
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={
+            "id": session["id"],
+            "user_id": session["user_id"],
+            "quiz_id": session["quiz_id"],
+            "started_at": session["started_at"],
+            "deadline": "" if session["deadline"] is None else session["deadline"],
+        })
+        pipe.expire(key, self._ttl(session))
+        pipe.set(self._active_key(session["user_id"], session["quiz_id"]), session["id"], ex=self._ttl(session))
+        if session["deadline"] is not None:
+            pipe.zadd(self.deadlines, {session["id"]: session["deadline"]})
+        pipe.execute()
+
+    def get(self, session_id):
+        fields = self.client.hgetall(self._key(session_id))
+        if not fields:
+            return None
+        return {
+            "id": fields["id"],
+            "user_id": int(fields["user_id"]),
+            "quiz_id": int(fields["quiz_id"]),
+            "started_at": float(fields["started_at"]),
+            "deadline": float(fields["deadline"]) if fields["deadline"] else None,
+            "finished": fields.get("finished") == "1",
+            "answers": {name[2:]: value for name, value in fields.items() if name.startswith("a:")},
+        }
+
+    def active_for(self, user_id, quiz_id):
+        return self.client.get(self._active_key(user_id, quiz_id))
+
+    def save_answers(self, session_id, answers):
+        if answers:
+            self.client.hset(self._key(session_id),
+                             mapping={f"a:{question_id}": value for question_id, value in answers.items()})
+
+    def claim(self, session_id):
+        """Mark the session finished; True only for the first caller"""
+        key = self._key(session_id)
+        if not self.client.exists(key) or not self.client.hsetnx(key, "finished", "1"):
+            return False
+        fields = self.client.hmget(key, "user_id", "quiz_id")
+        pipe = self.client.pipeline()
+        pipe.zrem(self.deadlines, session_id)
+        if fields[0] is not None:
+            pipe.delete(self._active_key(*fields))
+        pipe.execute()
+        return True
+
+    def release(self, session_id):
+        """Undo a claim whose submission failed, so it can be submitted again"""
+        session = self.get(session_id)
+        if session is None:
+            return
+        pipe = self.client.pipeline()
+        pipe.hdel(self._key(session_id), "finished")
+        pipe.set(self._active_key(session["user_id"], session["quiz_id"]), session_id,
+                 ex=max(self._ttl(session), 1), nx=True)
+        if session["deadline"] is not None:
+            pipe.zadd(self.deadlines, {session_id: session["deadline"]})
+        pipe.execute()
+
+    def due(self, now, limit=100):
+        return self.client.zrangebyscore(self.deadlines, 0, now, start=0, num=limit)
+
+    def purge(self, session_id):
+        self.client.zrem(self.deadlines, session_id)
+
+
+def _state(session, now=None):
+    now = now or time.time()
+    remaining = None if session["deadline"] is None else max(0, int(session["deadline"] - now))
+    return {
+        "session_id": session["id"],
+        "quiz_id": session["quiz_id"],
+        "started_at": session["started_at"],
+        "deadline": session["deadline"],
+        "remaining_seconds": remaining,
+        "finished": session["finished"],
+        "answers": session["answers"],
+    }
+
+
+class QuizSessionManager:
+    """Starts, autosaves and submits quiz sessions, and auto-submits expired ones"""
+
+    def __init__(self, app, store, grace_seconds=5, sweep_interval=5):
+        self.app = app
+        self.store = store
+        self.grace_seconds = grace_seconds
+        self.sweep_interval = sweep_interval
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+
+    def start(self, user_id, quiz):
+        """Start a session for the quiz, or resume the user's unfinished one"""
+        self.start_sweeper()
+        session_id = self.store.active_for(user_id, quiz.id)
+        session = self.store.get(session_id) if session_id else None
+        if session and not session["finished"] and not self.expired(session):
+            return _state(session)
+
+        now = time.time()
+        duration = parse_duration(quiz.time_duration)
+        session = {
+            "id": uuid.uuid4().hex,
+            "user_id": int(user_id),
+            "quiz_id": quiz.id,
+            "started_at": now,
+            "deadline": now + duration if duration else None,
+        }
+        self.store.create(session)
+        return _state(dict(session, answers={}, finished=False), now)
+
+    def get(self, session_id, user_id=None):
+        session = self.store.get(session_id)
+        if session is None or (user_id is not None and session["user_id"] != int(user_id)):
+            return None
+        return session
+
+    def state(self, session):
+        return _state(session)
+
+    def expired(self, session, now=None):
+        return session["deadline"] is not None and (now or time.time()) > session["deadline"] + self.grace_seconds
+
+    def autosave(self, session, answers):
+        """Merge partial answers into the session; False once it is finished or expired"""
+        if session["finished"] or self.expired(session):
+            return False
+        self.store.save_answers(session["id"], {str(k): str(v) for k, v in answers.items()})
+        return True
+
+    def submit(self, session, answers=None):
+        """Grade and record the session; answers sent after the deadline are ignored.
+
+        Returns the SubmissionResult, or None when the session had already been
+        submitted (by another request or the sweeper) or its quiz no longer exists. When grading or recording
+        fails the claim is released and the error re-raised, so a retry or the
+        sweeper submits it again; the ``session:<id>`` key keeps that to one Score.
+        """
+        if answers and not self.expired(session):
+            self.store.save_answers(session["id"], {str(k): str(v) for k, v in answers.items()})
+        if not self.store.claim(session["id"]):
+            return None
+        try:
+            saved = self.store.get(session["id"]) or session
+            answer_key = get_answer_key(session["quiz_id"])
+            if answer_key is None:
+                # The quiz was deleted during the attempt; there is nothing to grade against
+                self.store.purge(session["id"])
+                return None
+            return submit_score(session["user_id"], session["quiz_id"], grade_answers(answer_key, saved["answers"]),
+                                len(answer_key.answers), f"session:{session['id']}")
+        except Exception:
+            self.store.release(session["id"])
+            raise
+
+    def sweep(self):
+        """Auto-submit sessions whose deadline (plus grace) has passed"""
+        submitted = 0
+        with self.app.app_context():
+            for session_id in self.store.due(time.time() - self.grace_seconds):
+                session = self.store.get(session_id)
+                if session is None:
+                    self.store.purge(session_id)
+                    continue
+                try:
+                    if self.submit(session):
+                        submitted += 1
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error auto-submitting quiz session {session_id}: {e}")
+        return submitted
+
+    def start_sweeper(self):
+        """Start the sweeper thread once per process (workers may be forked)"""
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+            threading.Thread(target=self._run_sweeper, name="quiz-session-sweeper", daemon=True).start()
+
+    def _run_sweeper(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping quiz sessions: {e}")
+
+
+def init_quiz_sessions(app, store=None):
+    """Attach a QuizSessionManager, using Redis at QUIZ_SESSION_REDIS_URL when reachable"""
+    if store is None:
+        try:
+            client = redis.from_url(app.config["QUIZ_SESSION_REDIS_URL"], decode_responses=True)
+            client.ping()
+            store = RedisSessionStore(client)
+        except Exception as e:
+            print(f"Quiz sessions falling back to in-memory store: {e}")
+            store = MemorySessionStore()
+    manager = QuizSessionManager(
+        app, store,
+        grace_seconds=app.config.get("QUIZ_SESSION_GRACE_SECONDS", 5),
+        sweep_interval=app.config.get("QUIZ_SESSION_SWEEP_INTERVAL", 5)
+    )
+    app.extensions["quiz_sessions"] = manager
+    manager.start_sweeper()
+    return manager
+
+
+def get_quiz_sessions():
+    return current_app.extensions["quiz_sessions"]
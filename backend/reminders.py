@@ -0,0 +1,31 @@
+"""Recipient selection for the daily quiz reminder.
+
+Students who have not attempted a quiz today are found with one anti-join
+(``NOT EXISTS`` against Score, served by the (user_id, time_stamp_of_attempt)
+index) and streamed from the database ``batch_size`` rows at a time, so the
+selection never materializes the whole student table and each batch can be
+handed to a send task as soon as it is read.
+"""
+from datetime import datetime, time
+from sqlalchemy import select, exists
+from .models import db, User_Info, Score
+from .email_templates import DAILY_REMINDER
+
+REMINDER_BATCH_SIZE = 500
+
+
+def reminder_recipients(day, batch_size=REMINDER_BATCH_SIZE):
+    """Yield lists of (email, full name) for students with no attempt on ``day``"""
+    attempted = exists().where(
+        Score.user_id == User_Info.id,
+        Score.time_stamp_of_attempt >= datetime.combine(day, time.min)
+    )
+    stmt = select(User_Info.email, User_Info.full_name).where(
+        User_Info.role == 1, ~attempted
+    ).order_by(User_Info.id).execution_options(yield_per=batch_size)
+    for partition in db.session.execute(stmt).partitions():
+        yield [(email, full_name) for email, full_name in partition]
+
+
+def reminder_message(user_email, user_name):
+    return DAILY_REMINDER.message(user_email, name=user_name)
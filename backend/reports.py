@@ -0,0 +1,39 @@
+"""Monthly activity reports.
+
+Every student's figures for the last 30 days come from a single GROUP BY over
+Score; the resulting messages are queued in the mail outbox with one INSERT.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from .models import db, User_Info, Score
+from .mail_outbox import enqueue_mail
+from .email_templates import MONTHLY_REPORT
+
+ReportRow = namedtuple("ReportRow", ["email", "full_name", "quizzes_taken", "average_score", "total_score"])
+
+
+def monthly_report_rows(since):
+    """One row per student with at least one attempt since ``since``"""
+    rows = db.session.query(
+        User_Info.email,
+        User_Info.full_name,
+        func.count(Score.id),
+        func.avg(Score.total_scored),
+        func.sum(Score.total_scored)
+    ).join(Score, Score.user_id == User_Info.id).filter(
+        User_Info.role == 1,
+        Score.time_stamp_of_attempt >= since
+    ).group_by(User_Info.id).order_by(User_Info.id)
+    return [ReportRow(email, full_name, count, round(average, 2), total)
+            for email, full_name, count, average, total in rows]
+
+
+def monthly_report_message(row):
+    return MONTHLY_REPORT.message(row.email, report=row)
+
+
+def queue_monthly_reports(days=30):
+    """Queue every student's report for the last ``days`` days in the mail outbox (caller commits)"""
+    rows = monthly_report_rows(datetime.now() - timedelta(days=days))
+    return enqueue_mail((monthly_report_message(row) for row in rows), kind="monthly_report")
@@ -0,0 +1,113 @@
+"""Maintenance of the UserQuizStats rollup.
+
+Every Score insert goes through ``record_score`` (``record_scores`` for
+batches) so that best, latest, sum and attempt count per (user, quiz) are
+updated in the same transaction. Readers can then use the rollup instead of
+re-aggregating raw Score rows.
+"""
+from sqlalchemy import func, case, select
+from sqlalchemy.dialects.sqlite import insert
+from .models import db, Score, UserQuizStats
+
+
+def record_score(score):
+    """Fold a newly added Score into the rollup (caller commits)"""
+    record_scores([(score.user_id, score.quiz_id, score.total_scored, score.time_stamp_of_attempt)])
+
+
+def record_scores(scores):
+    """Fold many new (user_id, quiz_id, total_scored, attempted_at) scores into the rollup (caller commits).
+
+    Scores are folded per (user, quiz) first, then written with one
+    executemany upsert.
+    """
+    folded = {}
+    for user_id, quiz_id, total_scored, attempted_at in scores:
+        row = folded.get((user_id, quiz_id))
+        if row is None:
+            folded[(user_id, quiz_id)] = {
+                "user_id": user_id, "quiz_id": quiz_id, "attempt_count": 1, "best_score": total_scored,
+                "latest_score": total_scored, "latest_attempt_at": attempted_at, "score_sum": total_scored,
+            }
+            continue
+        row["attempt_count"] += 1
+        row["best_score"] = max(row["best_score"], total_scored)
+        row["score_sum"] += total_scored
+        if attempted_at >= row["latest_attempt_at"]:
+            row["latest_score"], row["latest_attempt_at"] = total_scored, attempted_at
+    if not folded:
+        return
+    stmt = insert(UserQuizStats)
+    is_latest = func.coalesce(UserQuizStats.latest_attempt_at <= stmt.excluded.latest_attempt_at, True)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserQuizStats.user_id, UserQuizStats.quiz_id],
+        set_={
+            "attempt_count": UserQuizStats.attempt_count + stmt.excluded.attempt_count,
+            "best_score": func.max(UserQuizStats.best_score, stmt.excluded.best_score),
+            "latest_score": case((is_latest, stmt.excluded.latest_score), else_=UserQuizStats.latest_score),
+            "latest_attempt_at": case((is_latest, stmt.excluded.latest_attempt_at), else_=UserQuizStats.latest_attempt_at),
+            "score_sum": UserQuizStats.score_sum + stmt.excluded.score_sum,
+        }
+    )
+    db.session.execute(stmt, list(folded.values()))
+
+
+def rebuild_user_quiz_stats():
+    """Rebuild the whole rollup from Score history; returns the number of rows written"""
+    totals = select(
+        Score.user_id.label("user_id"),
+        Score.quiz_id.label("quiz_id"),
+        func.count(Score.id).label("attempt_count"),
+        func.max(Score.total_scored).label("best_score"),
+        func.max(Score.time_stamp_of_attempt).label("latest_attempt_at"),
+        func.sum(Score.total_scored).label("score_sum")
+    ).group_by(Score.user_id, Score.quiz_id).subquery()
+
+    ranked = select(
+        Score.user_id.label("user_id"),
+        Score.quiz_id.label("quiz_id"),
+        Score.total_scored.label("total_scored"),
+        func.row_number().over(
+            partition_by=(Score.user_id, Score.quiz_id),
+            order_by=(Score.time_stamp_of_attempt.desc(), Score.id.desc())
+        ).label("rn")
+    ).subquery()
+
+    rows = select(
+        totals.c.user_id,
+        totals.c.quiz_id,
+        totals.c.attempt_count,
+        totals.c.best_score,
+        ranked.c.total_scored,
+        totals.c.latest_attempt_at,
+        totals.c.score_sum
+    ).join(ranked, (ranked.c.user_id == totals.c.user_id) & (ranked.c.quiz_id == totals.c.quiz_id)).where(ranked.c.rn == 1)
+
+    try:
+        db.session.query(UserQuizStats).delete()
+        result = db.session.execute(
+            UserQuizStats.__table__.insert().from_select(
+                ["user_id", "quiz_id", "attempt_count", "best_score", "latest_score", "latest_attempt_at", "score_sum"],
+                rows
+            )
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result.rowcount
+
+
+def init_score_stats(app):
+    """Backfill the rollup from Score history when it is empty, e.g. on first deploy"""
+    with app.app_context():
+        has_stats = db.session.query(UserQuizStats.user_id).first() is not None
+        if has_stats or db.session.query(Score.id).first() is None:
+            return 0
+        try:
+            rows = rebuild_user_quiz_stats()
+        except Exception as e:
+            print(f"Error backfilling score stats: {e}")
+            return 0
+        print(f"Backfilled score stats for {rows} user/quiz pairs")
+        return rows
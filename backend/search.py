@@ -0,0 +1,169 @@
+"""Full-text search over the catalog and users, backed by SQLite FTS5.
+
+A single ``search_index`` FTS5 table holds one row per subject, chapter, quiz,
+question and user. Rows are kept in sync by SQLite triggers on the source
+tables, so every write path (ORM, cascades, raw SQL) updates the index in the
+same transaction. Each row's rowid encodes ``entity_id * 8 + type code`` so the
+triggers can replace or remove a row by primary key.
+
+When FTS5 is not available (e.g. a non-SQLite database) searches fall back to
+``LIKE`` queries against the source tables.
+"""
+import re
+from flask import current_app
+from sqlalchemy import text, or_
+from .models import db, Subject, Chapter, Quiz, Question, User_Info
+
+# entity type -> (type code, table, title expression, body expression)
+INDEXED_ENTITIES = {
+    "subject": (1, "subject", "{row}.name", "coalesce({row}.description, '')"),
+    "chapter": (2, "chapter", "{row}.name", "coalesce({row}.description, '')"),
+    "quiz": (3, "quiz", "{row}.name", "coalesce({row}.remarks, '')"),
+    "question": (4, "question", "{row}.question_statement",
+                 "{row}.option1 || ' ' || {row}.option2 || ' ' || {row}.option3 || ' ' || {row}.option4"),
+    "user": (5, "user_info", "{row}.full_name", "{row}.email || ' ' || coalesce({row}.qualification, '')"),
+}
+
+# Columns used by the LIKE fallback
+FALLBACK_COLUMNS = {
+    "subject": (Subject, [Subject.name, Subject.description]),
+    "chapter": (Chapter, [Chapter.name, Chapter.description]),
+    "quiz": (Quiz, [Quiz.name, Quiz.remarks]),
+    "question": (Question, [Question.question_statement]),
+    "user": (User_Info, [User_Info.full_name, User_Info.email, User_Info.qualification]),
+}
+
+# bm25 column weights: entity_type, entity_id, title, body
+RANKING = "bm25(search_index, 0.0, 0.0, 10.0, 1.0)"
+# Most matches a search page lists; pages say when results were cut off
+SEARCH_RESULT_LIMIT = 200
+
+
+def _create_statements():
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "entity_type UNINDEXED, entity_id UNINDEXED, title, body, prefix='2 3')"
+    ]
+    for entity_type, (code, table, title, body) in INDEXED_ENTITIES.items():
+        insert_new = (
+            f"INSERT INTO search_index(rowid, entity_type, entity_id, title, body) VALUES "
+            f"(new.id * 8 + {code}, '{entity_type}', new.id, {title.format(row='new')}, {body.format(row='new')});"
+        )
+        delete_old = f"DELETE FROM search_index WHERE rowid = old.id * 8 + {code};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS search_index_{table}_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_index_{table}_au AFTER UPDATE ON {table} BEGIN {delete_old} {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_index_{table}_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+        ]
+    return statements
+
+
+def init_search_index(app):
+    """Create the FTS5 table and sync triggers, populating the index on first run"""
+    with app.app_context():
+        available = False
+        if db.engine.dialect.name == "sqlite":
+            try:
+                exists = db.session.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+                ).first()
+                for statement in _create_statements():
+                    db.session.execute(text(statement))
+                db.session.commit()
+                available = True
+                if not exists:
+                    rebuild_search_index()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Full-text search unavailable, falling back to LIKE queries: {e}")
+        app.extensions["search_index"] = available
+        return available
+
+
+def rebuild_search_index():
+    """Repopulate the index from the source tables; returns the number of rows indexed"""
+    db.session.execute(text("DELETE FROM search_index"))
+    for entity_type, (code, table, title, body) in INDEXED_ENTITIES.items():
+        db.session.execute(text(
+            f"INSERT INTO search_index(rowid, entity_type, entity_id, title, body) "
+            f"SELECT id * 8 + {code}, '{entity_type}', id, {title.format(row=table)}, {body.format(row=table)} FROM {table}"
+        ))
+    db.session.commit()
+    return db.session.execute(text("SELECT count(*) FROM search_index")).scalar()
+
+
+def match_expression(search_text):
+    """Turn free text into an FTS5 query where every term is prefix-matched"""
+    terms = re.findall(r"\w+", search_text or "")
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def full_text_search(search_text, entity_types=None, limit=50):
+    """Return ranked (entity_type, entity_id) pairs matching the text, best first"""
+    entity_types = list(entity_types or INDEXED_ENTITIES)
+    if not current_app.extensions.get("search_index"):
+        return _fallback_search(search_text, entity_types, limit)
+
+    expression = match_expression(search_text)
+    if not expression:
+        return []
+    type_params = {f"type_{i}": entity_type for i, entity_type in enumerate(entity_types)}
+    type_filter = ", ".join(f":{name}" for name in type_params)
+    rows = db.session.execute(text(
+        f"SELECT entity_type, entity_id FROM search_index "
+        f"WHERE search_index MATCH :expression AND entity_type IN ({type_filter}) "
+        f"ORDER BY {RANKING} LIMIT :limit"
+    ), {"expression": expression, "limit": limit, **type_params}).all()
+    return [(entity_type, int(entity_id)) for entity_type, entity_id in rows]
+
+
+def search_ids(search_text, entity_type, limit=SEARCH_RESULT_LIMIT):
+    """Ranked ids of a single entity type matching the text"""
+    return [entity_id for _, entity_id in full_text_search(search_text, [entity_type], limit)]
+
+
+def load_ranked(model, ids):
+    """Fetch model rows for ids, preserving the order of ids"""
+    if not ids:
+        return []
+    by_id = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def _fallback_search(search_text, entity_types, limit):
+    search_text = (search_text or "").strip()
+    if not search_text:
+        return []
+    results = []
+    for entity_type in entity_types:
+        model, columns = FALLBACK_COLUMNS[entity_type]
+        rows = db.session.query(model.id).filter(
+            or_(*[column.ilike(f"%{search_text}%") for column in columns])
+        ).limit(limit).all()
+        results.extend((entity_type, row.id) for row in rows)
+    return results[:limit]
+
+
+def subject_ids_for(matches):
+    """Resolve subject/chapter/quiz matches to their subject ids, in rank order"""
+    chapter_ids = [entity_id for entity_type, entity_id in matches if entity_type == "chapter"]
+    quiz_ids = [entity_id for entity_type, entity_id in matches if entity_type == "quiz"]
+    chapter_subjects = dict(
+        db.session.query(Chapter.id, Chapter.subject_id).filter(Chapter.id.in_(chapter_ids)).all()
+    ) if chapter_ids else {}
+    quiz_subjects = dict(
+        db.session.query(Quiz.id, Chapter.subject_id).join(Chapter, Chapter.id == Quiz.chapter_id)
+        .filter(Quiz.id.in_(quiz_ids)).all()
+    ) if quiz_ids else {}
+
+    subject_ids = []
+    for entity_type, entity_id in matches:
+        if entity_type == "subject":
+            subject_id = entity_id
+        elif entity_type == "chapter":
+            subject_id = chapter_subjects.get(entity_id)
+        else:
+            subject_id = quiz_subjects.get(entity_id)
+        if subject_id is not None and subject_id not in subject_ids:
+            subject_ids.append(subject_id)
+    return subject_ids
@@ -0,0 +1,419 @@
+"""Quiz score submission, optionally through a write-behind queue.
+
+Every submission carries an idempotency key and is recorded as a
+ScoreSubmission next to its Score, so a replayed key returns the original
+result instead of inserting again. Quiz pages hand out signed attempt tokens
+whose nonce becomes the key, so retries and double clicks of the same
+attempt are deduplicated without any client-side bookkeeping.
+
+With ``SCORE_QUEUE_ENABLED`` the request only grades and appends the
+submission to a local SQLite journal (WAL, synchronous=FULL), then returns.
+A flusher thread claims up to ``SCORE_QUEUE_BATCH_SIZE`` journal rows every
+``SCORE_QUEUE_FLUSH_INTERVAL_MS`` and inserts them in one transaction on the
+main database, deleting them from the journal only after that commit. A crash
+in between replays the batch, which the idempotency keys turn into no-ops, so
+delivery is at-least-once without duplicates. When a batch fails its records
+are retried one by one; a record that keeps failing is marked failed after
+``SCORE_QUEUE_MAX_ATTEMPTS`` attempts instead of blocking later submissions.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app, request
+from itsdangerous import URLSafeTimedSerializer, BadData
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from .models import db, Score, ScoreSubmission
+from .score_stats import record_scores
+from .caching import get_cache
+
+SubmissionResult = namedtuple(
+    "SubmissionResult", ["idempotency_key", "total_scored", "total_questions", "duplicate", "queued"]
+)
+
+
+def request_idempotency_key():
+    """Idempotency key sent with the request (header, form or JSON), or a fresh one"""
+    key = request.headers.get("Idempotency-Key") or request.form.get("idempotency_key")
+    if not key and request.is_json:
+        key = (request.get_json(silent=True) or {}).get("idempotency_key")
+    return str(key)[:64] if key else uuid.uuid4().hex
+
+
+class InvalidAttemptToken(Exception):
+    """Attempt token is forged, expired or issued for another user or quiz"""
+
+
+class InvalidSubmission(ValueError):
+    """Submission values that could never be stored (missing or non-numeric score, bad ids)"""
+
+
+def _attempt_serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt="quiz-attempt")
+
+
+def issue_attempt_token(user_id, quiz_id):
+    """Signed token identifying one attempt of a quiz, handed out when the quiz is served"""
+    return _attempt_serializer().dumps({"u": int(user_id), "q": int(quiz_id), "n": uuid.uuid4().hex})
+
+
+def submission_key(user_id, quiz_id):
+    """Idempotency key for a quiz submission.
+
+    Uses the attempt token (``attempt_token`` form/JSON field or
+    ``X-Attempt-Token`` header) when one is sent, otherwise falls back to
+    ``request_idempotency_key``. Raises InvalidAttemptToken for bad tokens.
+    """
+    token = request.headers.get("X-Attempt-Token") or request.form.get("attempt_token")
+    if not token and request.is_json:
+        token = (request.get_json(silent=True) or {}).get("attempt_token")
+    if not token:
+        return request_idempotency_key()
+    try:
+        payload = _attempt_serializer().loads(token, max_age=current_app.config.get("ATTEMPT_TOKEN_MAX_AGE"))
+    except BadData:
+        raise InvalidAttemptToken("Invalid or expired attempt token")
+    if payload.get("u") != int(user_id) or payload.get("q") != int(quiz_id):
+        raise InvalidAttemptToken("Attempt token does not match this quiz")
+    return f"attempt:{payload['n']}"
+
+
+def _result(record, duplicate, queued=False):
+    return SubmissionResult(record["idempotency_key"], record["total_scored"], record["total_questions"],
+                            duplicate, queued)
+
+
+def find_submission(idempotency_key):
+    """Previously accepted submission for a key, from the database or the pending journal"""
+    submission = ScoreSubmission.query.filter_by(idempotency_key=idempotency_key).first()
+    if submission:
+        return {"idempotency_key": submission.idempotency_key, "total_scored": submission.total_scored,
+                "total_questions": submission.total_questions}
+    queue = get_score_queue()
+    return queue.get(idempotency_key) if queue else None
+
+
+def insert_submissions(records):
+    """Insert Score, rollup and ScoreSubmission rows for records with unseen keys (caller commits).
+
+    Scores and submissions are each written with one executemany and the
+    rollup with one upsert, however many records there are. Returns the user
+    ids whose scores changed.
+    """
+    keys = [record["idempotency_key"] for record in records]
+    seen = {key for (key,) in db.session.query(ScoreSubmission.idempotency_key).filter(
+        ScoreSubmission.idempotency_key.in_(keys)
+    )}
+    new_records = []
+    for record in records:
+        if record["idempotency_key"] not in seen:
+            seen.add(record["idempotency_key"])
+            new_records.append(dict(record, submitted_at=datetime.fromisoformat(record["submitted_at"])))
+    if not new_records:
+        return set()
+
+    # RETURNING rows come back in no particular order; match them to records by
+    # their values (records with identical values are interchangeable)
+    inserted = {}
+    for score_id, *values in db.session.execute(
+        insert(Score).returning(Score.id, Score.user_id, Score.quiz_id, Score.total_scored, Score.time_stamp_of_attempt),
+        [{"user_id": record["user_id"], "quiz_id": record["quiz_id"], "total_scored": record["total_scored"],
+          "time_stamp_of_attempt": record["submitted_at"]} for record in new_records]
+    ):
+        inserted.setdefault(tuple(values), []).append(score_id)
+    score_ids = [
+        inserted[(record["user_id"], record["quiz_id"], record["total_scored"], record["submitted_at"])].pop()
+        for record in new_records
+    ]
+    record_scores((record["user_id"], record["quiz_id"], record["total_scored"], record["submitted_at"])
+                  for record in new_records)
+    db.session.execute(insert(ScoreSubmission), [
+        {"idempotency_key": record["idempotency_key"], "user_id": record["user_id"], "quiz_id": record["quiz_id"],
+         "score_id": score_id, "total_scored": record["total_scored"],
+         "total_questions": record["total_questions"], "submitted_at": record["submitted_at"]}
+        for record, score_id in zip(new_records, score_ids)
+    ])
+    return {record["user_id"] for record in new_records}
+
+
+def _invalidate_user_scores(user_ids):
+    try:
+        get_cache().delete_many(*[f"user_scores_{user_id}" for user_id in user_ids])
+    except Exception as e:
+        print(f"Error invalidating cached user scores: {e}")
+
+
+def submission_record(idempotency_key, user_id, quiz_id, total_scored, total_questions=None):
+    """Validated record for a submission; raises InvalidSubmission before anything is stored"""
+    try:
+        record = {
+            "idempotency_key": str(idempotency_key),
+            "user_id": int(user_id),
+            "quiz_id": int(quiz_id),
+            "total_scored": int(total_scored),
+            "total_questions": int(total_questions) if total_questions is not None else None,
+            "submitted_at": datetime.now().isoformat(),
+        }
+    except (TypeError, ValueError):
+        raise InvalidSubmission("user_id, quiz_id and total_scored must be integers")
+    if record["total_scored"] < 0 or (
+        record["total_questions"] is not None and not 0 <= record["total_scored"] <= record["total_questions"]
+    ):
+        raise InvalidSubmission("total_scored must be between 0 and total_questions")
+    return record
+
+
+def submit_score(user_id, quiz_id, total_scored, total_questions=None, idempotency_key=None):
+    """Record a graded submission, synchronously or through the write-behind queue.
+
+    Raises InvalidSubmission for values that could not be stored, so a bad
+    record never reaches the queue.
+    """
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    existing = find_submission(idempotency_key)
+    if existing:
+        return _result(existing, duplicate=True)
+
+    record = submission_record(idempotency_key, user_id, quiz_id, total_scored, total_questions)
+    queue = get_score_queue()
+    if queue:
+        stored, added = queue.enqueue(record)
+        if stored is None:
+            # Flushed between our lookup and the enqueue
+            stored = find_submission(idempotency_key)
+        return _result(stored, duplicate=not added, queued=True)
+
+    try:
+        user_ids = insert_submissions([record])
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won the insert
+        db.session.rollback()
+        existing = find_submission(idempotency_key)
+        if existing is None:
+            raise
+        return _result(existing, duplicate=True)
+    _invalidate_user_scores(user_ids)
+    return _result(record, duplicate=False)
+
+
+class ScoreQueue:
+    """Durable local journal of pending submissions plus its flusher thread"""
+
+    def __init__(self, app, path, batch_size=200, flush_interval_ms=250, claim_timeout=60, max_attempts=5):
+        self.app = app
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._enqueued = 0
+        self._flusher_pid = None
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self):
+        # sqlite connections must not be shared across a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_submission ("
+                "idempotency_key TEXT PRIMARY KEY, payload TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+                "claimed_by TEXT, claimed_at REAL, status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT)"
+            )
+            # Journals written before failed records were tracked lack these columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pending_submission)")}
+            for column, definition in (("status", "TEXT NOT NULL DEFAULT 'pending'"),
+                                       ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+                                       ("last_error", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE pending_submission ADD COLUMN {column} {definition}")
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def enqueue(self, record):
+        """Durably append a record; returns (stored record, whether it was newly added)"""
+        self.start()
+        with self._lock:
+            conn = self._connection()
+            added = conn.execute(
+                "INSERT OR IGNORE INTO pending_submission (idempotency_key, payload, enqueued_at) VALUES (?, ?, ?)",
+                (record["idempotency_key"], json.dumps(record), time.time())
+            ).rowcount == 1
+            self._enqueued += 1
+        if self._enqueued >= self.batch_size:
+            self._wakeup.set()
+        return (record, True) if added else (self.get(record["idempotency_key"]), False)
+
+    def get(self, idempotency_key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT payload FROM pending_submission WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending_count(self):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT count(*) FROM pending_submission WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def failed_count(self):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT count(*) FROM pending_submission WHERE status = 'failed'"
+            ).fetchone()[0]
+
+    def requeue_failed(self):
+        """Give failed records a fresh set of attempts; returns the count"""
+        with self._lock:
+            return self._connection().execute(
+                "UPDATE pending_submission SET status = 'pending', attempts = 0, last_error = NULL, "
+                "claimed_by = NULL, claimed_at = NULL WHERE status = 'failed'"
+            ).rowcount
+
+    def _claim(self):
+        """Lease a batch of unclaimed (or abandoned) rows to this flush"""
+        claim_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE pending_submission SET claimed_by = ?, claimed_at = ? WHERE idempotency_key IN ("
+                "SELECT idempotency_key FROM pending_submission "
+                "WHERE status = 'pending' AND (claimed_by IS NULL OR claimed_at < ?) "
+                "ORDER BY enqueued_at LIMIT ?)",
+                (claim_id, now, now - self.claim_timeout, self.batch_size)
+            )
+            rows = conn.execute(
+                "SELECT payload FROM pending_submission WHERE claimed_by = ? ORDER BY enqueued_at", (claim_id,)
+            ).fetchall()
+            self._enqueued = 0
+        return claim_id, [json.loads(payload) for (payload,) in rows]
+
+    def _finish(self, claim_id, flushed):
+        with self._lock:
+            if flushed:
+                self._connection().execute("DELETE FROM pending_submission WHERE claimed_by = ?", (claim_id,))
+            else:
+                self._connection().execute(
+                    "UPDATE pending_submission SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?",
+                    (claim_id,)
+                )
+
+    def _delete(self, keys):
+        if keys:
+            with self._lock:
+                self._connection().execute(
+                    f"DELETE FROM pending_submission WHERE idempotency_key IN ({', '.join('?' * len(keys))})",
+                    keys
+                )
+
+    def _record_failure(self, claim_id, record, error):
+        """Count a failed attempt, marking the record failed once it runs out of attempts"""
+        with self._lock:
+            self._connection().execute(
+                "UPDATE pending_submission SET attempts = attempts + 1, last_error = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END, "
+                "claimed_by = NULL, claimed_at = NULL WHERE idempotency_key = ? AND claimed_by = ?",
+                (f"{type(error).__name__}: {error}"[:1000], self.max_attempts, record["idempotency_key"], claim_id)
+            )
+        print(f"Error flushing queued score submission {record['idempotency_key']}: {error}")
+
+    def flush(self):
+        """Insert one batch into the main database; returns the number of journal rows flushed"""
+        claim_id, records = self._claim()
+        if not records:
+            return 0
+        with self.app.app_context():
+            try:
+                user_ids = insert_submissions(records)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error flushing {len(records)} queued score submissions, retrying one by one: {e}")
+                return self._flush_each(claim_id, records)
+            self._finish(claim_id, flushed=True)
+            _invalidate_user_scores(user_ids)
+        return len(records)
+
+    def _flush_each(self, claim_id, records):
+        """Insert a failed batch record by record, so one bad record cannot hold back the rest"""
+        flushed, user_ids = [], set()
+        for record in records:
+            try:
+                user_ids |= insert_submissions([record])
+                db.session.commit()
+            except OperationalError as e:
+                # The database itself is unavailable (e.g. locked); retry the rest on the next flush
+                db.session.rollback()
+                print(f"Error flushing queued score submissions, database unavailable: {e}")
+                break
+            except Exception as e:
+                db.session.rollback()
+                self._record_failure(claim_id, record, e)
+                continue
+            flushed.append(record["idempotency_key"])
+        self._delete(flushed)
+        self._finish(claim_id, flushed=False)
+        _invalidate_user_scores(user_ids)
+        return len(flushed)
+
+    def flush_all(self):
+        total = 0
+        while True:
+            flushed = self.flush()
+            total += flushed
+            if flushed < self.batch_size:
+                return total
+
+    def start(self):
+        """Start the flusher thread once per process (workers may be forked)"""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._run, name="score-queue-flusher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush_all()
+            except Exception as e:
+                print(f"Error in score queue flusher: {e}")
+                time.sleep(self.flush_interval)
+
+
+def init_score_queue(app):
+    """Create the write-behind queue when SCORE_QUEUE_ENABLED, draining leftovers from a previous run"""
+    if not app.config.get("SCORE_QUEUE_ENABLED"):
+        app.extensions["score_queue"] = None
+        return None
+    queue = ScoreQueue(
+        app,
+        app.config["SCORE_QUEUE_PATH"],
+        batch_size=app.config.get("SCORE_QUEUE_BATCH_SIZE", 200),
+        flush_interval_ms=app.config.get("SCORE_QUEUE_FLUSH_INTERVAL_MS", 250),
+        max_attempts=app.config.get("SCORE_QUEUE_MAX_ATTEMPTS", 5)
+    )
+    app.extensions["score_queue"] = queue
+    queue.start()
+    return queue
+
+
+def get_score_queue():
+    return current_app.extensions.get("score_queue")
@@ -1,97 +1,73 @@
+import os
 from celery import shared_task
 from .models import User_Info, Score, Quiz
 from datetime import datetime, timedelta
 from flask import current_app
 from flask_mail import Message
+from .notification_fanout import fan_out_assignment
+from .notification_retention import compact_notifications
+from .reminders import reminder_recipients, reminder_message, REMINDER_BATCH_SIZE
+from .reports import queue_monthly_reports, monthly_report_message, ReportRow
+from .mail_outbox import enqueue_mail, drain_outbox, purge_sent
+from .models import db
+from .exports import csv_chunks, write_csv, score_rows, SCORE_COLUMNS
 
 @shared_task
 def daily_reminder_task():
-    """Send daily reminders to users who haven't taken quizzes today"""
-    from app import mail  # Import here to avoid circular import
-    
-    users = User_Info.query.filter_by(role=1).all()  # Only regular users
-    for user in users:
-        # Check if user hasn't taken a quiz today
-        today = datetime.now().date()
-        recent_score = Score.query.filter(
-            Score.user_id == user.id,
-            Score.time_stamp_of_attempt >= today
-        ).first()
-        
-        if not recent_score:
-            try:
-                msg = Message(
-                    'Daily Quiz Reminder',
-                    sender='your-email@gmail.com',
-                    recipients=[user.email]
-                )
-                msg.body = f"Hello {user.full_name}! Don't forget to take your daily quiz to improve your knowledge."
-                mail.send(msg)
-                print(f"Daily reminder sent to {user.email}")
-            except Exception as e:
-                print(f"Error sending daily reminder to {user.email}: {e}")
-    
-    return f"Daily reminders sent to {len(users)} users"
+    """Queue daily reminders, in batches, for users who haven't taken quizzes today"""
+    from app import app  # Import here to avoid circular import
+    
+    queued = batches = 0
+    with app.app_context():
+        batch_size = app.config.get("REMINDER_BATCH_SIZE", REMINDER_BATCH_SIZE)
+        for recipients in reminder_recipients(datetime.now().date(), batch_size):
+            send_daily_reminder_batch.delay(recipients)
+            queued += len(recipients)
+            batches += 1
+    
+    return f"Daily reminders queued for {queued} users in {batches} batches"
+
+@shared_task
+def send_daily_reminder_batch(recipients):
+    """Queue the daily reminder for a batch of (email, name) pairs in the mail outbox"""
+    from app import app  # Import here to avoid circular import
+    
+    with app.app_context():
+        queued = enqueue_mail(
+            (reminder_message(user_email, user_name) for user_email, user_name in recipients),
+            kind="daily_reminder"
+        )
+        db.session.commit()
+    
+    return queued
 
 @shared_task
 def monthly_report_task():
-    """Generate and send monthly reports to all users"""
-    from app import mail  # Import here to avoid circular import
-    
-    users = User_Info.query.filter_by(role=1).all()
-    for user in users:
-        # Get last month's data
-        last_month = datetime.now() - timedelta(days=30)
-        scores = Score.query.filter(
-            Score.user_id == user.id,
-            Score.time_stamp_of_attempt >= last_month
-        ).all()
-        
-        if scores:
-            total_score = sum(score.total_scored for score in scores)
-            average_score = total_score / len(scores)
-            
-            try:
-                msg = Message(
-                    'Monthly Activity Report',
-                    sender='your-email@gmail.com',
-                    recipients=[user.email]
-                )
-                msg.html = f"""
-                <h2>Monthly Activity Report for {user.full_name}</h2>
-                <p>Quizzes taken: {len(scores)}</p>
-                <p>Average score: {round(average_score, 2)}%</p>
-                <p>Total score: {total_score}</p>
-                <p>Keep up the great work!</p>
-                """
-                mail.send(msg)
-                print(f"Monthly report sent to {user.email}")
-            except Exception as e:
-                print(f"Error sending monthly report to {user.email}: {e}")
-    
-    return f"Monthly reports sent to {len(users)} users"
+    """Generate monthly reports for all users and queue them in the mail outbox"""
+    from app import app  # Import here to avoid circular import
+    
+    with app.app_context():
+        queued = queue_monthly_reports()
+        db.session.commit()
+    
+    return f"Monthly reports queued for {queued} users"
 
 @shared_task
 def export_csv_task(user_id):
-    """Export user quiz data as CSV"""
+    """Export user quiz data as CSV, streamed to a file in EXPORT_FOLDER"""
+    from app import app  # Import here to avoid circular import
+    
     try:
-        user = User_Info.query.get(user_id)
-        if not user:
-            return "User not found"
-        
-        scores = Score.query.filter_by(user_id=user_id).all()
-        
-        # Generate CSV content
-        csv_content = "quiz_id,chapter_id,date_of_quiz,score,remarks\n"
-        for score in scores:
-            quiz = Quiz.query.get(score.quiz_id)
-            if quiz:
-                csv_content += f"{score.quiz_id},{quiz.chapter_id},{quiz.date_of_quiz},{score.total_scored},{quiz.remarks or ''}\n"
-        
-        # Save to file
-        filename = f"quiz_data_user_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        with open(filename, 'w') as f:
-            f.write(csv_content)
+        with app.app_context():
+            user = db.session.get(User_Info, user_id)
+            if not user:
+                return "User not found"
+            
+            filename = os.path.join(
+                app.config.get("EXPORT_FOLDER", "."),
+                f"quiz_data_user_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            )
+            write_csv(filename, csv_chunks(SCORE_COLUMNS, score_rows(user_id)))
         
         print(f"CSV exported for user {user_id}: {filename}")
         return filename
@@ -102,41 +78,67 @@ def export_csv_task(user_id):
 
 @shared_task
 def send_daily_reminder(user_email, user_name):
-    """Send daily reminder to specific user"""
-    from app import mail  # Import here to avoid circular import
+    """Queue the daily reminder for a specific user"""
+    from app import app  # Import here to avoid circular import
     
-    try:
-        msg = Message(
-            'Daily Quiz Reminder',
-            sender='your-email@gmail.com',
-            recipients=[user_email]
-        )
-        msg.body = f"Hello {user_name}! Don't forget to take your daily quiz to improve your knowledge."
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+    with app.app_context():
+        enqueue_mail([reminder_message(user_email, user_name)], kind="daily_reminder")
+        db.session.commit()
+    return True
 
 @shared_task
 def send_monthly_report(user_email, user_name, report_data):
-    """Send monthly activity report to specific user"""
-    from app import mail  # Import here to avoid circular import
+    """Queue a monthly activity report for a specific user"""
+    from app import app  # Import here to avoid circular import
     
-    try:
-        msg = Message(
-            'Monthly Activity Report',
-            sender='your-email@gmail.com',
-            recipients=[user_email]
+    row = ReportRow(user_email, user_name, report_data['quizzes_taken'],
+                    report_data['average_score'], report_data['total_score'])
+    with app.app_context():
+        enqueue_mail([monthly_report_message(row)], kind="monthly_report")
+        db.session.commit()
+    return True
+
+@shared_task(bind=True)
+def assignment_fanout_task(self, assignment_id):
+    """Notify every student enrolled in an assignment's subject, reporting progress"""
+    from app import app  # Import here to avoid circular import
+    
+    def report(done, total):
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total})
+    
+    with app.app_context():
+        created = fan_out_assignment(assignment_id, progress=report)
+    
+    print(f"Created {created} notifications for assignment {assignment_id}")
+    return {"assignment_id": assignment_id, "created": created}
+
+@shared_task
+def compact_notifications_task():
+    """Delete expired and old read notifications in bounded batches"""
+    from app import app  # Import here to avoid circular import
+    
+    with app.app_context():
+        report = compact_notifications(
+            read_retention_days=app.config.get("NOTIFICATION_READ_RETENTION_DAYS", 30),
+            batch_size=app.config.get("NOTIFICATION_COMPACTION_BATCH_SIZE", 500),
+            max_rows=app.config.get("NOTIFICATION_COMPACTION_MAX_ROWS", 20000),
+            pause=app.config.get("NOTIFICATION_COMPACTION_PAUSE_MS", 50) / 1000.0
         )
-        msg.html = f"""
-        <h2>Monthly Activity Report for {user_name}</h2>
-        <p>Quizzes taken: {report_data['quizzes_taken']}</p>
-        <p>Average score: {report_data['average_score']}%</p>
-        <p>Total score: {report_data['total_score']}</p>
-        """
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending monthly report: {e}")
-        return False 
\ No newline at end of file
+    
+    print(f"Notification compaction removed {report['notifications']} notifications, "
+          f"{report['broadcasts']} broadcasts and {report['receipts']} receipts")
+    return report
+
+@shared_task
+def drain_mail_outbox_task():
+    """Send due messages from the mail outbox within the rate limit, then purge old sent ones"""
+    from app import app, mail  # Import here to avoid circular import
+    
+    with app.app_context():
+        batches = drain_outbox(app, mail, max_seconds=app.config.get("MAIL_OUTBOX_DRAIN_SECONDS", 50))
+        purged = purge_sent(datetime.now() - timedelta(days=app.config.get("MAIL_OUTBOX_RETENTION_DAYS", 7)))
+        db.session.commit()
+    
+    sent = sum(batch["sent"] for batch in batches)
+    print(f"Mail outbox: sent {sent} messages in {len(batches)} batches, purged {purged}")
+    return {"batches": len(batches), "sent": sent, "purged": purged}
@@ -0,0 +1,173 @@
+"""Maintained unread-notification counters for badges.
+
+Each user's count is kept in one Redis hash (``unread:<id>``) holding the unread
+personal notifications, the unread broadcasts of their subjects, those subject
+ids and the broadcast version of each subject when the hash was computed.
+Personal notifications adjust the hash in place (fan-out adds one per
+recipient, marking read takes one off). A new broadcast only bumps its
+subject's version, so a class-wide notification stays one write; a reader
+whose stored versions no longer match recomputes its broadcast count. Hashes
+expire at the next notification expiry (or after ``UNREAD_COUNT_TTL``) and are
+rebuilt from the database on the next read, which is also the fallback when
+Redis is unreachable.
+"""
+import time
+import redis
+from flask import current_app
+from sqlalchemy import func
+from .models import db, Notification, BroadcastNotification, UserEnrollment
+
+# Adjust a field only while the hash exists; a missing hash is rebuilt on read
+_INCREMENT_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+"""
+
+
+def count_unread(user_id):
+    """(unread personal, unread broadcasts, earliest expiry among them) from the database"""
+    # Imported here: the feed imports the fan-out, which updates these counters
+    from .notification_feed import unread_personal, unread_broadcasts
+    personal, personal_expiry = unread_personal(user_id).with_entities(
+        func.count(Notification.id), func.min(Notification.expires_at)
+    ).one()
+    broadcast, broadcast_expiry = unread_broadcasts(user_id).with_entities(
+        func.count(BroadcastNotification.id), func.min(BroadcastNotification.expires_at)
+    ).one()
+    return personal, broadcast, min(filter(None, [personal_expiry, broadcast_expiry]), default=None)
+
+
+def enrolled_subject_ids(user_id):
+    rows = db.session.query(UserEnrollment.subject_id).filter_by(user_id=user_id, is_active=True)
+    return sorted({subject_id for (subject_id,) in rows})
+
+
+class UnreadCounter:
+    """Redis-backed counters; the client must be created with ``decode_responses=True``"""
+
+    def __init__(self, client, prefix="unread", ttl=3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._increment = client.register_script(_INCREMENT_IF_EXISTS)
+
+    def _user_key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    def _subject_key(self, subject_id):
+        return f"{self.prefix}:subject:{subject_id}"
+
+    def _versions(self, subject_ids):
+        if not subject_ids:
+            return ""
+        return ",".join(version or "0" for version in self.client.mget(
+            [self._subject_key(subject_id) for subject_id in subject_ids]
+        ))
+
+    def count(self, user_id):
+        """Unread personal notifications plus broadcasts; two Redis reads when fresh"""
+        fields = self.client.hgetall(self._user_key(user_id))
+        if fields:
+            subject_ids = [int(subject_id) for subject_id in fields["subjects"].split(",") if subject_id]
+            if self._versions(subject_ids) == fields["versions"]:
+                return int(fields["personal"]) + int(fields["broadcast"])
+        return self.refresh(user_id)
+
+    def refresh(self, user_id):
+        """Recompute a user's counter from the database and store it"""
+        subject_ids = enrolled_subject_ids(user_id)
+        # Read versions before counting, so a broadcast landing in between forces another refresh
+        versions = self._versions(subject_ids)
+        personal, broadcast, next_expiry = count_unread(user_id)
+        expire_at = int(time.time()) + self.ttl
+        if next_expiry is not None:
+            expire_at = max(int(time.time()) + 1, min(expire_at, int(next_expiry.timestamp()) + 1))
+        key = self._user_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            "personal": personal,
+            "broadcast": broadcast,
+            "subjects": ",".join(str(subject_id) for subject_id in subject_ids),
+            "versions": versions,
+        })
+        pipe.expireat(key, expire_at)
+        pipe.execute()
+        return personal + broadcast
+
+    def adjust(self, user_ids, personal=0, broadcast=0):
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            if personal:
+                self._increment(keys=[self._user_key(user_id)], args=["personal", personal], client=pipe)
+            if broadcast:
+                self._increment(keys=[self._user_key(user_id)], args=["broadcast", broadcast], client=pipe)
+        pipe.execute()
+
+    def subject_changed(self, subject_id):
+        self.client.incr(self._subject_key(subject_id))
+
+    def reset(self, user_ids):
+        if user_ids:
+            self.client.delete(*[self._user_key(user_id) for user_id in user_ids])
+
+
+def get_unread_counter():
+    return current_app.extensions.get("unread_counter")
+
+
+def unread_count(user_id):
+    """Unread notifications for a badge, from the counter or else the database"""
+    counter = get_unread_counter()
+    if counter:
+        try:
+            return counter.count(user_id)
+        except Exception as e:
+            print(f"Error reading unread counter for user {user_id}: {e}")
+    personal, broadcast, _ = count_unread(user_id)
+    return personal + broadcast
+
+
+def adjust_unread(user_ids, personal=0, broadcast=0):
+    """Apply a committed change to the counters of users whose counters are cached"""
+    counter = get_unread_counter()
+    if counter and user_ids:
+        try:
+            counter.adjust(user_ids, personal, broadcast)
+        except Exception as e:
+            print(f"Error adjusting unread counters: {e}")
+
+
+def broadcasts_changed(subject_id):
+    """A subject's broadcasts changed; its students recount broadcasts on their next read"""
+    counter = get_unread_counter()
+    if counter:
+        try:
+            counter.subject_changed(subject_id)
+        except Exception as e:
+            print(f"Error bumping broadcast version of subject {subject_id}: {e}")
+
+
+def reset_unread(*user_ids):
+    """Drop cached counters so they are rebuilt from the database"""
+    counter = get_unread_counter()
+    if counter:
+        try:
+            counter.reset(user_ids)
+        except Exception as e:
+            print(f"Error resetting unread counters: {e}")
+
+
+def init_unread_counter(app):
+    """Attach Redis counters at UNREAD_COUNT_REDIS_URL, or count from the database when unreachable"""
+    try:
+        client = redis.from_url(app.config["UNREAD_COUNT_REDIS_URL"], decode_responses=True)
+        client.ping()
+        counter = UnreadCounter(client, ttl=app.config.get("UNREAD_COUNT_TTL", 3600))
+    except Exception as e:
+        print(f"Unread counters falling back to database counts: {e}")
+        counter = None
+    app.extensions["unread_counter"] = counter
+    return counter
@@ -11,12 +11,15 @@
 
 from __future__ import with_statement
 
-__version__ = '0.9.1'
+__version__ = '0.9.2'
 
+import os
 import re
 import blinker
 import smtplib
+import socket
 import sys
+import threading
 import time
 import unicodedata
 
@@ -131,25 +134,107 @@ def _has_newline(line):
         return True
     return False
 
+
+_pool_lock = threading.Lock()
+
+# Errors after which the SMTP session can no longer be used
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                      smtplib.SMTPHeloError, smtplib.SMTPAuthenticationError,
+                      socket.error)
+
+
+class BulkResult(object):
+    """Outcome of a bulk send.
+
+    :ivar sent: number of messages accepted by the server.
+    :ivar failures: list of ``(message, exception)`` pairs for messages that
+                    could not be delivered.
+
+    :versionadded: 0.9.2
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.failures = []
+
+    @property
+    def failed(self):
+        return len(self.failures)
+
+
 class Connection(object):
     """Handles connection to host."""
 
     def __init__(self, mail):
         self.mail = mail
+        self.host = None
+        self.num_emails = 0
+        self.broken = False
+        self.last_used = time.time()
+        self.pid = os.getpid()
 
     def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def open(self):
+        """Opens (and authenticates) the SMTP session.
+
+        :versionadded: 0.9.2
+        """
         if self.mail.suppress:
             self.host = None
         else:
             self.host = self.configure_host()
 
         self.num_emails = 0
+        self.broken = False
+        self.last_used = time.time()
 
         return self
 
-    def __exit__(self, exc_type, exc_value, tb):
-        if self.host:
-            self.host.quit()
+    def close(self):
+        """Ends the SMTP session, dropping it if the server has gone away.
+
+        :versionadded: 0.9.2
+        """
+        host, self.host = self.host, None
+        if host:
+            try:
+                host.quit()
+            except _CONNECTION_ERRORS:
+                host.close()
+
+    def reconnect(self):
+        """Replaces the SMTP session with a fresh one.
+
+        :versionadded: 0.9.2
+        """
+        self.close()
+        try:
+            self.open()
+        except Exception:
+            self.broken = True
+            raise
+
+    def is_alive(self, max_idle=None):
+        """Whether the session can still be used: it belongs to this process,
+        has not been idle for more than ``max_idle`` seconds and answers NOOP.
+
+        :versionadded: 0.9.2
+        """
+        if self.broken or self.pid != os.getpid():
+            return False
+        if self.host is None:
+            return self.mail.suppress
+        if max_idle is not None and time.time() - self.last_used > max_idle:
+            return False
+        try:
+            return self.host.noop()[0] == 250
+        except _CONNECTION_ERRORS:
+            return False
 
     def configure_host(self):
         if self.mail.use_ssl:
@@ -184,6 +269,9 @@ class Connection(object):
         if message.date is None:
             message.date = time.time()
 
+        if self.broken:
+            self.reconnect()
+
         if self.host:
             self.host.sendmail(sanitize_address(envelope_from or message.sender),
                                list(sanitize_addresses(message.send_to)),
@@ -194,12 +282,52 @@ class Connection(object):
         email_dispatched.send(message, app=current_app._get_current_object())
 
         self.num_emails += 1
+        self.last_used = time.time()
 
         if self.num_emails == self.mail.max_emails:
             self.num_emails = 0
             if self.host:
-                self.host.quit()
-                self.host = self.configure_host()
+                # Reopened by the next send, so a failing QUIT never fails this message
+                self.close()
+                self.broken = True
+
+    def send_many(self, messages, envelope_from=None, retries=1):
+        """Sends every message over this connection.
+
+        A message rejected by the server (or with bad headers) is recorded as
+        a failure and the batch carries on. When the session itself breaks the
+        connection is reopened and the message retried up to ``retries`` times.
+        Any other error fails only the message being sent, and the next one
+        goes out on a fresh session, so the result always accounts for every
+        message handed over.
+
+        :param messages: iterable of Message instances.
+        :param envelope_from: Email address to be used in MAIL FROM command.
+        :param retries: reconnect attempts per message.
+        :returns: a :class:`BulkResult`.
+
+        :versionadded: 0.9.2
+        """
+        result = BulkResult()
+        for message in messages:
+            for attempt in range(retries + 1):
+                try:
+                    self.send(message, envelope_from)
+                except _MESSAGE_ERRORS as exc:
+                    result.failures.append((message, exc))
+                    break
+                except _CONNECTION_ERRORS as exc:
+                    self.broken = True
+                    if attempt == retries:
+                        result.failures.append((message, exc))
+                except Exception as exc:
+                    result.failures.append((message, exc))
+                    self.broken = True
+                    break
+                else:
+                    result.sent += 1
+                    break
+        return result
 
     def send_message(self, *args, **kwargs):
         """Shortcut for send(msg).
@@ -216,6 +344,11 @@ class BadHeaderError(Exception):
     pass
 
 
+# Errors that only concern the message being sent
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                   smtplib.SMTPDataError, BadHeaderError, AssertionError)
+
+
 class Attachment(object):
     """Encapsulates file attachment information.
 
@@ -253,6 +386,7 @@ class Message(object):
     :param extra_headers: A dictionary of additional headers for the message
     :param mail_options: A list of ESMTP options to be used in MAIL FROM command
     :param rcpt_options:  A list of ESMTP options to be used in RCPT commands
+    :param layout: a :class:`MessageLayout` to render the message with
     """
 
     def __init__(self, subject='',
@@ -268,7 +402,8 @@ class Message(object):
                  charset=None,
                  extra_headers=None,
                  mail_options=None,
-                 rcpt_options=None):
+                 rcpt_options=None,
+                 layout=None):
 
         sender = sender or current_app.extensions['mail'].default_sender
 
@@ -290,6 +425,7 @@ class Message(object):
         self.mail_options = mail_options or []
         self.rcpt_options = rcpt_options or []
         self.attachments = attachments or []
+        self.layout = layout
 
     @property
     def send_to(self):
@@ -381,6 +517,10 @@ class Message(object):
         return self._message().as_string()
 
     def as_bytes(self):
+        if self.layout is not None:
+            rendered = self.layout.render(self)
+            if rendered is not None:
+                return rendered
         if PY34:
             return self._message().as_bytes()
         else: # fallback for old Python (3) versions
@@ -451,6 +591,140 @@ class Message(object):
             Attachment(filename, content_type, data, disposition, headers))
 
 
+_LINE_BREAKS = re.compile(r'\r\n|\r|\n')
+
+
+class MessageLayout(object):
+    """Pre-built MIME skeleton for messages that share a subject, a sender
+    and the same parts, such as one announcement sent to many recipients.
+
+    Headers, boundaries and part headers are generated once; rendering a
+    message only fills its recipients, date, id and bodies into the
+    skeleton instead of building and flattening an email object tree for
+    every recipient. Messages the layout does not cover (a different
+    subject, sender or charset, CC, Reply-To, extra headers, attachments,
+    or text that would need folding or encoding) are rendered the usual way.
+
+    Assign it to :attr:`Message.layout`; :meth:`Message.as_bytes` uses it.
+
+    :param subject: email subject header
+    :param sender: email sender address, or **MAIL_DEFAULT_SENDER** by default
+    :param html: whether messages carry an HTML part next to the plain text
+    :param charset: message character set
+
+    :versionadded: 0.9.2
+    """
+
+    _FIELDS = ('to', 'date', 'message_id', 'text', 'text_encoding',
+               'html', 'html_encoding')
+
+    def __init__(self, subject, sender=None, html=True, charset=None):
+        sender = sender or current_app.extensions['mail'].default_sender
+        if isinstance(sender, tuple):
+            sender = "%s <%s>" % sender
+        self.subject = subject
+        self.sender = sender
+        self.html = bool(html)
+        self.charset = charset or 'utf-8'
+        self._segments = self._skeleton()
+
+    def _part(self, subtype, token, encoding_token):
+        part = MIMEText(token, _subtype=subtype, _charset=self.charset)
+        del part['Content-Transfer-Encoding']
+        part['Content-Transfer-Encoding'] = encoding_token
+        return part
+
+    def _skeleton(self):
+        """Flattens a message holding placeholders and splits it around them"""
+        fields = [field for field in self._FIELDS
+                  if self.html or not field.startswith('html')]
+        tokens = dict((field, '@@%s.%s@@' % (field, os.urandom(8).hex()))
+                      for field in fields)
+        text = self._part('plain', tokens['text'], tokens['text_encoding'])
+        if self.html:
+            msg = MIMEMultipart()
+            alternative = MIMEMultipart('alternative')
+            alternative.attach(text)
+            alternative.attach(self._part('html', tokens['html'], tokens['html_encoding']))
+            msg.attach(alternative)
+        else:
+            msg = text
+        if self.subject:
+            msg['Subject'] = sanitize_subject(force_text(self.subject), self.charset)
+        msg['From'] = sanitize_address(self.sender, self.charset)
+        msg['To'] = tokens['to']
+        msg['Date'] = tokens['date']
+        msg['Message-ID'] = tokens['message_id']
+        if message_policy:
+            msg.policy = message_policy
+        flat = msg.as_bytes()
+
+        self.boundaries = [part.get_boundary().encode('ascii')
+                           for part in msg.walk() if part.is_multipart()]
+        segments = []
+        positions = sorted((flat.index(token.encode('ascii')), field)
+                           for field, token in tokens.items())
+        start = 0
+        for position, field in positions:
+            segments.append(flat[start:position])
+            segments.append(field)
+            start = position + len(tokens[field])
+        segments.append(flat[start:])
+        return segments
+
+    def _header(self, name, value):
+        """The header value, or None when it would need folding or encoding"""
+        if len(name) + 2 + len(value) > 78 or _has_newline(value):
+            return None
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+
+    def _body(self, text):
+        """(encoded body, transfer encoding), or None when it needs a real encoder"""
+        linesep = message_policy.linesep if message_policy else '\n'
+        lines = _LINE_BREAKS.split(text)
+        if any(len(line) > 998 for line in lines):
+            return None
+        try:
+            body = linesep.join(lines).encode(self.charset)
+        except UnicodeEncodeError:
+            return None
+        if any(boundary in body for boundary in self.boundaries):
+            return None
+        try:
+            body.decode('ascii')
+            return body, b'7bit'
+        except UnicodeDecodeError:
+            return body, b'8bit'
+
+    def render(self, message):
+        """Returns the message as bytes, or None when the layout does not fit it"""
+        if (message.subject != self.subject or message.sender != self.sender
+                or (message.charset or 'utf-8') != self.charset
+                or bool(message.html) != self.html or message.body is None
+                or message.cc or message.reply_to or message.extra_headers
+                or message.attachments):
+            return None
+        values = {
+            'to': self._header('To', ', '.join(
+                set(sanitize_addresses(message.recipients, self.charset)))),
+            'date': self._header('Date', formatdate(message.date, localtime=True)),
+            'message_id': self._header('Message-ID', message.msgId),
+        }
+        encoded = [self._body(message.body)]
+        if self.html:
+            encoded.append(self._body(message.html))
+        if None in encoded or None in values.values():
+            return None
+        values['text'], values['text_encoding'] = encoded[0]
+        if self.html:
+            values['html'], values['html_encoding'] = encoded[1]
+        return b''.join(values[segment] if isinstance(segment, str) else segment
+                        for segment in self._segments)
+
+
 class _MailMixin(object):
 
     @contextmanager
@@ -501,19 +775,70 @@ class _MailMixin(object):
 
         self.send(Message(*args, **kwargs))
 
-    def connect(self):
-        """Opens a connection to the mail host."""
+    def _mail_state(self):
         app = getattr(self, "app", None) or current_app
         try:
-            return Connection(app.extensions['mail'])
+            return app.extensions['mail']
         except KeyError:
             raise RuntimeError("The curent application was not configured with Flask-Mail")
 
+    def connect(self):
+        """Opens a connection to the mail host."""
+        return Connection(self._mail_state())
+
+    def pooled_connection(self):
+        """Returns this thread's open connection to the mail host, opening a
+        new one when there is none or the previous one is stale.
+
+        The connection stays open between calls, so workers sending many
+        messages log in once instead of once per message. Connections are
+        kept per thread and per process (forked workers open their own) and
+        are replaced after ``MAIL_POOL_IDLE_TIMEOUT`` seconds of inactivity.
+
+        :versionadded: 0.9.2
+        """
+        state = self._mail_state()
+        with _pool_lock:
+            pool = state.__dict__.setdefault('_pool', threading.local())
+        connection = getattr(pool, 'connection', None)
+        if connection is not None and connection.is_alive(state.pool_idle_timeout):
+            return connection
+        if connection is not None and connection.pid == os.getpid():
+            connection.close()
+        connection = Connection(state).open()
+        pool.connection = connection
+        return connection
+
+    def close_pooled_connection(self):
+        """Closes this thread's pooled connection, if any.
+
+        :versionadded: 0.9.2
+        """
+        pool = self._mail_state().__dict__.get('_pool')
+        connection = getattr(pool, 'connection', None)
+        if connection is not None:
+            pool.connection = None
+            if connection.pid == os.getpid():
+                connection.close()
+
+    def send_bulk(self, messages, envelope_from=None):
+        """Sends many messages over this thread's pooled connection.
+
+        Messages the server rejects are reported in the result rather than
+        raised, and a dropped session is reopened transparently.
+
+        :param messages: iterable of Message instances.
+        :returns: a :class:`BulkResult`.
+
+        :versionadded: 0.9.2
+        """
+        return self.pooled_connection().send_many(messages, envelope_from)
+
 
 class _Mail(_MailMixin):
     def __init__(self, server, username, password, port, use_tls, use_ssl,
                  default_sender, debug, max_emails, suppress,
-                 ascii_attachments=False):
+                 ascii_attachments=False, pool_idle_timeout=60):
         self.server = server
         self.username = username
         self.password = password
@@ -525,6 +850,7 @@ class _Mail(_MailMixin):
         self.max_emails = max_emails
         self.suppress = suppress
         self.ascii_attachments = ascii_attachments
+        self.pool_idle_timeout = pool_idle_timeout
 
 
 class Mail(_MailMixin):
@@ -552,7 +878,8 @@ class Mail(_MailMixin):
             int(config.get('MAIL_DEBUG', debug)),
             config.get('MAIL_MAX_EMAILS'),
             config.get('MAIL_SUPPRESS_SEND', testing),
-            config.get('MAIL_ASCII_ATTACHMENTS', False)
+            config.get('MAIL_ASCII_ATTACHMENTS', False),
+            config.get('MAIL_POOL_IDLE_TIMEOUT', 60)
         )
 
     def init_app(self, app):
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+from cachelib import SimpleCache
+
+# The backend package and the vendored flask_mail live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """The real application, on a throwaway SQLite database and an in-memory cache instead of Redis"""
+    database = tmp_path_factory.mktemp("db") / "quiz_show.sqlite3"
+    os.environ["FLASK_SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database}"
+    from app import app
+    app.config["TESTING"] = True
+    app.extensions["cache"] = {cache: SimpleCache() for cache in app.extensions["cache"]}
+    return app
@@ -0,0 +1,146 @@
+"""TwoTierCache against an in-memory remote and a fake Redis pub/sub client."""
+import queue
+import threading
+import time
+
+from cachelib import SimpleCache
+
+from backend.cache_tiers import LocalLRUCache, TwoTierCache
+
+
+class FakePubSub:
+    def __init__(self, hub):
+        self.hub = hub
+        self.messages = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self.hub.lock:
+            for channel in channels:
+                self.hub.subscribers.setdefault(channel, []).append(self.messages)
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
+
+
+class FakeRedis:
+    """Just enough of redis-py for cross-worker invalidation"""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def pubsub(self, ignore_subscribe_messages=True):
+        return FakePubSub(self)
+
+    def publish(self, channel, message):
+        with self.lock:
+            queues = list(self.subscribers.get(channel, ()))
+        for q in queues:
+            q.put({"type": "message", "channel": channel, "data": message.encode("utf-8")})
+        return len(queues)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def workers(count=2, **kwargs):
+    remote = SimpleCache()
+    client = FakeRedis()
+    caches = [TwoTierCache(remote, redis_client=client, **kwargs) for _ in range(count)]
+    for cache in caches:
+        cache.get("view/warmup")
+    wait_for(lambda: all(cache.invalidation_mode == "pubsub" for cache in caches))
+    return remote, caches
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LocalLRUCache(max_entries=2)
+    lru.set("a", b"1", 60)
+    lru.set("b", b"2", 60)
+    lru.get("a")
+    lru.set("c", b"3", 60)
+    assert lru.get("b") is None
+    assert lru.get("a") == b"1"
+    assert lru.get("c") == b"3"
+    assert len(lru) == 2
+
+
+def test_lru_expires_entries():
+    lru = LocalLRUCache()
+    lru.set("a", b"1", 0.01)
+    time.sleep(0.02)
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_local_tier_bounded_and_falls_back_to_remote():
+    remote, (cache,) = workers(1, local_max_entries=2)
+    for i in range(3):
+        cache.set(f"view/{i}", i)
+    assert len(cache.local) == 2
+    assert cache.get("view/2") == 2
+    assert cache.counters["local_hits"] == 1
+    # Evicted locally, still served by the remote tier
+    assert cache.get("view/0") == 0
+    assert cache.counters["remote_hits"] == 1
+
+
+def test_only_configured_prefixes_are_held_locally():
+    remote, (cache,) = workers(1)
+    cache.set("session/1", "x")
+    assert len(cache.local) == 0
+    assert cache.get("session/1") == "x"
+
+
+def test_writes_invalidate_other_workers():
+    remote, (a, b) = workers()
+    a.set("view/catalog", "v1")
+    assert b.get("view/catalog") == "v1"
+    assert b.local.get("view/catalog") is not None
+
+    a.set("view/catalog", "v2")
+    wait_for(lambda: b.local.get("view/catalog") is None)
+    assert b.get("view/catalog") == "v2"
+    assert a.counters["invalidations_sent"] >= 2
+    assert b.counters["invalidations_received"] >= 1
+
+
+def test_delete_inc_and_clear_invalidate_other_workers():
+    remote, (a, b) = workers()
+    a.set("version/quiz", 1)
+    assert b.get("version/quiz") == 1
+
+    a.inc("version/quiz")
+    wait_for(lambda: b.local.get("version/quiz") is None)
+    assert b.get("version/quiz") == 2
+
+    a.delete("version/quiz")
+    wait_for(lambda: b.local.get("version/quiz") is None)
+    assert b.get("version/quiz") is None
+
+    b.set("view/a", 1)
+    assert a.get("view/a") == 1
+    b.clear()
+    wait_for(lambda: len(a.local) == 0)
+
+
+def test_own_invalidations_are_ignored():
+    remote, (a, b) = workers()
+    a.set("view/page", "x")
+    time.sleep(0.05)
+    assert a.local.get("view/page") is not None
+    assert a.counters["invalidations_received"] == 0
+
+
+def test_versions_poll_without_pubsub():
+    cache = TwoTierCache(SimpleCache(), local_timeout=60, version_poll_interval=0.05)
+    cache.set("version/quiz", 1)
+    cache.remote.set("version/quiz", 2)
+    assert cache.get("version/quiz") == 1
+    time.sleep(0.06)
+    assert cache.get("version/quiz") == 2
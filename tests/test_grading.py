@@ -0,0 +1,46 @@
+"""Answer keys for existing, empty and missing quizzes."""
+from datetime import date
+
+import pytest
+
+from backend.grading import compile_answer_key, get_answer_key, grade_answers
+from backend.models import db, Subject, Chapter, Quiz, Question
+
+
+@pytest.fixture(scope="module")
+def quizzes(app):
+    with app.app_context():
+        chapter = Chapter(name="Light", subject=Subject(name="Grading physics"))
+        graded = Quiz(name="Optics", date_of_quiz=date.today(), time_duration="10 min", chapter=chapter)
+        empty = Quiz(name="Empty", date_of_quiz=date.today(), time_duration="10 min", chapter=chapter)
+        db.session.add_all([graded, empty])
+        db.session.flush()
+        db.session.add_all([
+            Question(quiz_id=graded.id, question_statement="Speed of light?", option1="Slow", option2="Fast",
+                     option3="Still", option4="Unknown", correct_option="option2"),
+            Question(quiz_id=graded.id, question_statement="Colour of the sky?", option1="Blue", option2="Green",
+                     option3="Red", option4="Black", correct_option="Blue"),
+        ])
+        db.session.commit()
+        yield graded.id, empty.id
+
+
+def test_key_holds_every_question(app, quizzes):
+    graded, _ = quizzes
+    with app.app_context():
+        key = get_answer_key(graded)
+        assert [answer.text for answer in key.answers] == ["fast", "blue"]
+        first, second = (answer.question_id for answer in key.answers)
+        assert grade_answers(key, {str(first): "option2", str(second): "blue"}) == 2
+
+
+def test_quiz_without_questions_has_an_empty_key(app, quizzes):
+    _, empty = quizzes
+    with app.app_context():
+        assert compile_answer_key(empty).answers == ()
+
+
+def test_missing_quiz_has_no_key(app):
+    with app.app_context():
+        assert compile_answer_key(999999) is None
+        assert get_answer_key(999999) is None
@@ -0,0 +1,139 @@
+"""deliver_in_batches against an in-process SMTP server."""
+import smtplib
+import socket
+import socketserver
+import threading
+
+import pytest
+from flask import Flask
+from flask_mail import Mail, Message
+
+from backend.mail_delivery import MessageBuildError, deliver_in_batches
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts every message, refuses listed recipients with 550"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                self.reply("550 rejected" if address in server.rejected else "250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with server.lock:
+                    server.messages += 1
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:  # MAIL, RSET, NOOP
+                self.reply("250 OK")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.rejected = set()
+        self.connections = 0
+        self.messages = 0
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_app(port):
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=port,
+        MAIL_DEFAULT_SENDER="quiz@example.com",
+        MAIL_MAX_EMAILS=10,
+        MAIL_SUPPRESS_SEND=False,
+    )
+    return app, Mail(app)
+
+
+def reminder(address):
+    return Message("Daily Quiz Reminder", recipients=[address], body="Time for today's quiz")
+
+
+def addresses(count):
+    return [f"student{i}@example.com" for i in range(count)]
+
+
+def test_every_message_sent_over_one_connection_per_batch(smtp_server):
+    app, mail = make_app(smtp_server.server_address[1])
+
+    sent, failures = deliver_in_batches(app, mail, addresses(25), reminder, workers=2)
+
+    assert sent == 25
+    assert failures == []
+    assert smtp_server.messages == 25
+    assert smtp_server.connections == 3
+
+
+def test_rejected_recipients_fail_without_stopping_the_batch(smtp_server):
+    app, mail = make_app(smtp_server.server_address[1])
+    smtp_server.rejected = {"student3@example.com", "student11@example.com"}
+
+    sent, failures = deliver_in_batches(app, mail, addresses(15), reminder)
+
+    assert sent == 13
+    assert sorted(item for item, _ in failures) == sorted(smtp_server.rejected)
+    assert all(isinstance(error, smtplib.SMTPRecipientsRefused) for _, error in failures)
+    assert smtp_server.messages == 13
+
+
+def test_message_that_cannot_be_built_fails_alone(smtp_server):
+    app, mail = make_app(smtp_server.server_address[1])
+
+    def build(address):
+        if address == "student4@example.com":
+            raise ValueError("bad template context")
+        return reminder(address)
+
+    sent, failures = deliver_in_batches(app, mail, addresses(8), build)
+
+    assert sent == 7
+    assert [item for item, _ in failures] == ["student4@example.com"]
+    assert isinstance(failures[0][1], MessageBuildError)
+
+
+def test_unreachable_server_fails_every_item():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    app, mail = make_app(port)
+
+    sent, failures = deliver_in_batches(app, mail, addresses(12), reminder)
+
+    assert sent == 0
+    assert sorted(item for item, _ in failures) == sorted(addresses(12))
@@ -0,0 +1,52 @@
+"""Form submissions of a quiz at POST /quiz/<quiz_id>/<user_id>."""
+from datetime import date
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from backend.models import db, Subject, Chapter, Quiz, Question, Score, ScoreSubmission, UserQuizStats, User_Info
+
+
+@pytest.fixture(scope="module")
+def student(app):
+    with app.app_context():
+        user = User_Info(email="submitter@example.com", password=generate_password_hash("pw"), role=1,
+                         full_name="Sub Mitter", address="", pin_code=0)
+        chapter = Chapter(name="Waves", subject=Subject(name="Submission physics"))
+        quiz = Quiz(name="Sound", date_of_quiz=date.today(), time_duration="10 min", chapter=chapter)
+        db.session.add_all([user, quiz])
+        db.session.flush()
+        question = Question(quiz_id=quiz.id, question_statement="Sound travels through?", option1="Vacuum",
+                            option2="Air", option3="Nothing", option4="Light", correct_option="option2")
+        db.session.add(question)
+        db.session.commit()
+        return user.id, quiz.id, question.id
+
+
+def rows(user_id):
+    return [
+        model.query.filter_by(user_id=user_id).count()
+        for model in (Score, ScoreSubmission, UserQuizStats)
+    ]
+
+
+def test_submission_is_graded_and_recorded(app, student):
+    user_id, quiz_id, question_id = student
+    response = app.test_client().post(f"/quiz/{quiz_id}/{user_id}", data={f"question_{question_id}": "Air"})
+
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith(f"/quiz_results/{quiz_id}/{user_id}/1/1")
+    with app.app_context():
+        assert rows(user_id) == [1, 1, 1]
+
+
+def test_missing_quiz_is_not_found_and_records_nothing(app, student):
+    user_id = student[0]
+    with app.app_context():
+        before = rows(user_id)
+
+    response = app.test_client().post(f"/quiz/999999/{user_id}", data={"question_1": "Air"})
+
+    assert response.status_code == 404
+    with app.app_context():
+        assert rows(user_id) == before
@@ -0,0 +1,45 @@
+"""GET /api/subjects?search= through the registered route, cache included."""
+import pytest
+
+from backend.controllers import create_jwt_token
+from backend.models import db, Subject, User_Info
+
+
+@pytest.fixture(scope="module")
+def client(app):
+    with app.app_context():
+        db.session.add_all([
+            Subject(name="Zoology", description="Animals and their habitats"),
+            Subject(name="Physics", description="Waves, optics and motion"),
+            Subject(name="Organic Chemistry", description="Reactions of carbon compounds"),
+        ])
+        db.session.commit()
+        token = create_jwt_token(User_Info.query.filter_by(role=0).first())
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return client
+
+
+def names(response):
+    assert response.status_code == 200
+    return [subject["name"] for subject in response.get_json()]
+
+
+def test_search_returns_only_matching_subjects(client):
+    assert names(client.get("/api/subjects?search=zoo")) == ["Zoology"]
+
+
+def test_different_searches_are_cached_separately(client):
+    assert names(client.get("/api/subjects?search=waves")) == ["Physics"]
+    assert names(client.get("/api/subjects?search=carbon")) == ["Organic Chemistry"]
+    # Repeated, so the second answers come from the cache
+    assert names(client.get("/api/subjects?search=waves")) == ["Physics"]
+    assert names(client.get("/api/subjects?search=carbon")) == ["Organic Chemistry"]
+
+
+def test_without_search_lists_every_subject(client):
+    assert {"Zoology", "Physics", "Organic Chemistry"} <= set(names(client.get("/api/subjects")))
+
+
+def test_search_needs_a_token(app):
+    assert app.test_client().get("/api/subjects?search=zoo").status_code == 401